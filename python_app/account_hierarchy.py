@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from collections import Counter
+from typing import Any, Iterable
+
+import numpy as np
+
+from money import CENTS, TOLERANCE_CENTS, cents_array, from_cents, to_cents
+
+AMOUNT_FIELDS = ("sid", "sia", "cargos", "abonos", "sfd", "sfa")
+ROOT_KEY = ""
+
+
+def _is_zero_segment(segment: str) -> bool:
+    s = str(segment or "").strip()
+    return bool(s) and all(ch == "0" for ch in s)
+
+
+def _significant_len(segments: list[str]) -> int:
+    n = len(segments)
+    while n > 0 and _is_zero_segment(segments[n - 1]):
+        n -= 1
+    return n
+
+
+def summary_flags(rows: list[dict[str, Any]], extra_codes: Iterable[str] = ()) -> list[bool]:
+    """Marca las sumatorias CONTPAQi (`xxx-000-000`, `xxx-yyy-000`, `000-000-*`) en O(n).
+
+    Una linea con segmentos finales a cero es sumatoria si existe otra cuenta bajo su prefijo;
+    `extra_codes` son cuentas que existen pero no estan en `rows` (lineas a cero podadas).
+    """
+    codes = [str(r.get("code", "")).strip() for r in rows]
+    all_codes = [*codes, *(str(c).strip() for c in extra_codes)]
+    code_counts = Counter(all_codes)
+    prefix_counts: Counter[str] = Counter()
+    for code in all_codes:
+        if not code:
+            continue
+        segments = code.split("-")
+        for ln in range(1, len(segments)):
+            prefix_counts["-".join(segments[:ln]) + "-"] += 1
+
+    flags: list[bool] = []
+    for code in codes:
+        if not code:
+            flags.append(False)
+            continue
+        if code.startswith("000-000-"):
+            flags.append(True)
+            continue
+        segments = code.split("-")
+        prefix_len = _significant_len(segments)
+        if prefix_len == len(segments):
+            flags.append(False)
+        elif prefix_len <= 0:
+            flags.append(True)
+        else:
+            prefix = "-".join(segments[:prefix_len]) + "-"
+            flags.append(prefix_counts[prefix] - code_counts[code] > 0)
+    return flags
+
+
+def _node_key(code: str, is_summary: bool) -> str | None:
+    if code.startswith("000-000-"):
+        return None
+    segments = code.split("-")
+    if is_summary:
+        segments = segments[: _significant_len(segments)]
+    return "-".join(segments)
+
+
+def _new_node(key: str, parent: str | None, depth: int) -> dict[str, Any]:
+    return {
+        "key": key,
+        "parent": parent,
+        "depth": depth,
+        "children": [],
+        "rowIds": [],
+        "summaryRowIds": [],
+        "totals": {},
+    }
+
+
+def _ensure_path(nodes: dict[str, dict[str, Any]], key: str) -> dict[str, Any]:
+    node = nodes.get(key)
+    if node is not None:
+        return node
+    segments = key.split("-")
+    parent_key = ROOT_KEY
+    for depth in range(1, len(segments) + 1):
+        current = "-".join(segments[:depth])
+        if current not in nodes:
+            nodes[current] = _new_node(current, parent_key, depth)
+            nodes[parent_key]["children"].append(current)
+        parent_key = current
+    return nodes[key]
+
+
+def _net_cents(row: dict[str, Any], debit: str, credit: str) -> int:
+    return to_cents(row.get(debit)) - to_cents(row.get(credit))
+
+
+def build_account_hierarchy(
+    rows: list[dict[str, Any]],
+    flags: list[bool] | None = None,
+    amounts: np.ndarray | None = None,
+) -> dict[str, Any]:
+    """Arbol de cuentas por segmentos del codigo con subtotales calculados de abajo arriba.
+
+    Las sumatorias cuelgan del nodo de su prefijo significativo y se comparan con la suma de
+    sus cuentas de detalle; las que no cuadran se devuelven en `mismatches`. Los subtotales se
+    acumulan en una matriz int64 de centimos (`amounts`, una fila por linea en el orden de
+    `AMOUNT_FIELDS`; se calcula si no se pasa) y se devuelven en unidades.
+    """
+    flags = summary_flags(rows) if flags is None else flags
+    if amounts is None:
+        amounts = cents_array([[row.get(f) or 0.0 for f in AMOUNT_FIELDS] for row in rows]).reshape(-1, len(AMOUNT_FIELDS))
+    nodes: dict[str, dict[str, Any]] = {ROOT_KEY: _new_node(ROOT_KEY, None, 0)}
+    summaries: list[tuple[dict[str, Any], str]] = []
+    detail_rows: list[int] = []
+    detail_nodes: list[str] = []
+
+    for i, (row, is_summary) in enumerate(zip(rows, flags)):
+        code = str(row.get("code", "")).strip()
+        if not code:
+            continue
+        key = _node_key(code, is_summary)
+        if key is None:
+            continue
+        node = _ensure_path(nodes, key)
+        if is_summary:
+            node["summaryRowIds"].append(row["_rowId"])
+            summaries.append((row, key))
+            continue
+        node["rowIds"].append(row["_rowId"])
+        detail_rows.append(i)
+        detail_nodes.append(key)
+
+    # Indice denso por nodo: suma de las lineas de detalle y propagacion por niveles de profundidad
+    index = {key: i for i, key in enumerate(nodes)}
+    totals = np.zeros((len(nodes), len(AMOUNT_FIELDS)), dtype=np.int64)
+    if detail_rows:
+        np.add.at(totals, np.fromiter((index[k] for k in detail_nodes), dtype=np.intp, count=len(detail_nodes)), amounts[detail_rows])
+    nodes_list = list(nodes.values())
+    parents = np.fromiter((index.get(n["parent"], -1) for n in nodes_list), dtype=np.intp, count=len(nodes_list))
+    depths = np.fromiter((n["depth"] for n in nodes_list), dtype=np.intp, count=len(nodes_list))
+    for depth in range(int(depths.max()), 0, -1):
+        level = np.flatnonzero(depths == depth)
+        np.add.at(totals, parents[level], totals[level])
+
+    mismatches: list[dict[str, Any]] = []
+    for row, key in summaries:
+        sid, sia, cargos, abonos, sfd, sfa = totals[index[key]].tolist()
+        checks = {
+            "saldoInicial": (_net_cents(row, "sid", "sia"), sid - sia),
+            "cargos": (to_cents(row.get("cargos")), cargos),
+            "abonos": (to_cents(row.get("abonos")), abonos),
+            "saldoFinal": (_net_cents(row, "sfd", "sfa"), sfd - sfa),
+        }
+        fields = [name for name, (stated, computed) in checks.items() if abs(stated - computed) > TOLERANCE_CENTS]
+        if fields:
+            stated, computed = checks["saldoFinal"]
+            mismatches.append(
+                {
+                    "_rowId": row["_rowId"],
+                    "code": str(row.get("code", "")).strip(),
+                    "name": row.get("name", ""),
+                    "node": key,
+                    "fields": fields,
+                    "statedSaldo": from_cents(stated),
+                    "childrenSaldo": from_cents(computed),
+                    "differenceSaldo": from_cents(stated - computed),
+                }
+            )
+
+    # Por columnas: listas de float en vez de una lista por nodo
+    columns = [(totals[:, j] / CENTS).tolist() for j in range(len(AMOUNT_FIELDS))]
+    for node, *values in zip(nodes_list, *columns):
+        node["totals"] = dict(zip(AMOUNT_FIELDS, values))
+
+    return {
+        "nodes": nodes,
+        "maxDepth": int(depths.max()),
+        "mismatches": mismatches,
+    }
+
+
+def _node_summary(node: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "key": node["key"],
+        "depth": node["depth"],
+        "childCount": len(node["children"]),
+        "rowIds": node["rowIds"],
+        "summaryRowIds": node["summaryRowIds"],
+        "totals": node["totals"],
+        "saldo": from_cents(_net_cents(node["totals"], "sfd", "sfa")),
+    }
+
+
+def find_node(hierarchy: dict[str, Any], code: str) -> dict[str, Any] | None:
+    nodes = hierarchy["nodes"]
+    safe = str(code or "").strip()
+    if safe in nodes:
+        return nodes[safe]
+    segments = safe.split("-")
+    return nodes.get("-".join(segments[: _significant_len(segments)]))
+
+
+def drill_down(hierarchy: dict[str, Any], code: str = ROOT_KEY) -> dict[str, Any] | None:
+    """Nodo, ruta hasta la raiz e hijos directos de una cuenta; la ruta cuesta O(profundidad)."""
+    node = find_node(hierarchy, code)
+    if node is None:
+        return None
+    nodes = hierarchy["nodes"]
+    path: list[dict[str, Any]] = []
+    current = node
+    while current["parent"] is not None:
+        current = nodes[current["parent"]]
+        if current["key"] != ROOT_KEY:
+            path.append(_node_summary(current))
+    path.reverse()
+    return {
+        "node": _node_summary(node),
+        "path": path,
+        "children": [_node_summary(nodes[k]) for k in node["children"]],
+    }
@@ -0,0 +1,585 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from conversion_engine import can_save, convert_rows, parse_balance, write_conversion_xlsx
+from db import (
+    PeriodConflictError,
+    close_pool,
+    diff_period_versions,
+    init_db,
+    list_period_versions,
+    list_periods,
+    load_period_data,
+    load_period_version,
+    rollback_period,
+    save_account_mappings,
+    save_mapping_rules,
+    save_period_data,
+    search_period_rows,
+)
+from kpis import kpi_trend
+from mapping_store import current_snapshot, reload_snapshot
+from report_pack import write_report_pack
+
+DEFAULT_EXCHANGE_RATE = 0.046
+STREAM_CHUNK_SIZE = 64 * 1024
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _period_label(period: dict[str, Any] | None) -> str:
+    if isinstance(period, dict) and period.get("year") and period.get("month"):
+        try:
+            return f"{int(period['year'])}-{str(int(period['month'])).zfill(2)}"
+        except (TypeError, ValueError):
+            pass
+    return dt.date.today().isoformat()
+
+
+def _timed(fn: Callable[..., Any], *args: Any) -> tuple[Any, float]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def convert_to_json(
+    rows: list[dict[str, Any]],
+    exchange_rate: float,
+    manual_mappings: dict[str, dict[str, str]],
+    period: dict[str, Any] | None,
+    extra: dict[str, Any] | None = None,
+) -> tuple[bytes, dict[str, float]]:
+    conversion, convert_ms = _timed(convert_rows, rows, exchange_rate, manual_mappings, period)
+    payload = {**conversion, **(extra or {})}
+    body, encode_ms = _timed(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    return body, {"convert": convert_ms, "encode": encode_ms}
+
+
+def convert_for_save(
+    rows: list[dict[str, Any]],
+    exchange_rate: float,
+    manual_mappings: dict[str, dict[str, str]],
+    period: dict[str, Any],
+) -> tuple[tuple[bool, bytes], dict[str, float]]:
+    conversion, convert_ms = _timed(convert_rows, rows, exchange_rate, manual_mappings, period)
+    ok, message = can_save(conversion)
+    if ok:
+        payload = {
+            **conversion,
+            "sourceRows": rows,
+            "manualMappings": manual_mappings,
+            "storage": {**period, "exchangeRate": exchange_rate},
+        }
+    else:
+        payload = {
+            "error": f"No se puede guardar: {message}.",
+            "validations": {
+                "analyzedRowCount": conversion["metadata"]["analyzedRowCount"],
+                "unmappedCount": conversion["metadata"]["unmappedCount"],
+                "trialBalanceFinalDifference": conversion["validations"]["trialBalanceFinalDifference"],
+            },
+        }
+    body, encode_ms = _timed(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    return (ok, body), {"convert": convert_ms, "encode": encode_ms}
+
+
+def parse_and_convert_to_json(
+    file_bytes: bytes,
+    all_sheets: bool,
+    exchange_rate: float,
+    period: dict[str, Any] | None,
+    extra: dict[str, Any],
+    prune_zero: bool = False,
+) -> tuple[bytes, dict[str, float]]:
+    # ya estamos en un worker del pool: la lectura de hojas se hace en este mismo proceso
+    parsed, parse_ms = _timed(lambda: parse_balance(file_bytes, all_sheets=all_sheets, workers=1, prune_zero=prune_zero))
+    rows = parsed.rows()
+    conversion, convert_ms = _timed(lambda: convert_rows(rows, exchange_rate, {}, period, pruned_codes=parsed.pruned_codes))
+    payload = {**conversion, "sourceRows": rows, "prunedRows": parsed.pruned_rows(), "skippedSheets": parsed.skipped_sheets, "manualMappings": {}, "storage": extra}
+    body, encode_ms = _timed(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    return body, {"parse": parse_ms, "convert": convert_ms, "encode": encode_ms}
+
+
+def convert_to_xlsx_file(
+    path: str,
+    rows: list[dict[str, Any]],
+    exchange_rate: float,
+    manual_mappings: dict[str, dict[str, str]],
+    period: dict[str, Any] | None,
+) -> tuple[None, dict[str, float]]:
+    conversion, convert_ms = _timed(convert_rows, rows, exchange_rate, manual_mappings, period)
+    _, export_ms = _timed(write_conversion_xlsx, conversion, path)
+    return None, {"convert": convert_ms, "export": export_ms}
+
+
+def kpi_trend_timed(currency: str, ratios: list[dict[str, Any]] | None) -> tuple[dict[str, Any], dict[str, float]]:
+    # los periodos sin cache valida se reconvierten: es trabajo de CPU, va al pool de procesos
+    trend, kpis_ms = _timed(kpi_trend, currency, ratios)
+    return trend, {"kpis": kpis_ms}
+
+
+def report_pack_to_file(
+    path: str,
+    periods: list[tuple[int, int]] | None,
+    currency: str,
+    detail: bool,
+) -> tuple[dict[str, Any], dict[str, float]]:
+    summary, pack_ms = _timed(lambda: write_report_pack(path, periods, currency=currency, detail=detail))
+    return summary, {"pack": pack_ms}
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    cpu_pool: Executor
+    db_pool: Executor
+
+    def initialize(self, cpu_pool: Executor, db_pool: Executor) -> None:
+        self.cpu_pool = cpu_pool
+        self.db_pool = db_pool
+        self._timings: dict[str, float] = {}
+
+    def prepare(self) -> None:
+        self._started = time.perf_counter()
+
+    def set_default_headers(self) -> None:
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+
+    async def run_cpu(self, fn: Callable[..., tuple[Any, dict[str, float]]], *args: Any) -> Any:
+        queued = time.perf_counter()
+        result, timings = await asyncio.get_running_loop().run_in_executor(self.cpu_pool, fn, *args)
+        worker_ms = sum(timings.values())
+        self._timings["queue"] = max(0.0, (time.perf_counter() - queued) * 1000 - worker_ms)
+        self._timings.update(timings)
+        return result
+
+    async def run_db(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.db_pool, lambda: fn(*args, **kwargs))
+        self._timings["db"] = self._timings.get("db", 0.0) + (time.perf_counter() - started) * 1000
+        return result
+
+    def _write_timing_headers(self) -> None:
+        total_ms = (time.perf_counter() - self._started) * 1000
+        metrics = [f"{name};dur={ms:.2f}" for name, ms in self._timings.items()]
+        metrics.append(f"total;dur={total_ms:.2f}")
+        self.set_header("Server-Timing", ", ".join(metrics))
+        self.set_header("X-Response-Time-Ms", f"{total_ms:.2f}")
+
+    def flush(self, include_footers: bool = False) -> Any:
+        if not self._headers_written:
+            self._write_timing_headers()
+        return super().flush(include_footers)
+
+    def json_body(self) -> dict[str, Any]:
+        try:
+            data = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError as exc:
+            raise tornado.web.HTTPError(400, reason="JSON invalido") from exc
+        if not isinstance(data, dict):
+            raise tornado.web.HTTPError(400, reason="JSON invalido")
+        return data
+
+    def send_json(self, payload: Any) -> None:
+        self.finish(json.dumps(payload, ensure_ascii=False))
+
+    def write_error(self, status_code: int, **kwargs: Any) -> None:
+        self.finish(json.dumps({"error": self._reason}, ensure_ascii=False))
+
+    def number(self, value: Any, name: str, default: Any = None, *, integer: bool = False) -> Any:
+        """Numero enviado por el cliente (cuerpo o query); `default` si falta y 400 si no es numerico."""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return default
+        try:
+            number = int(value) if integer else float(value)
+        except (TypeError, ValueError, OverflowError) as exc:
+            raise tornado.web.HTTPError(400, reason=f"'{name}' debe ser {'un entero' if integer else 'numerico'}.") from exc
+        if not integer and not math.isfinite(number):
+            raise tornado.web.HTTPError(400, reason=f"'{name}' debe ser numerico.")
+        return number
+
+    def expected_version(self, data: dict[str, Any]) -> int | None:
+        """Version de la que parten los cambios ('expectedVersion', 0 = periodo nuevo); sin ella no se comprueba."""
+        return self.number(data.get("expectedVersion"), "expectedVersion", integer=True)
+
+    async def send_file(self, path: str, filename: str) -> None:
+        """Envia un xlsx ya escrito en disco por bloques (no se carga entero en memoria)."""
+        self.set_header("Content-Type", XLSX_MIME)
+        self.set_header("Content-Disposition", f"attachment; filename={filename}")
+        self.set_header("Content-Length", str(os.path.getsize(path)))
+        with open(path, "rb") as handle:
+            while chunk := handle.read(STREAM_CHUNK_SIZE):
+                self.write(chunk)
+                await self.flush()
+        self.finish()
+
+    def send_conflict(self, exc: PeriodConflictError) -> None:
+        self.set_status(409)
+        self.send_json({"error": str(exc), "currentVersion": exc.current_version})
+
+    def conversion_args(self, data: dict[str, Any]) -> tuple[list[dict[str, Any]], float, dict[str, Any], dict[str, Any] | None]:
+        rows = data.get("rows") or []
+        if not isinstance(rows, list) or not rows:
+            raise tornado.web.HTTPError(400, reason="Debes enviar filas contables en 'rows'.")
+        exchange_rate = self.number(data.get("exchangeRate") or None, "exchangeRate", DEFAULT_EXCHANGE_RATE)
+        return rows, exchange_rate, data.get("manualMappings") or {}, data.get("period")
+
+
+class HealthHandler(BaseHandler):
+    def get(self) -> None:
+        self.send_json({"ok": True, "service": "pmex-pgc-converter-python", "at": dt.datetime.now().isoformat()})
+
+
+class MappingMetaHandler(BaseHandler):
+    def get(self) -> None:
+        snapshot = current_snapshot()
+        groups: dict[str, int] = {}
+        for value in snapshot.mappings.values():
+            groups[value["grupo"]] = groups.get(value["grupo"], 0) + 1
+        self.send_json(
+            {
+                "version": snapshot.version,
+                "totalMappings": len(snapshot.mappings),
+                "groups": groups,
+                "groupOptions": snapshot.group_options,
+                "subgroupOptions": snapshot.subgroup_options,
+            }
+        )
+
+
+class MappingsHandler(BaseHandler):
+    def get(self) -> None:
+        snapshot = current_snapshot()
+        self.send_json({"version": snapshot.version, "mappings": snapshot.mappings})
+
+    async def post(self) -> None:
+        """`{"mappings": {"601": {...}, "602": null}, "savedBy": ""}`: null da de baja el prefijo."""
+        data = self.json_body()
+        changes = data.get("mappings")
+        if not isinstance(changes, dict) or not changes:
+            raise tornado.web.HTTPError(400, reason="Debes enviar los mapeos a cambiar en 'mappings'.")
+        try:
+            version = await self.run_db(
+                save_account_mappings,
+                {code: m for code, m in changes.items() if m is not None},
+                [code for code, m in changes.items() if m is None],
+                updated_by=str(data.get("savedBy") or self.request.headers.get("X-User", "")),
+                updated_at=dt.datetime.now().isoformat(),
+            )
+        except ValueError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc)) from exc
+        reload_snapshot()
+        self.send_json({"ok": True, "version": version})
+
+
+class MappingRulesHandler(BaseHandler):
+    def get(self) -> None:
+        snapshot = current_snapshot()
+        self.send_json({"version": snapshot.version, "rules": snapshot.rules.rules})
+
+    async def post(self) -> None:
+        """`{"rules": [...], "savedBy": ""}`: el juego completo; las reglas sin `id` son nuevas y las que faltan se borran."""
+        data = self.json_body()
+        rules = data.get("rules")
+        if not isinstance(rules, list) or not all(isinstance(r, dict) for r in rules):
+            raise tornado.web.HTTPError(400, reason="Debes enviar la lista de reglas en 'rules'.")
+        try:
+            version = await self.run_db(
+                save_mapping_rules,
+                rules,
+                updated_by=str(data.get("savedBy") or self.request.headers.get("X-User", "")),
+                updated_at=dt.datetime.now().isoformat(),
+            )
+        except ValueError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc)) from exc
+        reload_snapshot()
+        self.send_json({"ok": True, "version": version})
+
+
+class PeriodsHandler(BaseHandler):
+    async def get(self) -> None:
+        self.send_json({"periods": await self.run_db(list_periods)})
+
+
+class PeriodSearchHandler(BaseHandler):
+    async def get(self) -> None:
+        def query(name: str, **kwargs: Any) -> Any:
+            return self.number(self.get_query_argument(name, ""), name, **kwargs)
+
+        result = await self.run_db(
+            search_period_rows,
+            text=self.get_query_argument("q", ""),
+            code_prefix=self.get_query_argument("code", ""),
+            min_saldo=query("minSaldo"),
+            max_saldo=query("maxSaldo"),
+            limit=max(1, min(query("limit", default=50, integer=True), 500)),
+            offset=max(query("offset", default=0, integer=True), 0),
+        )
+        self.send_json(result)
+
+
+class PeriodHandler(BaseHandler):
+    async def get(self, year: str, month: str) -> None:
+        payload = await self.run_db(load_period_data, int(year), int(month))
+        if not payload:
+            raise tornado.web.HTTPError(404, reason="No existe informacion para ese periodo.")
+        await self.send_period(payload, int(year), int(month))
+
+    async def send_period(self, payload: dict[str, Any], year: int, month: int) -> None:
+        exchange_rate = float(payload["period"]["exchange_rate"] or DEFAULT_EXCHANGE_RATE)
+        body = await self.run_cpu(
+            convert_to_json,
+            payload["rows"],
+            exchange_rate,
+            payload["manualMappings"],
+            {"year": year, "month": month},
+            {"sourceRows": payload["rows"], "manualMappings": payload["manualMappings"], "storage": payload["period"]},
+        )
+        self.finish(body)
+
+
+class PeriodVersionsHandler(BaseHandler):
+    async def get(self, year: str, month: str) -> None:
+        self.send_json({"versions": await self.run_db(list_period_versions, int(year), int(month))})
+
+
+class PeriodVersionHandler(PeriodHandler):
+    async def get(self, year: str, month: str, version: str) -> None:  # type: ignore[override]
+        payload = await self.run_db(load_period_version, int(year), int(month), int(version))
+        if not payload:
+            raise tornado.web.HTTPError(404, reason="No existe esa version del periodo.")
+        await self.send_period(payload, int(year), int(month))
+
+
+class PeriodDiffHandler(BaseHandler):
+    async def get(self, year: str, month: str) -> None:
+        try:
+            from_version = int(self.get_query_argument("from"))
+            to_version = int(self.get_query_argument("to"))
+        except (tornado.web.MissingArgumentError, ValueError) as exc:
+            raise tornado.web.HTTPError(400, reason="Indica las versiones 'from' y 'to'.") from exc
+        self.send_json(await self.run_db(diff_period_versions, int(year), int(month), from_version, to_version))
+
+
+class PeriodRollbackHandler(BaseHandler):
+    async def post(self, year: str, month: str) -> None:
+        data = self.json_body()
+        try:
+            version = await self.run_db(
+                rollback_period,
+                int(year),
+                int(month),
+                self.number(data.get("version"), "version", 0, integer=True),
+                saved_by=str(data.get("savedBy") or self.request.headers.get("X-User", "")),
+                uploaded_at=dt.datetime.now().isoformat(),
+                expected_version=self.expected_version(data),
+            )
+        except PeriodConflictError as exc:
+            self.send_conflict(exc)
+            return
+        except ValueError as exc:
+            raise tornado.web.HTTPError(404, reason=str(exc)) from exc
+        self.send_json({"ok": True, "version": version})
+
+
+class PeriodUploadHandler(BaseHandler):
+    async def post(self) -> None:
+        files = self.request.files.get("file") or []
+        if not files:
+            raise tornado.web.HTTPError(400, reason="No se encontro ningun archivo. Usa el campo 'file'.")
+        year = self.number(self.get_body_argument("year", ""), "year", 0, integer=True)
+        month = self.number(self.get_body_argument("month", ""), "month", 0, integer=True)
+        if not year or not month:
+            raise tornado.web.HTTPError(400, reason="Debes seleccionar mes y anio.")
+        exchange_rate = self.number(self.get_body_argument("exchangeRate", ""), "exchangeRate", DEFAULT_EXCHANGE_RATE)
+        all_sheets = self.get_body_argument("allSheets", "false").lower() in ("1", "true", "yes")
+        prune_zero = self.get_body_argument("pruneZero", "false").lower() in ("1", "true", "yes")
+        storage = {
+            "year": year,
+            "month": month,
+            "exchangeRate": exchange_rate,
+            "filename": files[0]["filename"],
+            "persisted": False,
+        }
+        try:
+            body = await self.run_cpu(
+                parse_and_convert_to_json,
+                files[0]["body"],
+                all_sheets,
+                exchange_rate,
+                {"year": year, "month": month},
+                storage,
+                prune_zero,
+            )
+        except Exception as exc:
+            raise tornado.web.HTTPError(400, reason=f"No se pudo leer el archivo: {exc}") from exc
+        self.finish(body)
+
+
+class PeriodSaveHandler(BaseHandler):
+    async def post(self) -> None:
+        data = self.json_body()
+        period = data.get("period") or {}
+        if not isinstance(period, dict):
+            raise tornado.web.HTTPError(400, reason="'period' debe ser un objeto con 'year' y 'month'.")
+        year = self.number(period.get("year"), "year", 0, integer=True)
+        month = self.number(period.get("month"), "month", 0, integer=True)
+        if not year or not month:
+            raise tornado.web.HTTPError(400, reason="Debes indicar mes y anio del periodo.")
+        rows, exchange_rate, manual_mappings, _ = self.conversion_args(data)
+        expected_version = self.expected_version(data)
+
+        ok, body = await self.run_cpu(convert_for_save, rows, exchange_rate, manual_mappings, {"year": year, "month": month})
+        if not ok:
+            self.set_status(400)
+            self.finish(body)
+            return
+
+        try:
+            version = await self.run_db(
+                save_period_data,
+                year=year,
+                month=month,
+                filename=str(period.get("filename") or "manual-save"),
+                exchange_rate=exchange_rate,
+                rows=rows,
+                manual_mappings=manual_mappings,
+                uploaded_at=dt.datetime.now().isoformat(),
+                saved_by=str(data.get("savedBy") or self.request.headers.get("X-User", "")),
+                expected_version=expected_version,
+            )
+        except PeriodConflictError as exc:
+            self.send_conflict(exc)
+            return
+        self.set_header("X-Period-Version", str(version))
+        self.finish(body)
+
+
+class KpisHandler(BaseHandler):
+    async def get(self) -> None:
+        await self.send_trend(self.get_query_argument("currency", "MXN"), None)
+
+    async def post(self) -> None:
+        """`{"currency": "EUR", "ratios": [{"key", "label", "numerator", "denominator", "unit"}]}`."""
+        data = self.json_body()
+        ratios = data.get("ratios")
+        if ratios is not None and not isinstance(ratios, list):
+            raise tornado.web.HTTPError(400, reason="'ratios' debe ser una lista.")
+        await self.send_trend(str(data.get("currency") or "MXN"), ratios)
+
+    async def send_trend(self, currency: str, ratios: list[dict[str, Any]] | None) -> None:
+        try:
+            trend = await self.run_cpu(kpi_trend_timed, currency, ratios)
+        except ValueError as exc:
+            raise tornado.web.HTTPError(400, reason=str(exc)) from exc
+        self.send_json(trend)
+
+
+class ReportPackHandler(BaseHandler):
+    async def get(self) -> None:
+        """`?periods=2025-01,2025-02&currency=MXN&detail=1`; sin `periods`, todos los guardados."""
+        periods = None
+        if self.get_query_argument("periods", ""):
+            try:
+                periods = [(int(y), int(m)) for y, m in (p.split("-") for p in self.get_query_argument("periods").split(","))]
+            except ValueError as exc:
+                raise tornado.web.HTTPError(400, reason="'periods' son periodos AAAA-MM separados por comas.") from exc
+        currency = self.get_query_argument("currency", "MXN")
+        detail = self.get_query_argument("detail", "1").lower() in ("1", "true", "yes")
+        # El pack se escribe a un fichero temporal en el pool de procesos y se envia por bloques
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            try:
+                summary = await self.run_cpu(report_pack_to_file, path, periods, currency, detail)
+            except ValueError as exc:
+                raise tornado.web.HTTPError(400, reason=str(exc)) from exc
+            if not summary["periods"]:
+                raise tornado.web.HTTPError(404, reason="No hay periodos guardados para el pack.")
+            await self.send_file(path, f"pack_pgc_{summary['periods'][0]}_{summary['periods'][-1]}_{currency}.xlsx")
+        finally:
+            os.unlink(path)
+
+
+class ConvertHandler(BaseHandler):
+    async def post(self) -> None:
+        body = await self.run_cpu(convert_to_json, *self.conversion_args(self.json_body()))
+        self.finish(body)
+
+
+class ExportHandler(BaseHandler):
+    async def post(self) -> None:
+        rows, exchange_rate, manual_mappings, period = self.conversion_args(self.json_body())
+        # Como el pack: el worker escribe el libro en un temporal y aqui se envia desde disco por bloques
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            await self.run_cpu(convert_to_xlsx_file, path, rows, exchange_rate, manual_mappings, period)
+            await self.send_file(path, f"conversion_pgc_{_period_label(period)}.xlsx")
+        finally:
+            os.unlink(path)
+
+
+def make_app(cpu_pool: Executor, db_pool: Executor) -> tornado.web.Application:
+    pools = {"cpu_pool": cpu_pool, "db_pool": db_pool}
+    return tornado.web.Application(
+        [
+            (r"/api/health", HealthHandler, pools),
+            (r"/api/mapping/meta", MappingMetaHandler, pools),
+            (r"/api/mappings", MappingsHandler, pools),
+            (r"/api/mapping-rules", MappingRulesHandler, pools),
+            (r"/api/periods", PeriodsHandler, pools),
+            (r"/api/periods/upload", PeriodUploadHandler, pools),
+            (r"/api/periods/save", PeriodSaveHandler, pools),
+            (r"/api/periods/search", PeriodSearchHandler, pools),
+            (r"/api/periods/(\d{4})/(\d{1,2})", PeriodHandler, pools),
+            (r"/api/periods/(\d{4})/(\d{1,2})/versions", PeriodVersionsHandler, pools),
+            (r"/api/periods/(\d{4})/(\d{1,2})/versions/(\d+)", PeriodVersionHandler, pools),
+            (r"/api/periods/(\d{4})/(\d{1,2})/diff", PeriodDiffHandler, pools),
+            (r"/api/periods/(\d{4})/(\d{1,2})/rollback", PeriodRollbackHandler, pools),
+            (r"/api/kpis", KpisHandler, pools),
+            (r"/api/report-pack", ReportPackHandler, pools),
+            (r"/api/convert", ConvertHandler, pools),
+            (r"/api/export", ExportHandler, pools),
+        ]
+    )
+
+
+async def serve(port: int, workers: int, db_threads: int) -> None:
+    init_db()
+    # spawn: los workers leen la BBDD (KPIs, paquete de informes) y no deben heredar por fork las
+    # conexiones ni los cerrojos de este proceso
+    cpu_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    with cpu_pool, ThreadPoolExecutor(max_workers=db_threads) as db_pool:
+        server = HTTPServer(make_app(cpu_pool, db_pool), max_body_size=200 * 1024 * 1024)
+        server.listen(port)
+        print(f"API Python en http://localhost:{port} ({workers} workers, {db_threads} hilos BBDD)", flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            server.stop()
+            close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="API HTTP del motor de conversion NIF Mexico -> PGC")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--db-threads", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, args.workers, args.db_threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,31 @@ from typing import Any
 import pandas as pd
 import streamlit as st
 
-from conversion_engine import convert_rows, export_conversion_xlsx, parse_workbook
-from db import init_db, list_periods, load_period_data, save_period_data
+from account_hierarchy import drill_down
+from conversion_store import ConversionStore, content_key
+from conversion_engine import can_save, convert_rows, export_conversion_xlsx, parse_balance, restore_pruned
+from db import (
+    PeriodConflictError,
+    build_period_key,
+    diff_period_versions,
+    init_db,
+    list_period_versions,
+    list_periods,
+    load_period_data,
+    load_period_version,
+    period_version,
+    rollback_period,
+    save_account_mappings,
+    save_mapping_rules,
+    save_period_data,
+    save_period_delta,
+    search_period_rows,
+)
+from kpis import cache_period_statements, kpi_trend
+from mapping_store import current_snapshot, reload_snapshot
+from mapping_suggestions import APPLY_MIN_SCORE, suggest_mappings
+from report_pack import export_report_pack
+from period_delta import diff_period_rows
 
 st.set_page_config(page_title="NIF Mexico a PGC Espana", layout="wide")
 init_db()
@@ -28,46 +51,7 @@ MONTHS = {
     12: "Diciembre",
 }
 
-GROUP_OPTIONS = [
-    "Sin clasificar",
-    "Activo No Corriente",
-    "Activo Corriente",
-    "Patrimonio Neto",
-    "Pasivo No Corriente",
-    "Pasivo Corriente",
-    "Ingresos",
-    "Ingresos Financieros",
-    "Gastos",
-    "Gastos Financieros",
-]
-
-SUBGROUP_OPTIONS = [
-    "Sin clasificar",
-    "Efectivo y equivalentes",
-    "Deudores comerciales",
-    "Otros deudores",
-    "Periodificaciones",
-    "Administraciones Publicas",
-    "Inmovilizado material",
-    "Amortizacion acumulada",
-    "Inversiones financieras LP",
-    "Acreedores comerciales",
-    "Otros acreedores",
-    "Deudas empresas grupo CP",
-    "Otros pasivos",
-    "Deudas a LP",
-    "Fondos propios",
-    "Importe neto cifra negocios",
-    "Otros ingresos de explotacion",
-    "Gastos de personal",
-    "Servicios exteriores",
-    "Tributos",
-    "Amortizaciones",
-    "Gastos excepcionales",
-    "Resultado financiero",
-    "Otros resultados",
-]
-
+SEARCH_PAGE_SIZE = 50
 
 st.markdown(
     """
@@ -87,52 +71,245 @@ def fmt(n: float) -> str:
     return f"{n:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
 
+@st.cache_resource
+def get_store() -> ConversionStore:
+    return ConversionStore()
+
+
 def ensure_state() -> None:
     now = dt.date.today()
+    st.session_state.setdefault("session_uid", uuid.uuid4().hex)
     st.session_state.setdefault("period_month", now.month)
     st.session_state.setdefault("period_year", now.year)
     st.session_state.setdefault("exchange_rate", 0.046)
-    st.session_state.setdefault("source_rows", [])
-    st.session_state.setdefault("manual_mappings", {})
-    st.session_state.setdefault("conversion", None)
+    st.session_state.setdefault("source_rows_key", None)
+    st.session_state.setdefault("pruned_rows_key", None)
+    st.session_state.setdefault("manual_mappings_key", None)
+    st.session_state.setdefault("conversion_key", None)
+    st.session_state.setdefault("stored_conversion", None)
+    st.session_state.setdefault("delta", None)
+    st.session_state.setdefault("upload_id", None)
+    st.session_state.setdefault("user_name", "")
+    st.session_state.setdefault("mapping_version", None)
+    st.session_state.setdefault("period_base", None)
+    st.session_state.setdefault("save_conflict", None)
+
+
+def current_period_key() -> str:
+    return build_period_key(int(st.session_state["period_year"]), int(st.session_state["period_month"]))
+
+
+def set_period_base(year: int, month: int, version: int) -> None:
+    """Version del periodo de la que parten los datos en pantalla (bloqueo optimista al guardar)."""
+    st.session_state["period_base"] = (build_period_key(year, month), int(version))
+    st.session_state["save_conflict"] = None
+
+
+def base_version() -> int | None:
+    base = st.session_state["period_base"]
+    return base[1] if base and base[0] == current_period_key() else None
+
+
+def bind_handle(slot: str, key: str | None) -> None:
+    st.session_state[f"{slot}_key"] = key
+    get_store().bind(st.session_state["session_uid"], slot, key)
+
+
+HANDLE_SLOTS = ("source_rows", "pruned_rows", "manual_mappings", "conversion")
+
+
+def load_handle(slot: str) -> Any:
+    """Valor de un asa de la sesion; si el almacen ya no lo tiene (sesion caducada o volcado perdido)
+    se avisa y se para en vez de seguir con datos vacios."""
+    key = st.session_state[f"{slot}_key"]
+    value = get_store().get(key, st.session_state["session_uid"])
+    if key is not None and value is None:
+        for name in HANDLE_SLOTS:
+            st.session_state[f"{name}_key"] = None
+        st.session_state["delta"] = None
+        st.error(
+            "Los datos de esta sesion ya no estan disponibles (sesion caducada o servidor reiniciado). "
+            "Vuelve a cargar el periodo o a subir el archivo."
+        )
+        st.stop()
+    return value
+
+
+def get_source_rows() -> list[dict[str, Any]]:
+    return load_handle("source_rows") or []
+
+
+def set_source_rows(rows: list[dict[str, Any]]) -> None:
+    bind_handle("source_rows", get_store().put(rows))
 
 
-def analyze_current() -> None:
-    rows = st.session_state["source_rows"]
-    mappings = st.session_state["manual_mappings"]
+def get_pruned_rows() -> list[dict[str, Any]]:
+    return load_handle("pruned_rows") or []
+
+
+def set_pruned_rows(rows: list[dict[str, Any]]) -> None:
+    bind_handle("pruned_rows", get_store().put(rows) if rows else None)
+
+
+def get_manual_mappings() -> dict[str, dict[str, Any]]:
+    return load_handle("manual_mappings") or {}
+
+
+def set_manual_mappings(mappings: dict[str, dict[str, Any]]) -> None:
+    bind_handle("manual_mappings", get_store().put(mappings) if mappings else None)
+
+
+def get_conversion() -> dict[str, Any] | None:
+    return load_handle("conversion")
+
+
+def get_stored_conversion(period_key: str) -> dict[str, Any] | None:
+    stored = st.session_state["stored_conversion"]
+    if not stored or stored[0] != period_key:
+        return None
+    return get_store().get(stored[1], st.session_state["session_uid"])
+
+
+def set_stored_conversion(period_key: str, conversion_key: str | None) -> None:
+    st.session_state["stored_conversion"] = (period_key, conversion_key)
+    get_store().bind(st.session_state["session_uid"], "stored_conversion", conversion_key)
+
+
+def analyze_current(previous: dict[str, Any] | None = None, changed_row_ids: set[str] | None = None) -> None:
+    mappings = get_manual_mappings()
     period = {"month": st.session_state["period_month"], "year": st.session_state["period_year"]}
-    st.session_state["conversion"] = convert_rows(rows, st.session_state["exchange_rate"], mappings, period)
-
-
-def can_save(conversion: dict[str, Any] | None) -> tuple[bool, str]:
-    if not conversion:
-        return False, "Sin analisis"
-    analyzed = conversion["metadata"]["analyzedRowCount"]
-    unmapped = conversion["metadata"]["unmappedCount"]
-    trial = abs(conversion["validations"]["trialBalanceFinalDifference"])
-    if analyzed <= 0:
-        return False, "No hay lineas analizadas"
-    if unmapped > 0:
-        return False, "Hay lineas sin mapear"
-    if trial > 0.01:
-        return False, "La balanza final no cuadra"
-    return True, "Listo para guardar"
-
-
-def load_period_action(year: int, month: int) -> None:
-    payload = load_period_data(year, month)
+    rate = st.session_state["exchange_rate"]
+    snapshot = current_snapshot()
+    # Solo entran en la clave los mapeos que usan estas cuentas: editar otros no invalida la conversion
+    used_mappings = snapshot.fingerprint(r.get("code", "") for r in get_source_rows())
+    pruned_key = st.session_state["pruned_rows_key"]
+    mappings_key = st.session_state["manual_mappings_key"]
+    key = content_key("conversion", st.session_state["source_rows_key"], rate, mappings_key, period, used_mappings, pruned_key)
+    st.session_state["mapping_version"] = snapshot.version
+    get_store().get_or_compute(
+        key,
+        lambda: convert_rows(
+            get_source_rows(),
+            rate,
+            mappings,
+            period,
+            previous=previous,
+            changed_row_ids=changed_row_ids,
+            pruned_codes=[r["code"] for r in get_pruned_rows()],
+            snapshot=snapshot,
+        ),
+        st.session_state["session_uid"],
+    )
+    bind_handle("conversion", key)
+
+
+def apply_delta_upload(stored: dict[str, Any], rows: list[dict[str, Any]]) -> None:
+    period_key = current_period_key()
+    previous = get_stored_conversion(period_key)
+    if previous is None:
+        period = {"month": st.session_state["period_month"], "year": st.session_state["period_year"]}
+        rate = float(stored["period"]["exchange_rate"] or 0.046)
+        previous = convert_rows(stored["rows"], rate, stored["manualMappings"], period)
+        set_stored_conversion(period_key, get_store().put(previous))
+
+    delta = diff_period_rows(stored["rows"], stored["manualMappings"], rows)
+    set_source_rows(delta["rows"])
+    set_manual_mappings(delta["manualMappings"])
+    st.session_state["delta"] = {
+        "periodKey": period_key,
+        "changedRowIds": delta["changedRowIds"],
+        "removedRowIds": delta["removedRowIds"],
+        "movedRowIds": delta["movedRowIds"],
+        "report": delta["report"],
+    }
+    analyze_current(previous, delta["changedRowIds"])
+
+
+def load_period_action(year: int, month: int, version: int | None = None) -> None:
+    payload = load_period_data(year, month) if version is None else load_period_version(year, month, version)
     if not payload:
         st.warning("No existe informacion guardada para ese periodo")
         return
-    st.session_state["source_rows"] = payload["rows"]
-    st.session_state["manual_mappings"] = payload["manualMappings"]
+    set_source_rows(payload["rows"])
+    set_pruned_rows([])
+    set_manual_mappings(payload["manualMappings"])
     st.session_state["exchange_rate"] = float(payload["period"]["exchange_rate"] or 0.046)
+    st.session_state["delta"] = None
+    # Una version antigua abierta se guarda sobre la vigente, que es la que hay que comprobar
+    set_period_base(year, month, payload["period"]["version"] if version is None else period_version(year, month))
     analyze_current()
+    set_stored_conversion(build_period_key(year, month), st.session_state["conversion_key"])
+
+
+def cache_saved_statements(version: int) -> None:
+    """Deja cacheados los estados de la version guardada para la pestaña KPIs (si el mapeo no cambio entre medias)."""
+    snapshot = current_snapshot()
+    if snapshot.version != st.session_state["mapping_version"]:
+        return
+    cache_period_statements(
+        int(st.session_state["period_year"]),
+        int(st.session_state["period_month"]),
+        version,
+        get_conversion(),
+        [r["code"] for r in get_source_rows()],
+        snapshot,
+    )
+
+
+def save_current_period(expected_version: int | None, *, full: bool = False) -> None:
+    """Guarda lo que hay en pantalla (en delta si procede) comprobando que el periodo sigue en `expected_version`."""
+    year, month = int(st.session_state["period_year"]), int(st.session_state["period_month"])
+    delta = st.session_state["delta"]
+    try:
+        if delta and delta["periodKey"] == current_period_key() and not full:
+            written = save_period_delta(
+                year=year,
+                month=month,
+                filename="delta-save",
+                exchange_rate=float(st.session_state["exchange_rate"]),
+                rows=get_source_rows(),
+                changed_row_ids=delta["changedRowIds"],
+                removed_row_ids=delta["removedRowIds"],
+                moved_row_ids=delta["movedRowIds"],
+                manual_mappings=get_manual_mappings(),
+                uploaded_at=dt.datetime.now().isoformat(),
+                saved_by=st.session_state["user_name"],
+                expected_version=expected_version,
+            )
+            version = written["version"]
+            message = (
+                f"Periodo guardado (version {version}, delta: {written['rowsWritten']} lineas escritas, "
+                f"{written['rowsDeleted']} eliminadas)"
+            )
+        else:
+            version = save_period_data(
+                year=year,
+                month=month,
+                filename="manual-save",
+                exchange_rate=float(st.session_state["exchange_rate"]),
+                # las lineas a cero podadas solo salen del analisis: el periodo se guarda completo
+                rows=restore_pruned(get_source_rows(), get_pruned_rows()),
+                manual_mappings=get_manual_mappings(),
+                uploaded_at=dt.datetime.now().isoformat(),
+                saved_by=st.session_state["user_name"],
+                expected_version=expected_version,
+            )
+            message = f"Periodo guardado (version {version})"
+    except PeriodConflictError as exc:
+        st.session_state["save_conflict"] = {"periodKey": exc.period_key, "currentVersion": exc.current_version, "message": str(exc)}
+        return
+    st.session_state["delta"] = None
+    set_period_base(year, month, version)
+    cache_saved_statements(version)
+    st.success(message)
+    set_stored_conversion(current_period_key(), st.session_state["conversion_key"])
 
 
 def apply_partidas_changes(edited: pd.DataFrame) -> None:
     new_rows = []
     new_maps: dict[str, dict[str, str]] = {}
+    # la posicion de lectura se conserva para poder reinsertar despues las lineas a cero podadas
+    read_pos = {r["_rowId"]: r["_readPos"] for r in get_source_rows() if "_readPos" in r}
     for _, row in edited.iterrows():
         row_id = str(row.get("_rowId") or f"row-{uuid.uuid4().hex[:8]}")
         code = str(row.get("code", "")).strip()
@@ -142,6 +319,7 @@ def apply_partidas_changes(edited: pd.DataFrame) -> None:
         new_rows.append(
             {
                 "_rowId": row_id,
+                **({"_readPos": read_pos[row_id]} if row_id in read_pos else {}),
                 "_isNew": True,
                 "_excludeFromAnalysis": False,
                 "code": code,
@@ -167,8 +345,9 @@ def apply_partidas_changes(edited: pd.DataFrame) -> None:
                 "subgrupo": subgrupo,
             }
 
-    st.session_state["source_rows"] = new_rows
-    st.session_state["manual_mappings"] = new_maps
+    set_source_rows(new_rows)
+    set_manual_mappings(new_maps)
+    st.session_state["delta"] = None
     analyze_current()
 
 
@@ -197,17 +376,45 @@ with st.sidebar:
         value=float(st.session_state["exchange_rate"]),
         format="%.4f",
     )
+    st.session_state["user_name"] = st.text_input("Usuario (queda en el historial)", value=st.session_state["user_name"])
 
     if st.button("Cargar periodo", use_container_width=True):
         load_period_action(int(st.session_state["period_year"]), int(st.session_state["period_month"]))
 
+    all_sheets = st.checkbox("Leer todas las hojas del libro", value=False)
+    delta_mode = st.checkbox("Modo delta: aplicar solo los cambios sobre el periodo guardado", value=False)
+    prune_zero = st.checkbox("Omitir del analisis las lineas con todos los importes a cero", value=False)
     upload = st.file_uploader("Subir y analizar archivo", type=["xlsx", "xls", "csv"])
-    if upload is not None:
-        rows = parse_workbook(upload.read())
-        st.session_state["source_rows"] = rows
-        st.session_state["manual_mappings"] = {}
-        analyze_current()
-        st.success(f"Archivo analizado: {len(rows)} lineas")
+    if upload is not None and st.session_state["upload_id"] != upload.file_id:
+        st.session_state["upload_id"] = upload.file_id
+        stored = load_period_data(int(st.session_state["period_year"]), int(st.session_state["period_month"])) if delta_mode else None
+        # En modo delta se compara la lectura completa con lo guardado
+        parsed = parse_balance(upload.read(), all_sheets=all_sheets, prune_zero=prune_zero and not stored)
+        rows = parsed.rows()
+        set_pruned_rows(parsed.pruned_rows())
+        year, month = int(st.session_state["period_year"]), int(st.session_state["period_month"])
+        set_period_base(year, month, stored["period"]["version"] if stored else period_version(year, month))
+        if stored:
+            apply_delta_upload(stored, rows)
+        else:
+            if delta_mode:
+                st.warning("No hay periodo guardado para comparar: se analiza el archivo completo")
+            set_source_rows(rows)
+            set_manual_mappings({})
+            st.session_state["delta"] = None
+            analyze_current()
+        pruned_note = f" ({parsed.pruned_count} a cero omitidas)" if parsed.pruned_count else ""
+        st.success(f"Archivo analizado: {len(rows)} lineas{pruned_note}")
+        if parsed.skipped_sheets:
+            st.warning(f"Hojas sin cabecera Cuenta/Nombre ignoradas: {', '.join(parsed.skipped_sheets)}")
+
+    pruned_rows = get_pruned_rows()
+    if pruned_rows:
+        st.caption(f"{len(pruned_rows)} lineas a cero fuera del analisis (se guardan con el periodo)")
+        if st.button(f"Recuperar {len(pruned_rows)} lineas a cero", use_container_width=True):
+            set_source_rows(restore_pruned(get_source_rows(), pruned_rows))
+            set_pruned_rows([])
+            analyze_current()
 
     if st.button("Recalcular", use_container_width=True):
         analyze_current()
@@ -226,7 +433,126 @@ with st.sidebar:
     else:
         st.caption("Sin periodos guardados")
 
-conversion = st.session_state["conversion"]
+    store_metrics = get_store().metrics()
+    session_metrics = store_metrics["sessions"].get(st.session_state["session_uid"], {"bytes": 0})
+    st.caption(
+        f"Memoria de la sesion: {session_metrics['bytes'] / 1024 / 1024:.1f} MB · "
+        f"almacen: {store_metrics['memoryBytes'] / 1024 / 1024:.1f} MB en memoria, "
+        f"{store_metrics['diskBytes'] / 1024 / 1024:.1f} MB en disco"
+    )
+
+with st.expander("Buscar en periodos guardados"):
+    s1, s2, s3, s4 = st.columns(4)
+    search_text = s1.text_input("Nombre o codigo contiene", key="search_text")
+    search_code = s2.text_input("Codigo empieza por (ej. 601-*)", key="search_code")
+    search_min = s3.number_input("Saldo minimo", value=None, format="%.2f", key="search_min")
+    search_max = s4.number_input("Saldo maximo", value=None, format="%.2f", key="search_max")
+    if search_text or search_code or search_min is not None or search_max is not None:
+        search_page = st.number_input("Pagina", min_value=1, value=1, step=1, key="search_page")
+        result = search_period_rows(
+            text=search_text,
+            code_prefix=search_code,
+            min_saldo=search_min,
+            max_saldo=search_max,
+            limit=SEARCH_PAGE_SIZE,
+            offset=(int(search_page) - 1) * SEARCH_PAGE_SIZE,
+        )
+        pages = max(1, -(-result["total"] // SEARCH_PAGE_SIZE))
+        st.caption(f"{result['total']} lineas · pagina {int(search_page)} de {pages}")
+        if result["rows"]:
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {
+                            "Periodo": f"{r['month']:02d}/{r['year']}",
+                            "Cuenta": r["code"],
+                            "Nombre": r["name"],
+                            "Cargos": r["cargos"],
+                            "Abonos": r["abonos"],
+                            "Saldo": r["saldo"],
+                        }
+                        for r in result["rows"]
+                    ]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+with st.expander("Historial del periodo"):
+    h_year, h_month = int(st.session_state["period_year"]), int(st.session_state["period_month"])
+    versions = list_period_versions(h_year, h_month)
+    if not versions:
+        st.caption(f"Sin versiones guardadas de {MONTHS[h_month]} {h_year}")
+    else:
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "Version": v["version"],
+                        "Guardado": v["savedAt"],
+                        "Usuario": v["savedBy"] or "-",
+                        "Archivo": v["filename"],
+                        "TC": v["exchangeRate"],
+                        "Lineas": v["rowCount"],
+                        "Nuevas": v["addedCount"],
+                        "Modificadas": v["changedCount"],
+                        "Eliminadas": v["removedCount"],
+                        "Nota": v["note"],
+                    }
+                    for v in versions
+                ]
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+        numbers = [v["version"] for v in versions]
+        h1, h2 = st.columns(2)
+        from_version = h1.selectbox("Desde version", options=numbers, index=min(1, len(numbers) - 1), key="history_from")
+        to_version = h2.selectbox("Hasta version", options=numbers, index=0, key="history_to")
+        if from_version != to_version:
+            diff = diff_period_versions(h_year, h_month, int(from_version), int(to_version))
+            st.caption(f"{len(diff['added'])} nuevas · {len(diff['changed'])} modificadas · {len(diff['removed'])} eliminadas")
+            changes = [
+                {
+                    "Cambio": "Modificada",
+                    "Cuenta": c["code"],
+                    "Nombre": c["name"],
+                    "Campos": ", ".join(c["fields"]),
+                    "Saldo antes": c["before"]["sfd"] - c["before"]["sfa"],
+                    "Saldo despues": c["after"]["sfd"] - c["after"]["sfa"],
+                }
+                for c in diff["changed"]
+            ]
+            for r in diff["added"]:
+                changes.append({"Cambio": "Nueva", "Cuenta": r["code"], "Nombre": r["name"], "Campos": "", "Saldo antes": 0.0, "Saldo despues": r["sfd"] - r["sfa"]})
+            for r in diff["removed"]:
+                changes.append({"Cambio": "Eliminada", "Cuenta": r["code"], "Nombre": r["name"], "Campos": "", "Saldo antes": r["sfd"] - r["sfa"], "Saldo despues": 0.0})
+            if changes:
+                st.dataframe(pd.DataFrame(changes), use_container_width=True, hide_index=True)
+        r1, r2 = st.columns(2)
+        if r1.button(f"Abrir version {to_version}", use_container_width=True):
+            load_period_action(h_year, h_month, int(to_version))
+        if r2.button(f"Restaurar version {to_version}", disabled=to_version == numbers[0], use_container_width=True):
+            try:
+                restored = rollback_period(
+                    h_year,
+                    h_month,
+                    int(to_version),
+                    saved_by=st.session_state["user_name"],
+                    uploaded_at=dt.datetime.now().isoformat(),
+                    expected_version=int(numbers[0]),
+                )
+            except PeriodConflictError as exc:
+                st.error(str(exc))
+            else:
+                load_period_action(h_year, h_month)
+                st.success(f"Version {to_version} restaurada como version {restored}")
+
+if st.session_state["conversion_key"] and st.session_state["mapping_version"] != current_snapshot().version:
+    # El mapeo cambio (en esta u otra sesion): se recalcula la clave y solo se reconvierte si afecta a estas cuentas
+    analyze_current()
+
+conversion = get_conversion()
 if not conversion:
     st.info("Carga un archivo o selecciona un periodo guardado para empezar")
     st.stop()
@@ -247,19 +573,41 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+delta_info = st.session_state["delta"]
+if delta_info:
+    report = delta_info["report"]
+    st.info(
+        f"Modo delta sobre {delta_info['periodKey']}: {report['unchangedCount']} sin cambios, "
+        f"{len(report['added'])} nuevas, {len(report['changed'])} modificadas, {len(report['removed'])} eliminadas, "
+        f"{report['carriedMappingCount']} mapeos manuales conservados"
+    )
+    with st.expander("Detalle de cambios"):
+        for label, key in (("Modificadas", "changed"), ("Nuevas", "added"), ("Eliminadas", "removed")):
+            if report[key]:
+                st.markdown(f"**{label}**")
+                st.dataframe(pd.DataFrame(report[key]), use_container_width=True, hide_index=True)
+
 act1, act2 = st.columns([1, 1])
 with act1:
     if st.button("Guardar periodo en BBDD", disabled=not ok_save, use_container_width=True):
-        save_period_data(
-            year=int(st.session_state["period_year"]),
-            month=int(st.session_state["period_month"]),
-            filename="manual-save",
-            exchange_rate=float(st.session_state["exchange_rate"]),
-            rows=st.session_state["source_rows"],
-            manual_mappings=st.session_state["manual_mappings"],
-            uploaded_at=dt.datetime.now().isoformat(),
-        )
-        st.success("Periodo guardado")
+        save_current_period(base_version())
+    conflict = st.session_state["save_conflict"]
+    if conflict and conflict["periodKey"] == current_period_key():
+        conflict_box = st.empty()
+        with conflict_box.container():
+            st.error(conflict["message"])
+            c1, c2 = st.columns(2)
+            reload_clicked = c1.button("Cargar version actual", use_container_width=True)
+            # Sobrescribir guarda todas las lineas en pantalla: el delta se calculo contra otra version
+            overwrite_clicked = c2.button("Guardar igualmente (sobrescribir)", disabled=not ok_save, use_container_width=True)
+        if reload_clicked:
+            load_period_action(int(st.session_state["period_year"]), int(st.session_state["period_month"]))
+            st.rerun()
+        if overwrite_clicked:
+            conflict_box.empty()
+            save_current_period(conflict["currentVersion"], full=True)
+            if st.session_state["save_conflict"]:
+                st.error(st.session_state["save_conflict"]["message"])
 
 with act2:
     xbytes = export_conversion_xlsx(conversion)
@@ -271,7 +619,7 @@ with act2:
         use_container_width=True,
     )
 
-tabs = st.tabs(["Partidas", "Mapeo", "Balance", "P&G", "Control"])
+tabs = st.tabs(["Partidas", "Mapeo", "Balance", "P&G", "Estados PGC", "Control", "Mapeo de cuentas", "KPIs"])
 
 with tabs[0]:
     f1, f2 = st.columns([1.2, 2])
@@ -281,8 +629,9 @@ with tabs[0]:
         detail_search = st.text_input("Buscar por cuenta o descripcion")
 
     converted_by_id = {r["_rowId"]: r for r in conversion["convertedData"]}
+    manual_mappings = get_manual_mappings()
     display_rows: list[dict[str, Any]] = []
-    for r in st.session_state["source_rows"]:
+    for r in get_source_rows():
         c = converted_by_id.get(r["_rowId"], {})
         is_summary = bool(c.get("isSummaryLine"))
         is_mapped = c.get("pgcCode") not in (None, "SIN MAPEO")
@@ -299,7 +648,7 @@ with tabs[0]:
             if q not in r["code"].lower() and q not in r["name"].lower():
                 continue
 
-        manual = st.session_state["manual_mappings"].get(r["_rowId"], {})
+        manual = manual_mappings.get(r["_rowId"], {})
         display_rows.append(
             {
                 "_rowId": r["_rowId"],
@@ -341,8 +690,8 @@ with tabs[0]:
                 "estado": st.column_config.TextColumn("Estado", disabled=True),
                 "pgc_asignado": st.column_config.TextColumn("PGC asignado", disabled=True),
                 "nombre_asignado": st.column_config.TextColumn("Nombre asignado", disabled=True),
-                "manual_grupo": st.column_config.SelectboxColumn("Manual Grupo", options=GROUP_OPTIONS),
-                "manual_subgrupo": st.column_config.SelectboxColumn("Manual Subgrupo", options=SUBGROUP_OPTIONS),
+                "manual_grupo": st.column_config.SelectboxColumn("Manual Grupo", options=current_snapshot().group_options),
+                "manual_subgrupo": st.column_config.SelectboxColumn("Manual Subgrupo", options=current_snapshot().subgroup_options),
             },
         )
 
@@ -404,11 +753,260 @@ with tabs[3]:
     st.info(f"Total del periodo: {fmt(conversion['pnl']['resultadoAntesImpuestosMx'])}")
 
 with tabs[4]:
+    statements = conversion["statements"]
+    statement_key = st.selectbox(
+        "Estado",
+        options=list(statements.keys()),
+        format_func=lambda k: statements[k]["title"],
+    )
+    statement = statements[statement_key]
+    if statement["unassigned"]:
+        st.warning(f"Cuentas PGC sin linea en este modelo: {', '.join(statement['unassigned'])}")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "Linea": ("    " * max(line["level"] - 1, 0)) + line["label"],
+                    "Total MXN": line["totalMXN"],
+                    "Total EUR": line["totalEUR"],
+                    "Cuentas": ", ".join(str(item["pgcCode"]) for item in line["items"]),
+                }
+                for line in statement["lines"]
+            ]
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+with tabs[5]:
     st.subheader("Control")
     st.write(f"Dif. balanza inicial: {fmt(conversion['validations']['trialBalanceInitialDifference'])}")
     st.write(f"Dif. balanza final: {fmt(conversion['validations']['trialBalanceFinalDifference'])}")
     st.write(f"Sin mapear: {conversion['metadata']['unmappedCount']}")
 
-    if conversion["validations"]["unmappedRows"]:
+    applied_message = st.session_state.pop("suggestions_applied", None)
+    if applied_message:
+        st.success(applied_message)
+    unmapped_rows = conversion["validations"]["unmappedRows"]
+    if unmapped_rows:
         st.markdown("**Lineas sin mapear**")
-        st.dataframe(pd.DataFrame(conversion["validations"]["unmappedRows"]), use_container_width=True)
+        suggestions = suggest_mappings(unmapped_rows)
+        suggestion_rows = []
+        for r in unmapped_rows:
+            candidates = suggestions.get(r["_rowId"], [])
+            best = candidates[0] if candidates else {}
+            suggestion_rows.append(
+                {
+                    "aplicar": bool(best) and best["score"] >= APPLY_MIN_SCORE,
+                    "_rowId": r["_rowId"],
+                    "code": r["code"],
+                    "name": r["name"],
+                    "saldo": r["saldo"],
+                    "sugerencia_pgc": best.get("pgc", ""),
+                    "sugerencia_nombre": best.get("pgcName", ""),
+                    "sugerencia_grupo": best.get("grupo", ""),
+                    "sugerencia_subgrupo": best.get("subgrupo", ""),
+                    "confianza": best.get("score", 0.0),
+                    "alternativas": " | ".join(f"{c['pgc']} {c['pgcName']}" for c in candidates[1:]),
+                }
+            )
+        st.caption(
+            f"Se marcan las sugerencias con confianza >= {APPLY_MIN_SCORE:.2f}; revisa y marca o desmarca las lineas "
+            "antes de aplicar. Se guardan como mapeo manual de la linea (ganan al prefijo y a las reglas)."
+        )
+        suggestion_df = pd.DataFrame(suggestion_rows)
+        edited_suggestions = st.data_editor(
+            suggestion_df,
+            use_container_width=True,
+            hide_index=True,
+            key=f"suggestions_{st.session_state['conversion_key']}",
+            disabled=[c for c in suggestion_df.columns if c != "aplicar"],
+            column_config={"aplicar": st.column_config.CheckboxColumn("Aplicar"), "_rowId": None},
+        )
+        if st.button("Aplicar sugerencias marcadas"):
+            picked = {r["_rowId"] for r in edited_suggestions.to_dict("records") if r["aplicar"]}
+            # los valores del almacen no se modifican: se guarda un diccionario nuevo
+            new_maps = dict(get_manual_mappings())
+            applied = 0
+            for r in unmapped_rows:
+                candidates = suggestions.get(r["_rowId"], [])
+                if r["_rowId"] in picked and candidates:
+                    best = candidates[0]
+                    new_maps[r["_rowId"]] = {k: best[k] for k in ("pgc", "pgcName", "grupo", "subgrupo")}
+                    applied += 1
+            set_manual_mappings(new_maps)
+            st.session_state["suggestions_applied"] = f"Sugerencia aplicada a {applied} de {len(unmapped_rows)} lineas sin mapear"
+            analyze_current()
+            st.rerun()
+
+    mismatches = conversion["validations"]["summaryMismatches"]
+    st.write(f"Sumatorias que no cuadran con sus cuentas: {len(mismatches)}")
+    if mismatches:
+        st.dataframe(pd.DataFrame(mismatches), use_container_width=True, hide_index=True)
+
+    st.markdown("**Desglose por cuenta**")
+    drill_code = st.text_input("Cuenta (vacio = nivel superior)", key="drill_code")
+    drill = drill_down(conversion["hierarchy"], drill_code)
+    if not drill:
+        st.warning("Cuenta no encontrada en la jerarquia")
+    else:
+        if drill["path"]:
+            st.caption(" > ".join(f"{p['key']} ({fmt(p['saldo'])})" for p in drill["path"]))
+        st.write(f"{drill['node']['key'] or 'Total'} · Saldo {fmt(drill['node']['saldo'])}")
+        if drill["children"]:
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {"Cuenta": c["key"], "Subcuentas": c["childCount"], **c["totals"], "Saldo": c["saldo"]}
+                        for c in drill["children"]
+                    ]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+with tabs[6]:
+    snapshot = current_snapshot()
+    st.caption(
+        f"Version del mapeo {snapshot.version} · {len(snapshot.mappings)} prefijos de cuenta. "
+        "Los cambios se aplican al momento en todas las sesiones; solo se reconvierten los periodos con cuentas afectadas."
+    )
+    mapping_df = pd.DataFrame(
+        [{"prefijo": code, **m} for code, m in snapshot.mappings.items()],
+        columns=["prefijo", "pgc", "pgcName", "grupo", "subgrupo"],
+    )
+    edited_mappings = st.data_editor(
+        mapping_df,
+        num_rows="dynamic",
+        use_container_width=True,
+        hide_index=True,
+        key=f"mapping_editor_{snapshot.version}",
+        column_config={
+            "prefijo": st.column_config.TextColumn("Prefijo cuenta", required=True),
+            "pgc": st.column_config.TextColumn("PGC", required=True),
+            "pgcName": st.column_config.TextColumn("Nombre PGC", required=True),
+            "grupo": st.column_config.SelectboxColumn("Grupo", options=snapshot.group_options, required=True),
+            "subgrupo": st.column_config.TextColumn("Subgrupo", required=True),
+        },
+    )
+    if st.button("Guardar mapeo de cuentas"):
+        edited_map = {
+            str(r["prefijo"] or "").strip(): {k: str(r[k] or "").strip() for k in ("pgc", "pgcName", "grupo", "subgrupo")}
+            for r in edited_mappings.to_dict("records")
+            if str(r["prefijo"] or "").strip()
+        }
+        try:
+            new_version = save_account_mappings(
+                {code: m for code, m in edited_map.items() if snapshot.mappings.get(code) != m},
+                [code for code in snapshot.mappings if code not in edited_map],
+                updated_by=st.session_state["user_name"],
+                updated_at=dt.datetime.now().isoformat(),
+            )
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            reload_snapshot()
+            analyze_current()
+            st.success(f"Mapeo guardado (version {new_version})")
+
+    st.markdown("**Reglas de mapeo**")
+    st.caption(
+        "Rango de cuentas (Desde/Hasta; solo Desde = prefijo) o expresion regular sobre el nombre, opcionalmente "
+        "segun el signo del saldo. Gana la de mayor prioridad y cualquier regla gana al prefijo; el mapeo manual por linea gana a todo."
+    )
+    rule_hits = (get_conversion() or {}).get("metadata", {}).get("mappingRuleHits", {})
+    rule_columns = ["id", "priority", "codeFrom", "codeTo", "namePattern", "sign", "pgc", "pgcName", "grupo", "subgrupo", "note"]
+    rules_df = pd.DataFrame(
+        [{**{k: r[k] for k in rule_columns}, "lineas": rule_hits.get(str(r["id"]))} for r in snapshot.rules.rules],
+        columns=[*rule_columns, "lineas"],
+    )
+    edited_rules = st.data_editor(
+        rules_df,
+        num_rows="dynamic",
+        use_container_width=True,
+        hide_index=True,
+        key=f"rules_editor_{snapshot.version}",
+        disabled=["id", "lineas"],
+        column_config={
+            "id": st.column_config.NumberColumn("Id"),
+            "priority": st.column_config.NumberColumn("Prioridad", step=1, default=0),
+            "codeFrom": st.column_config.TextColumn("Cuenta desde"),
+            "codeTo": st.column_config.TextColumn("Cuenta hasta"),
+            "namePattern": st.column_config.TextColumn("Patron nombre (regex)"),
+            "sign": st.column_config.SelectboxColumn("Signo", options=["", "deudor", "acreedor"], default=""),
+            "pgc": st.column_config.TextColumn("PGC", required=True),
+            "pgcName": st.column_config.TextColumn("Nombre PGC", required=True),
+            "grupo": st.column_config.SelectboxColumn("Grupo", options=snapshot.group_options, required=True),
+            "subgrupo": st.column_config.TextColumn("Subgrupo", required=True),
+            "note": st.column_config.TextColumn("Nota"),
+            "lineas": st.column_config.NumberColumn("Lineas (periodo actual)"),
+        },
+    )
+    if st.button("Guardar reglas de mapeo"):
+        edited_rule_list = []
+        for r in edited_rules.to_dict("records"):
+            rule = {k: (None if pd.isna(r[k]) else r[k]) for k in rule_columns}
+            if any(str(rule[k] or "").strip() for k in ("codeFrom", "namePattern", "pgc")):
+                edited_rule_list.append({**rule, "id": int(rule["id"]) if rule["id"] is not None else None})
+        try:
+            new_version = save_mapping_rules(
+                edited_rule_list, updated_by=st.session_state["user_name"], updated_at=dt.datetime.now().isoformat()
+            )
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            reload_snapshot()
+            analyze_current()
+            st.success(f"Reglas guardadas (version {new_version})")
+
+with tabs[7]:
+    kpi_currency = st.radio("Moneda", ["MXN", "EUR"], horizontal=True, key="kpi_currency")
+    trend = kpi_trend(kpi_currency)
+    if not trend["periods"]:
+        st.caption("Sin periodos guardados")
+    else:
+        kpi_labels = [f"{p['month']:02d}/{p['year']}" for p in trend["periods"]]
+        cache = trend["cache"]
+        st.caption(
+            f"{len(kpi_labels)} periodos guardados · {cache['hit'] + cache['revalidated']} desde cache, "
+            f"{cache['converted']} convertidos ahora. Ratios sobre el Balance y la P&G PGC (modelo normal); "
+            "% en los margenes y rentabilidades."
+        )
+
+        def kpi_table(field: str) -> pd.DataFrame:
+            return pd.DataFrame(
+                [
+                    {"KPI": r["label"], "Unidad": r["unit"], **dict(zip(kpi_labels, r[field]))}
+                    for r in trend["ratios"]
+                ]
+            )
+
+        st.dataframe(kpi_table("values").round(2), use_container_width=True, hide_index=True)
+        st.markdown("**Variacion frente al periodo guardado anterior**")
+        st.dataframe(kpi_table("variations").round(2), use_container_width=True, hide_index=True)
+        kpi_pick = st.selectbox("Evolucion de", options=range(len(trend["ratios"])), format_func=lambda i: trend["ratios"][i]["label"])
+        st.line_chart(pd.Series(trend["ratios"][kpi_pick]["values"], index=kpi_labels, dtype="float64"))
+
+        with st.expander("Pack de informes (xlsx)"):
+            st.caption(
+                "Un libro con los estados PGC, KPIs, balanza PGC y validaciones de cada periodo en columnas "
+                "(con la variacion del ultimo frente al anterior) y, si se pide, el detalle de cada periodo en su hoja."
+            )
+            pack_periods = st.multiselect(
+                "Periodos",
+                options=range(len(kpi_labels)),
+                default=list(range(len(kpi_labels)))[-12:],
+                format_func=lambda i: kpi_labels[i],
+                key="pack_periods",
+            )
+            pack_detail = st.checkbox("Incluir el detalle de cada periodo", value=True, key="pack_detail")
+            if st.button("Generar pack", disabled=not pack_periods):
+                chosen = [trend["periods"][i] for i in sorted(pack_periods)]
+                with st.spinner("Generando pack..."):
+                    pack = export_report_pack([(p["year"], p["month"]) for p in chosen], currency=kpi_currency, detail=pack_detail)
+                st.download_button(
+                    "Descargar pack",
+                    data=pack,
+                    file_name=f"pack_pgc_{chosen[0]['periodKey']}_{chosen[-1]['periodKey']}_{kpi_currency}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
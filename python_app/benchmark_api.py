@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from sample_data import build_synthetic_rows
+
+ENDPOINTS = {
+    "convert": "/api/convert",
+    "export": "/api/export",
+    "periods": "/api/periods",
+}
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _request(url: str, body: bytes | None) -> tuple[float, float, int]:
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"} if body else {})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            resp.read()
+            status = resp.status
+            server_ms = float(resp.headers.get("X-Response-Time-Ms") or 0)
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        status = exc.code
+        server_ms = float(exc.headers.get("X-Response-Time-Ms") or 0)
+    return (time.perf_counter() - started) * 1000, server_ms, status
+
+
+def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/health", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"La API no responde en {base_url}")
+
+
+def run_benchmark(base_url: str, endpoint: str, total: int, concurrency: int, row_count: int) -> dict[str, float]:
+    body = None
+    if endpoint in ("convert", "export"):
+        rows = build_synthetic_rows(row_count, seed=7)
+        body = json.dumps({"rows": rows, "exchangeRate": 0.046, "period": {"year": 2025, "month": 1}}).encode("utf-8")
+    url = f"{base_url}{ENDPOINTS[endpoint]}"
+
+    _request(url, body)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: _request(url, body), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] for r in results]
+    server = [r[1] for r in results]
+    return {
+        "requests": total,
+        "errors": sum(1 for r in results if r[2] >= 400),
+        "throughputRps": total / elapsed if elapsed else 0.0,
+        "p50Ms": _percentile(latencies, 50),
+        "p99Ms": _percentile(latencies, 99),
+        "meanMs": statistics.fmean(latencies),
+        "serverP50Ms": _percentile(server, 50),
+        "serverP99Ms": _percentile(server, 99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga local de la API Python")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="convert")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--spawn", action="store_true", help="Arranca api_server.py con una BBDD temporal")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    server = None
+    tmp = tempfile.TemporaryDirectory()
+    try:
+        if args.spawn:
+            port = args.url.rsplit(":", 1)[-1]
+            env = {**os.environ, "CONTABILIDAD_DB_PATH": str(Path(tmp.name) / "bench.db")}
+            server = subprocess.Popen(
+                [sys.executable, str(Path(__file__).with_name("api_server.py")), "--port", port, "--workers", str(args.workers)],
+                env=env,
+            )
+        _wait_ready(args.url)
+        report = run_benchmark(args.url, args.endpoint, args.requests, args.concurrency, args.rows)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        tmp.cleanup()
+
+    print(f"endpoint={args.endpoint} rows={args.rows} requests={args.requests} concurrency={args.concurrency}")
+    for key, value in report.items():
+        print(f"  {key:>14}: {value:,.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import time
+from typing import Any
+
+import numpy as np
+
+from mapping_rules import CompiledRules
+from money import cents_array
+from sample_data import build_synthetic_rows, temp_database
+
+# Nombres habituales de una balanza: se repiten entre cuentas (la memoria por nombre los evalua una vez)
+NAME_WORDS = ("Bancos", "Caja", "Clientes", "Proveedores", "Honorarios", "Arrendamiento", "Sueldos", "IVA", "ISR", "Intereses")
+NAME_SUFFIXES = ("nacionales", "extranjeros", "BBVA", "Santander", "por pagar", "por cobrar", "acreditable", "retenido")
+
+
+def build_rules(roots: list[str], count: int, rnd: random.Random, name_every: int) -> list[dict[str, Any]]:
+    """Juego tipico: sobre todo rangos de raices y prefijos de subcuenta, algunas reglas por signo y
+    pocos patrones de nombre (uno de cada `name_every`)."""
+    mapping = {"pgc": "629", "pgcName": "Otros servicios", "grupo": "Gastos", "subgrupo": "Otros gastos de explotacion"}
+    rules: list[dict[str, Any]] = []
+    for i in range(count):
+        kind = 3 if i % name_every == name_every - 1 else i % 3
+        if kind == 0:
+            low, high = sorted(rnd.sample(roots, 2))
+            rule = {"codeFrom": low, "codeTo": high}
+        elif kind == 1:
+            rule = {"codeFrom": f"{rnd.choice(roots)}-{rnd.randint(1, 40):03d}"}
+        elif kind == 2:
+            rule = {"codeFrom": rnd.choice(roots), "sign": rnd.choice(("deudor", "acreedor"))}
+        else:
+            rule = {"namePattern": rf"\b{rnd.choice(NAME_WORDS)}\b.*{rnd.choice(NAME_SUFFIXES)}", "sign": rnd.choice(("", "acreedor"))}
+        rules.append({"id": i + 1, "priority": rnd.randint(0, 5), **rule, **mapping, "pgc": str(600 + i)})
+    return rules
+
+
+def naive_ranks(compiled: Any, codes: list[str], names: list[str], saldos: np.ndarray) -> np.ndarray:
+    """Referencia: cada linea recorre las reglas en orden de prioridad hasta la primera que aplica."""
+    checks = []
+    for r in compiled.rules:
+        pattern = re.compile(r["namePattern"], re.IGNORECASE | re.DOTALL) if r["namePattern"] else None
+        checks.append((r["codeFrom"], r["codeTo"] + ".", pattern, r["sign"]))
+    out = np.full(len(codes), compiled.none, dtype=np.int32)
+    for i, (code, name, saldo) in enumerate(zip(codes, names, saldos.tolist())):
+        sign = "deudor" if saldo > 0 else "acreedor" if saldo < 0 else "cero"
+        for rank, (low, high, pattern, rule_sign) in enumerate(checks):
+            if rule_sign and rule_sign != sign:
+                continue
+            if (pattern.search(name) is not None) if pattern is not None else low <= code < high:
+                out[i] = rank
+                break
+    return out
+
+
+def _ns_per_row(seconds: float, rows: int) -> float:
+    return seconds / rows * 1e9 if rows else 0.0
+
+
+def run(rows: int, rule_count: int, name_every: int, unique_names: bool, naive: bool) -> None:
+    rnd = random.Random(7)
+    lines = build_synthetic_rows(rows, seed=7)
+    codes = [r["code"] for r in lines]
+    names = [r["name"] if unique_names else f"{rnd.choice(NAME_WORDS)} {rnd.choice(NAME_SUFFIXES)}" for r in lines]
+    amounts = cents_array(np.array([[r["sfd"], r["sfa"]] for r in lines], dtype=np.float64))
+    saldos = amounts[:, 0] - amounts[:, 1]
+    roots = sorted({c.split("-")[0] for c in codes})
+    rules = build_rules(roots, rule_count, rnd, name_every)
+
+    started = time.perf_counter()
+    compiled = CompiledRules(rules)
+    compile_s = time.perf_counter() - started
+    started = time.perf_counter()
+    ranks = compiled.evaluate(codes, names, saldos)
+    cold_s = time.perf_counter() - started
+    started = time.perf_counter()
+    again = compiled.evaluate(codes, names, saldos)
+    warm_s = time.perf_counter() - started
+    assert (ranks == again).all()
+
+    hits = compiled.hit_counts(ranks)
+    print(
+        f"{len(codes)} lineas, {len(compiled)} reglas ({len(compiled.name_rules)} de nombre, "
+        f"{len(compiled.points)} limites de intervalo), nombres {'unicos' if unique_names else 'repetidos'}"
+    )
+    print(f"  compilar                 {compile_s * 1000:9.1f} ms")
+    print(f"  evaluar (en frio)        {cold_s * 1000:9.1f} ms  {_ns_per_row(cold_s, len(codes)):8.0f} ns/linea")
+    print(f"  evaluar (nombres vistos) {warm_s * 1000:9.1f} ms  {_ns_per_row(warm_s, len(codes)):8.0f} ns/linea")
+    print(f"  lineas con regla {sum(hits.values())}, reglas sin aciertos {sum(1 for v in hits.values() if not v)}")
+    if naive:
+        started = time.perf_counter()
+        reference = naive_ranks(compiled, codes, names, saldos)
+        naive_s = time.perf_counter() - started
+        print(f"  regla a regla            {naive_s * 1000:9.1f} ms  {_ns_per_row(naive_s, len(codes)):8.0f} ns/linea")
+        if not (reference == ranks).all():
+            raise SystemExit(f"{int((reference != ranks).sum())} lineas con distinta regla que la evaluacion regla a regla")
+        print("  mismas reglas ganadoras que la evaluacion regla a regla")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste por linea de las reglas de mapeo compiladas")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--name-every", type=int, default=10, help="una regla de nombre de cada N (1 = todas)")
+    parser.add_argument("--unique-names", action="store_true", help="un nombre distinto por cuenta (sin reutilizar la memoria)")
+    parser.add_argument("--no-naive", action="store_true", help="no comparar con la evaluacion regla a regla")
+    args = parser.parse_args()
+
+    with temp_database():
+        run(args.rows, args.rules, max(1, args.name_every), args.unique_names, not args.no_naive)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from decimal import Decimal
+from typing import Any, Callable
+
+import numpy as np
+
+from conversion_engine import AMOUNT_FIELDS, convert_rows
+from money import cents_array, from_cents
+from sample_data import build_synthetic_rows
+
+
+def _median_time(fn: Callable[[], Any], repeat: int) -> tuple[Any, float]:
+    times: list[float] = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def float_sums(rows: list[dict[str, Any]]) -> tuple[list[float], dict[str, float]]:
+    """Camino anterior: sumas de float en Python por campo y por cuenta."""
+    totals = [sum(r[f] for r in rows) for f in AMOUNT_FIELDS]
+    by_code: dict[str, float] = {}
+    for r in rows:
+        key = r["code"][:3]
+        by_code[key] = by_code.get(key, 0.0) + (r["sfd"] - r["sfa"])
+    return totals, by_code
+
+
+def cents_sums(rows: list[dict[str, Any]]) -> tuple[list[int], dict[str, int]]:
+    """Camino actual: matriz int64 de centimos, suma por columnas y np.add.at por cuenta."""
+    raw = np.fromiter((r[f] for r in rows for f in AMOUNT_FIELDS), dtype=np.float64, count=len(rows) * len(AMOUNT_FIELDS))
+    amounts = cents_array(raw).reshape(-1, len(AMOUNT_FIELDS))
+    keys: dict[str, int] = {}
+    ids = np.fromiter((keys.setdefault(r["code"][:3], len(keys)) for r in rows), dtype=np.intp, count=len(rows))
+    by_id = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(by_id, ids, amounts[:, 4] - amounts[:, 5])
+    return amounts.sum(axis=0).tolist(), {key: int(by_id[i]) for key, i in keys.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sumas en float vs centimos enteros")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = build_synthetic_rows(args.rows, seed=11)
+    (float_totals, _), float_s = _median_time(lambda: float_sums(rows), args.repeat)
+    (cents_totals, _), cents_s = _median_time(lambda: cents_sums(rows), args.repeat)
+    exact = [sum(Decimal(str(r[f])) for r in rows) for f in AMOUNT_FIELDS]
+    conversion, convert_s = _median_time(lambda: convert_rows(rows), max(1, args.repeat // 2))
+
+    print(f"{args.rows} lineas, mediana de {args.repeat} repeticiones")
+    print(f"  sumas float      {float_s * 1000:9.1f} ms")
+    print(f"  sumas centimos   {cents_s * 1000:9.1f} ms  (x{float_s / cents_s if cents_s else 0:.2f})")
+    print(f"  convert_rows     {convert_s * 1000:9.1f} ms")
+    for f, flt, cts, ref in zip(AMOUNT_FIELDS, float_totals, cents_totals, exact):
+        print(f"  {f:>7}: error float {abs(Decimal(flt) - ref):.3e}  centimos exactos {'si' if Decimal(cts) / 100 == ref else 'NO'}")
+    diff = conversion["validations"]["trialBalanceFinalDifferenceCents"]
+    print(f"  dif. balanza final: {from_cents(diff):.2f} (centimos {diff}); float {float_totals[4] - float_totals[5]:.3e}")
+
+
+if __name__ == "__main__":
+    main()
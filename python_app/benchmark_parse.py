@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import argparse
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+from conversion_engine import convert_rows, parse_balance, parse_workbook
+from sample_data import build_synthetic_rows, build_synthetic_workbook
+
+
+def _timed_parse(file_bytes: bytes, all_sheets: bool, workers: int) -> tuple[list, float]:
+    started = time.perf_counter()
+    rows = parse_workbook(file_bytes, all_sheets=all_sheets, workers=workers)
+    return rows, time.perf_counter() - started
+
+
+def _timed(fn: Callable[[], Any]) -> tuple[Any, float]:
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def _retained_mb(fn: Callable[[], Any]) -> float:
+    """Memoria que sigue ocupando el resultado de `fn` (aparte, porque tracemalloc ralentiza)."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current / 1e6
+
+
+def _report_pruning(data: bytes) -> None:
+    """Lectura completa en dicts vs columnas con las lineas a cero podadas, hasta la conversion."""
+    full, full_parse_s = _timed(lambda: parse_balance(data, all_sheets=True, workers=1).rows())
+    parsed, compact_s = _timed(lambda: parse_balance(data, all_sheets=True, workers=1, prune_zero=True))
+    rows, dicts_s = _timed(parsed.rows)
+    _, full_convert_s = _timed(lambda: convert_rows(full))
+    _, pruned_convert_s = _timed(lambda: convert_rows(rows, pruned_codes=parsed.pruned_codes))
+    full_mb = _retained_mb(lambda: parse_balance(data, all_sheets=True, workers=1).rows())
+    compact_mb = _retained_mb(lambda: parse_balance(data, all_sheets=True, workers=1, prune_zero=True))
+    pruned_mb = _retained_mb(lambda: parse_balance(data, all_sheets=True, workers=1, prune_zero=True).rows())
+
+    share = parsed.pruned_count / len(full) * 100 if full else 0.0
+    print(f"  lineas a cero   {parsed.pruned_count:8d}  ({share:.0f}%)")
+    print(f"  dicts completos {full_parse_s:8.2f} s  {full_mb:8.1f} MB  convert {full_convert_s:6.2f} s")
+    print(f"  columnas        {compact_s:8.2f} s  {compact_mb:8.1f} MB")
+    print(f"  podadas (dicts) {compact_s + dicts_s:8.2f} s  {pruned_mb:8.1f} MB  convert {pruned_convert_s:6.2f} s")
+    print(f"  recuperables    {'si' if parsed.rows(include_pruned=True) == full else 'NO'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lectura secuencial vs paralela de balanzas y poda de lineas a cero")
+    parser.add_argument("files", nargs="*", type=Path, help="xlsx/csv reales; sin ficheros se genera un libro sintetico")
+    parser.add_argument("--sheets", type=int, default=4)
+    parser.add_argument("--rows-per-sheet", type=int, default=25_000)
+    parser.add_argument("--zero-ratio", type=float, default=0.4, help="proporcion de cuentas a cero en el libro sintetico")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    inputs: list[tuple[str, bytes]] = [(str(p), p.read_bytes()) for p in args.files]
+    if not inputs:
+        sheets = {
+            f"Entidad{i+1}": build_synthetic_rows(args.rows_per_sheet, seed=i, zero_ratio=args.zero_ratio) for i in range(args.sheets)
+        }
+        inputs.append((f"sintetico {args.sheets}x{args.rows_per_sheet}", build_synthetic_workbook(sheets)))
+
+    for label, data in inputs:
+        sequential, seq_s = _timed_parse(data, True, 1)
+        parallel, par_s = _timed_parse(data, True, args.workers)
+        print(f"{label}: {len(sequential)} lineas, {len(data) / 1e6:.1f} MB")
+        print(f"  secuencial      {seq_s:8.2f} s")
+        print(f"  {args.workers:>2} workers      {par_s:8.2f} s  (x{seq_s / par_s if par_s else 0:.2f})")
+        print(f"  identico        {'si' if sequential == parallel else 'NO'}")
+        _report_pruning(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+from conversion_engine import convert_rows
+from db import init_db, load_period_data, save_period_data
+from report_pack import write_report_pack
+from sample_data import build_synthetic_rows, temp_database
+
+
+def _peak_mb(fn: Callable[[], Any]) -> tuple[Any, float, float]:
+    """Resultado, segundos y pico de memoria de Python (MB) durante `fn` (tracemalloc alarga los tiempos)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def run(months: int, rows: int, out_dir: Path, naive: bool) -> None:
+    init_db()
+    started = time.perf_counter()
+    for month in range(1, months + 1):
+        save_period_data(
+            year=2025,
+            month=month,
+            filename="benchmark",
+            exchange_rate=0.046,
+            rows=build_synthetic_rows(rows, seed=month, unmapped_ratio=0.02),
+            manual_mappings={},
+            uploaded_at=dt.datetime.now().isoformat(),
+        )
+    print(f"{months} periodos x {rows} lineas guardados en {time.perf_counter() - started:.1f} s")
+
+    def one_period() -> int:
+        payload = load_period_data(2025, 1)
+        return len(convert_rows(payload["rows"], 0.046, payload["manualMappings"], {"year": 2025, "month": 1})["convertedData"])
+
+    _, one_s, one_mb = _peak_mb(one_period)
+    print(f"  1 periodo (carga + conversion)   {one_s:8.1f} s  pico {one_mb:8.1f} MB")
+
+    pack_path = out_dir / "pack.xlsx"
+    summary, pack_s, pack_mb = _peak_mb(lambda: write_report_pack(pack_path, detail=True))
+    print(
+        f"  pack con detalle                 {pack_s:8.1f} s  pico {pack_mb:8.1f} MB  "
+        f"({len(summary['sheets'])} hojas, {summary['detailRows']} lineas, {pack_path.stat().st_size / 1e6:.1f} MB)"
+    )
+    _, light_s, light_mb = _peak_mb(lambda: write_report_pack(out_dir / "pack_comparativo.xlsx", detail=False))
+    print(f"  pack solo comparativo (cache)    {light_s:8.1f} s  pico {light_mb:8.1f} MB")
+
+    if naive:
+        # Lo de antes: todas las conversiones en memoria y un export por periodo
+        from conversion_engine import export_conversion_xlsx
+
+        def all_in_memory() -> int:
+            conversions = []
+            for month in range(1, months + 1):
+                payload = load_period_data(2025, month)
+                conversions.append(convert_rows(payload["rows"], 0.046, payload["manualMappings"], {"year": 2025, "month": month}))
+            return sum(len(export_conversion_xlsx(c)) for c in conversions)
+
+        _, naive_s, naive_mb = _peak_mb(all_in_memory)
+        print(f"  conversiones en memoria + export {naive_s:8.1f} s  pico {naive_mb:8.1f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pack de informes multiperiodo: tiempo y pico de memoria")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--rows", type=int, default=50_000, help="lineas por periodo")
+    parser.add_argument("--naive", action="store_true", help="comparar con todas las conversiones en memoria")
+    args = parser.parse_args()
+
+    with temp_database() as tmp:
+        run(args.months, args.rows, tmp, args.naive)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,31 @@
 from __future__ import annotations
 
+import csv
 import io
-import json
-import math
-from copy import deepcopy
-from dataclasses import dataclass
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Iterable, Sequence
 
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 
+from account_hierarchy import build_account_hierarchy, summary_flags
+from mapping_store import MappingSnapshot, current_snapshot
+from money import CENTS, TOLERANCE_CENTS, cents_array, eur_cents, from_cents, parse_cents, to_cents
+from statement_layouts import LEGACY_KEYS, build_statements, line_map
+
 BASE_DIR = Path(__file__).resolve().parent
-MAPPING_FILE = BASE_DIR / "account_mapping.json"
-
-with MAPPING_FILE.open("r", encoding="utf-8") as f:
-    ACCOUNT_MAPPING: dict[str, dict[str, str]] = json.load(f)
-
-BALANCE_GROUPS_TEMPLATE = {
-    "Activo No Corriente": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Activo Corriente": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Patrimonio Neto": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Pasivo No Corriente": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Pasivo Corriente": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-}
-
-PNL_SECTIONS_TEMPLATE = {
-    "Importe neto cifra negocios": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Otros ingresos de explotacion": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Gastos de personal": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Servicios exteriores": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Tributos": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Amortizaciones": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Gastos excepcionales": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Resultado financiero": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-    "Otros resultados": {"items": [], "totalMXN": 0.0, "totalEUR": 0.0},
-}
+
+
+def __getattr__(name: str) -> Any:
+    # ACCOUNT_MAPPING ya no se carga al importar: es el mapeo del snapshot vigente (ver mapping_store)
+    if name == "ACCOUNT_MAPPING":
+        return current_snapshot().mappings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _norm_header(value: Any) -> str:
@@ -54,27 +44,29 @@ def _norm_header(value: Any) -> str:
     return "".join(ch for ch in text if ch.isalnum())
 
 
-def _to_float(value: Any) -> float:
-    if value is None:
-        return 0.0
-    if isinstance(value, (int, float)):
-        if math.isfinite(value):
-            return float(value)
-        return 0.0
+def _to_cents(value: Any, decimal: str = ",") -> int:
+    """Importe de celda a centimos enteros; el texto (`1.234,56`, o `1,234.56` con `decimal="."`)
+    se convierte sin pasar por float."""
+    if value is None or isinstance(value, (int, float)):
+        return to_cents(value)
     text = str(value).strip().replace(" ", "")
     if not text:
-        return 0.0
-    text = text.replace(".", "").replace(",", ".")
-    text = "".join(ch for ch in text if ch in "0123456789.-")
-    try:
-        return float(text)
-    except ValueError:
-        return 0.0
+        return 0
+    if decimal == ",":
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    return parse_cents("".join(ch for ch in text if ch in "0123456789.-") or "0")
+
+
+def _to_amount(value: Any) -> float:
+    """Importe de celda para la fila normalizada; el redondeo al centimo se hace despues en bloque."""
+    if type(value) is float:
+        return value
+    return from_cents(_to_cents(value))
 
 
-def _is_zero_segment(segment: str) -> bool:
-    s = str(segment or "").strip()
-    return bool(s) and all(ch == "0" for ch in s)
+NORMALIZED_KEYS = ("_rowId", "_isNew", "_excludeFromAnalysis", "code", "name", "sid", "sia", "cargos", "abonos", "sfd", "sfa")
 
 
 def _normalize_row(row: dict[str, Any], index: int) -> dict[str, Any]:
@@ -84,67 +76,42 @@ def _normalize_row(row: dict[str, Any], index: int) -> dict[str, Any]:
         "_excludeFromAnalysis": bool(row.get("_excludeFromAnalysis", False)),
         "code": str(row.get("code", "")).strip(),
         "name": str(row.get("name", "Sin descripcion")).strip() or "Sin descripcion",
-        "sid": _to_float(row.get("sid")),
-        "sia": _to_float(row.get("sia")),
-        "cargos": _to_float(row.get("cargos")),
-        "abonos": _to_float(row.get("abonos")),
-        "sfd": _to_float(row.get("sfd")),
-        "sfa": _to_float(row.get("sfa")),
+        "sid": _to_amount(row.get("sid")),
+        "sia": _to_amount(row.get("sia")),
+        "cargos": _to_amount(row.get("cargos")),
+        "abonos": _to_amount(row.get("abonos")),
+        "sfd": _to_amount(row.get("sfd")),
+        "sfa": _to_amount(row.get("sfa")),
     }
 
 
 def find_mapping(code: str) -> dict[str, str] | None:
-    safe = str(code or "").strip()
-    if not safe:
-        return None
-    parts = [p for p in safe.split("-") if p]
-    candidates = [safe]
-    for ln in range(len(parts), 0, -1):
-        candidates.append("-".join(parts[:ln]))
-    for c in candidates:
-        if c in ACCOUNT_MAPPING:
-            return ACCOUNT_MAPPING[c]
-    return None
-
-
-def _account_display_value(group: str, saldo: float) -> float:
-    if group in {"Pasivo Corriente", "Pasivo No Corriente", "Patrimonio Neto", "Ingresos", "Ingresos Financieros"}:
-        return -saldo
-    return saldo
+    return current_snapshot().find(code)
 
 
-def _detect_summary_line(row: dict[str, Any], all_rows: list[dict[str, Any]]) -> bool:
-    code = str(row.get("code", "")).strip()
-    if not code:
-        return False
-    if code.startswith("000-000-"):
-        return True
+CREDIT_GROUPS = frozenset({"Pasivo Corriente", "Pasivo No Corriente", "Patrimonio Neto", "Ingresos", "Ingresos Financieros"})
+
+
+def _account_display_value(group: str, saldo: int) -> int:
+    if group in CREDIT_GROUPS:
+        return -saldo
+    return saldo
 
-    segments = code.split("-")
-    trailing_zero_count = 0
-    for seg in reversed(segments):
-        if _is_zero_segment(seg):
-            trailing_zero_count += 1
-        else:
-            break
 
-    if trailing_zero_count == 0:
-        return False
-    prefix_len = len(segments) - trailing_zero_count
-    if prefix_len <= 0:
-        return True
-    prefix = "-".join(segments[:prefix_len]) + "-"
-    return any(c.get("code") != code and str(c.get("code", "")).startswith(prefix) for c in all_rows)
+AMOUNT_FIELDS = ("sid", "sia", "cargos", "abonos", "sfd", "sfa")
+# Los csv se reparten entre workers por rangos de bytes (cortados en fin de linea); la cabecera,
+# el dialecto y el formato de los importes se deciden antes con las primeras lineas
+CSV_CHUNK_BYTES = 2 * 1024 * 1024
+CSV_HEAD_BYTES = 1024 * 1024
+PARALLEL_MIN_BYTES = 2 * 1024 * 1024
 
+# (codes, names, amounts) con amounts plano de 6 importes en centimos por linea; es lo que devuelve cada worker
+CompactRows = tuple[list[str], list[str], array]
 
-def parse_workbook(file_bytes: bytes) -> list[dict[str, Any]]:
-    wb = load_workbook(io.BytesIO(file_bytes), data_only=True)
-    ws = wb[wb.sheetnames[0]]
+_worker_source: bytes = b""
 
-    matrix_rows: list[list[Any]] = []
-    for row in ws.iter_rows(values_only=True):
-        matrix_rows.append(["" if v is None else v for v in row])
 
+def _find_data_start(matrix_rows: list[list[Any]]) -> int:
     header_row_idx = -1
     for idx, row in enumerate(matrix_rows):
         c0 = _norm_header(row[0] if len(row) > 0 else "")
@@ -152,63 +119,334 @@ def parse_workbook(file_bytes: bytes) -> list[dict[str, Any]]:
         if c0 == "cuenta" and "nombre" in c1:
             header_row_idx = idx
             break
+    if header_row_idx < 0:
+        return -1
 
-    rows: list[dict[str, Any]] = []
-    if header_row_idx >= 0:
-        start = header_row_idx + 1
-        while start < len(matrix_rows):
-            code = str(matrix_rows[start][0] if len(matrix_rows[start]) > 0 else "").strip()
-            if code:
-                break
-            start += 1
-
-        for raw in matrix_rows[start:]:
-            code = str(raw[0] if len(raw) > 0 else "").strip()
-            if not code or not any(ch.isdigit() for ch in code):
-                continue
-            rows.append(
-                {
-                    "_rowId": f"row-{len(rows)+1}",
-                    "_isNew": False,
-                    "_excludeFromAnalysis": False,
-                    "code": code,
-                    "name": str(raw[1] if len(raw) > 1 else "Sin descripcion").strip() or "Sin descripcion",
-                    "sid": _to_float(raw[2] if len(raw) > 2 else 0),
-                    "sia": _to_float(raw[3] if len(raw) > 3 else 0),
-                    "cargos": _to_float(raw[4] if len(raw) > 4 else 0),
-                    "abonos": _to_float(raw[5] if len(raw) > 5 else 0),
-                    "sfd": _to_float(raw[6] if len(raw) > 6 else 0),
-                    "sfa": _to_float(raw[7] if len(raw) > 7 else 0),
-                }
-            )
-
-    if rows:
-        return rows
+    start = header_row_idx + 1
+    while start < len(matrix_rows):
+        code = str(matrix_rows[start][0] if len(matrix_rows[start]) > 0 else "").strip()
+        if code:
+            break
+        start += 1
+    return start
 
-    # fallback simple tabular scan
-    df = pd.DataFrame(matrix_rows)
-    out_rows: list[dict[str, Any]] = []
-    for i in range(len(df)):
-        row = df.iloc[i].tolist()
-        code = str(row[0] if len(row) > 0 else "").strip()
-        if not code:
+
+def _extract_compact(matrix_rows: Iterable[list[Any]], require_digit: bool, decimal: str = ",") -> CompactRows:
+    codes: list[str] = []
+    names: list[str] = []
+    amounts = array("q")
+    for raw in matrix_rows:
+        code = str(raw[0] if len(raw) > 0 else "").strip()
+        if not code or (require_digit and not any(ch.isdigit() for ch in code)):
             continue
-        out_rows.append(
+        codes.append(code)
+        names.append(str(raw[1] if len(raw) > 1 else "Sin descripcion").strip() or "Sin descripcion")
+        amounts.extend(_to_cents(raw[i] if len(raw) > i else 0, decimal) for i in range(2, 8))
+    return codes, names, amounts
+
+
+def _parse_matrix(matrix_rows: list[list[Any]], *, decimal: str = ",", fallback: bool = True) -> CompactRows:
+    start = _find_data_start(matrix_rows)
+    if start >= 0:
+        compact = _extract_compact(matrix_rows[start:], require_digit=True, decimal=decimal)
+        if compact[0] or not fallback:
+            return compact
+    if not fallback:
+        return [], [], array("q")
+    # fallback simple tabular scan
+    return _extract_compact(matrix_rows, require_digit=False, decimal=decimal)
+
+
+def _is_csv(file_bytes: bytes) -> bool:
+    return not file_bytes.startswith(b"PK") and not file_bytes.startswith(b"\xd0\xcf\x11\xe0")
+
+
+def _csv_encoding(file_bytes: bytes) -> str:
+    try:
+        file_bytes.decode("utf-8")
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8-sig"
+
+
+def _decimal_separator(matrix_rows: Iterable[list[Any]], delimiter: str) -> str:
+    """Separador decimal de los importes ("," o "."), decidido por las celdas de importe.
+
+    Cuenta las celdas que lo delatan: con punto y coma a la vez manda el ultimo; con uno solo,
+    si no lleva 3 cifras detras es el decimal y si se repite es el de miles. `1,234` o `1.234`
+    no deciden nada; sin ninguna pista se asume la coma solo con ";" como delimitador.
+    """
+    votes = {",": 0, ".": 0}
+    for raw in matrix_rows:
+        for cell in raw[2:8]:
+            text = str(cell).strip().replace(" ", "")
+            comma, dot = text.rfind(","), text.rfind(".")
+            if comma >= 0 and dot >= 0:
+                votes["," if comma > dot else "."] += 1
+            elif comma >= 0 or dot >= 0:
+                sep = "," if comma >= 0 else "."
+                other = "." if sep == "," else ","
+                if text.count(sep) > 1:
+                    votes[other] += 1
+                elif len(text) - max(comma, dot) - 1 != 3:
+                    votes[sep] += 1
+    if votes[","] == votes["."]:
+        return "," if delimiter == ";" else "."
+    return "," if votes[","] > votes["."] else "."
+
+
+def _csv_lines(text: str) -> list[str]:
+    return text.replace("\r\n", "\n").split("\n")
+
+
+def _csv_head(file_bytes: bytes, encoding: str) -> tuple[list[list[str]], list[int], dict[str, str]]:
+    """Primeras lineas completas del csv: filas, offset en bytes de cada una y dialecto."""
+    head = file_bytes[:CSV_HEAD_BYTES]
+    if len(file_bytes) > CSV_HEAD_BYTES:
+        head = head[: head.rfind(b"\n") + 1]
+    text = head.decode(encoding)
+    try:
+        sniffed: Any = csv.Sniffer().sniff(text[:8192], delimiters=",;\t|")
+    except csv.Error:
+        sniffed = csv.excel
+    dialect = {"delimiter": sniffed.delimiter, "quotechar": sniffed.quotechar or '"'}
+    offsets: list[int] = []
+    rows: list[list[str]] = []
+    offset = 0
+    for line in head.split(b"\n"):
+        offsets.append(offset)
+        offset += len(line) + 1
+        rows.append(next(csv.reader([line.decode(encoding).rstrip("\r")], **dialect), []))
+    return rows, offsets, dialect
+
+
+def _byte_ranges(file_bytes: bytes, start: int) -> list[tuple[int, int]]:
+    """Rangos de unos `CSV_CHUNK_BYTES` desde `start`, cada uno acabado en fin de linea."""
+    ranges: list[tuple[int, int]] = []
+    while start < len(file_bytes):
+        end = file_bytes.find(b"\n", min(start + CSV_CHUNK_BYTES, len(file_bytes)) - 1)
+        end = len(file_bytes) if end < 0 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _sheet_matrix(file_bytes: bytes, sheet_name: str) -> list[list[Any]]:
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        return [["" if v is None else v for v in row] for row in wb[sheet_name].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def _init_worker(file_bytes: bytes) -> None:
+    global _worker_source
+    _worker_source = file_bytes
+
+
+def _parse_sheet_task(sheet_name: str, fallback: bool) -> CompactRows:
+    return _parse_matrix(_sheet_matrix(_worker_source, sheet_name), fallback=fallback)
+
+
+def _parse_csv_range_task(
+    start: int, end: int, encoding: str, dialect: dict[str, str], decimal: str, require_digit: bool
+) -> CompactRows | None:
+    """Lee un rango de bytes del csv; None si algun campo entre comillas cruza de linea (ver `_parse_csv`)."""
+    lines = _csv_lines(_worker_source[start:end].decode(encoding))
+    quote = dialect["quotechar"]
+    if any(line.count(quote) % 2 for line in lines):
+        return None
+    return _extract_compact(csv.reader(lines, **dialect), require_digit, decimal)
+
+
+@dataclass
+class ParsedBalance:
+    """Balanza leida en columnas: codigos, nombres e importes en centimos int64 (una fila de 6 por linea).
+
+    Las lineas con los seis importes a cero quedan en `zero`; con `prune_zero` no salen en `rows()`
+    pero se conservan aqui (`pruned_rows()`, `rows(include_pruned=True)`). Los `_rowId` siguen la
+    posicion de lectura (`row-N`), asi que podar no cambia los de las demas lineas; esa posicion
+    tambien va en `_readPos` para poder reinsertar las podadas (`restore_pruned`). `skipped_sheets`
+    son las hojas sin cabecera `Cuenta | Nombre` (o sin lineas) que se ignoraron al leer todas.
+    """
+
+    codes: list[str]
+    names: list[str]
+    cents: np.ndarray
+    prune_zero: bool = False
+    skipped_sheets: list[str] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.zero = ~self.cents.any(axis=1)
+        self.kept = np.flatnonzero(~self.zero) if self.prune_zero else np.arange(len(self.codes))
+
+    @property
+    def pruned_count(self) -> int:
+        return len(self.codes) - len(self.kept)
+
+    @property
+    def pruned_codes(self) -> list[str]:
+        return [self.codes[i] for i in np.flatnonzero(self.zero).tolist()] if self.prune_zero else []
+
+    def _dicts(self, index: np.ndarray) -> list[dict[str, Any]]:
+        codes, names = self.codes, self.names
+        return [
             {
-                "_rowId": f"row-{len(out_rows)+1}",
+                "_rowId": f"row-{i+1}",
+                "_readPos": i,
                 "_isNew": False,
                 "_excludeFromAnalysis": False,
-                "code": code,
-                "name": str(row[1] if len(row) > 1 else "Sin descripcion").strip() or "Sin descripcion",
-                "sid": _to_float(row[2] if len(row) > 2 else 0),
-                "sia": _to_float(row[3] if len(row) > 3 else 0),
-                "cargos": _to_float(row[4] if len(row) > 4 else 0),
-                "abonos": _to_float(row[5] if len(row) > 5 else 0),
-                "sfd": _to_float(row[6] if len(row) > 6 else 0),
-                "sfa": _to_float(row[7] if len(row) > 7 else 0),
+                "code": codes[i],
+                "name": names[i],
+                **dict(zip(AMOUNT_FIELDS, amounts)),
             }
-        )
-    return out_rows
+            for i, amounts in zip(index.tolist(), (self.cents[index] / CENTS).tolist())
+        ]
+
+    def rows(self, *, include_pruned: bool = False) -> list[dict[str, Any]]:
+        """Lineas normalizadas (las de `parse_workbook`); solo aqui se crea un dict por linea."""
+        return self._dicts(np.arange(len(self.codes)) if include_pruned else self.kept)
+
+    def pruned_rows(self) -> list[dict[str, Any]]:
+        return self._dicts(np.flatnonzero(self.zero)) if self.prune_zero else []
+
+
+def _merge_compact(parts: list[CompactRows], prune_zero: bool = False, skipped_sheets: list[str] | None = None) -> ParsedBalance:
+    amounts = [np.frombuffer(a, dtype=np.int64) for _, _, a in parts if len(a)]
+    return ParsedBalance(
+        codes=[code for codes, _, _ in parts for code in codes],
+        names=[name for _, names, _ in parts for name in names],
+        cents=(np.concatenate(amounts) if amounts else np.zeros(0, dtype=np.int64)).reshape(-1, len(AMOUNT_FIELDS)),
+        prune_zero=prune_zero,
+        skipped_sheets=skipped_sheets or [],
+    )
+
+
+def restore_pruned(rows: list[dict[str, Any]], pruned: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Reinserta las lineas podadas entre las actuales segun su posicion de lectura (`_readPos`).
+
+    Cada podada entra justo antes de la primera linea actual leida despues de ella; las lineas
+    sin `_readPos` (anadidas a mano o que vienen de lo guardado) se quedan donde estan, asi que
+    editar, borrar o rebasar sobre un periodo guardado no descoloca la reinsercion.
+    """
+    pending = sorted(pruned, key=lambda r: r["_readPos"])
+    merged: list[dict[str, Any]] = []
+    nxt = 0
+    for row in rows:
+        position = row.get("_readPos")
+        if position is not None:
+            while nxt < len(pending) and pending[nxt]["_readPos"] < position:
+                merged.append(pending[nxt])
+                nxt += 1
+        merged.append(row)
+    merged.extend(pending[nxt:])
+    return merged
+
+
+def _run_tasks(fn: Any, tasks: list[tuple[Any, ...]], file_bytes: bytes, workers: int) -> list[Any]:
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(file_bytes)
+        return [fn(*t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker, initargs=(file_bytes,)) as pool:
+        return list(pool.map(fn, *zip(*tasks)))
+
+
+def parse_balance(
+    file_bytes: bytes,
+    *,
+    all_sheets: bool = False,
+    workers: int | None = None,
+    prune_zero: bool = False,
+) -> ParsedBalance:
+    """Lee la balanza de un xlsx (primera hoja o todas) o de un csv en forma de columnas.
+
+    Con varias hojas o un csv grande, cada hoja/rango de bytes se procesa en un proceso aparte;
+    el resultado es identico al de la lectura secuencial (`workers=1`). Con `workers=None` solo se
+    paraleliza a partir de `PARALLEL_MIN_BYTES`. Con `prune_zero` se apartan las lineas a cero.
+    Al leer todas las hojas, las que no tienen cabecera `Cuenta | Nombre` se ignoran (notas,
+    portadas...) y se informan en `skipped_sheets`; con una sola hoja se lee tal cual.
+    """
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(file_bytes) >= PARALLEL_MIN_BYTES else 1
+
+    if _is_csv(file_bytes):
+        return _parse_csv(file_bytes, workers, prune_zero)
+
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True)
+    sheet_names = list(wb.sheetnames) if all_sheets else wb.sheetnames[:1]
+    wb.close()
+    multi = len(sheet_names) > 1
+    parts = _run_tasks(_parse_sheet_task, [(name, not multi) for name in sheet_names], file_bytes, workers)
+    skipped = [name for name, (codes, _, _) in zip(sheet_names, parts) if not codes] if multi else []
+    return _merge_compact(parts, prune_zero, skipped)
+
+
+def _parse_csv(file_bytes: bytes, workers: int, prune_zero: bool) -> ParsedBalance:
+    """csv por rangos de bytes: cada worker decodifica y lee solo su parte (nada de filas por pickle).
+
+    La cabecera, el dialecto y el separador decimal salen de las primeras lineas. Si la cabecera
+    no esta ahi o algun campo entre comillas ocupa varias lineas, se lee entero en este proceso.
+    """
+    encoding = _csv_encoding(file_bytes)
+    head_rows, offsets, dialect = _csv_head(file_bytes, encoding)
+    start = _find_data_start(head_rows)
+    decimal = _decimal_separator(head_rows[max(start, 0) :], dialect["delimiter"])
+    if start >= 0:
+        data_start = offsets[start] if start < len(offsets) else len(file_bytes)
+        for begin, require_digit in ((data_start, True), (0, False)):
+            tasks = [(a, b, encoding, dialect, decimal, require_digit) for a, b in _byte_ranges(file_bytes, begin)]
+            parts = _run_tasks(_parse_csv_range_task, tasks, file_bytes, workers)
+            if any(part is None for part in parts):
+                break
+            if any(codes for codes, _, _ in parts):
+                return _merge_compact(parts, prune_zero)
+    matrix_rows = list(csv.reader(io.StringIO(file_bytes.decode(encoding)), **dialect))
+    decimal = _decimal_separator(matrix_rows[max(_find_data_start(matrix_rows), 0) :], dialect["delimiter"])
+    return _merge_compact([_parse_matrix(matrix_rows, decimal=decimal)], prune_zero)
+
+
+def parse_workbook(file_bytes: bytes, *, all_sheets: bool = False, workers: int | None = None) -> list[dict[str, Any]]:
+    """Lee la balanza completa como lista de lineas normalizadas (ver `parse_balance`)."""
+    return parse_balance(file_bytes, all_sheets=all_sheets, workers=workers).rows()
+
+
+def _manual_mapping(manual: dict[str, Any]) -> dict[str, str] | None:
+    if not any(str(manual.get(k, "")).strip() for k in ("pgc", "pgcName", "grupo", "subgrupo")):
+        return None
+    return {
+        "pgc": str(manual.get("pgc", "")).strip() or "SIN MAPEO",
+        "pgcName": str(manual.get("pgcName", "")).strip() or "Sin equivalencia PGC",
+        "grupo": str(manual.get("grupo", "")).strip() or "Sin clasificar",
+        "subgrupo": str(manual.get("subgrupo", "")).strip() or "Sin clasificar",
+    }
+
+
+def _convert_row(
+    row: dict[str, Any],
+    summary: bool,
+    manual: dict[str, str] | None,
+    saldo: int,
+    saldo_eur: int,
+    auto: dict[str, str] | None,
+) -> dict[str, Any]:
+    mapping = manual if manual is not None else auto
+    group = mapping["grupo"] if mapping else "Sin clasificar"
+    exclude = bool(row.get("_excludeFromAnalysis", False) or summary)
+    return {
+        **{k: row[k] for k in NORMALIZED_KEYS},
+        "mapping": mapping,
+        "pgcCode": mapping["pgc"] if mapping else "SIN MAPEO",
+        "pgcName": mapping["pgcName"] if mapping else "Sin equivalencia PGC",
+        "grupo": group,
+        "subgrupo": mapping["subgrupo"] if mapping else "Sin clasificar",
+        "saldo": from_cents(saldo),
+        "saldoEur": from_cents(saldo_eur),
+        "displayMXN": from_cents(_account_display_value(group, saldo)),
+        "displayEUR": from_cents(_account_display_value(group, saldo_eur)),
+        "manualMappingApplied": manual is not None,
+        "isSummaryLine": summary,
+        "excludeFromAnalysis": exclude,
+    }
 
 
 def convert_rows(
@@ -216,57 +454,80 @@ def convert_rows(
     exchange_rate: float = 0.046,
     manual_mappings: dict[str, dict[str, str]] | None = None,
     period: dict[str, int] | None = None,
+    *,
+    previous: dict[str, Any] | None = None,
+    changed_row_ids: set[str] | None = None,
+    pruned_codes: Sequence[str] = (),
+    snapshot: MappingSnapshot | None = None,
 ) -> dict[str, Any]:
+    """Convierte la balanza a PGC.
+
+    Con `previous` (conversion anterior) y `changed_row_ids`, las lineas no modificadas reutilizan
+    su linea convertida y solo se normalizan y mapean las cambiadas. Toda la conversion usa el
+    mismo snapshot de mapeo aunque se recargue a mitad. `pruned_codes` son las cuentas a cero
+    podadas al leer: no se convierten, pero cuentan para detectar sumatorias. Con `snapshot` se
+    convierte con ese mapeo en lugar del vigente (quien cachea el resultado sabe asi con cual fue).
+    """
+    mappings = snapshot or current_snapshot()
     manual_mappings = manual_mappings or {}
-    normalized_rows = [_normalize_row(r, i) for i, r in enumerate(rows) if str(r.get("code", "")).strip()]
+    reusable: dict[str, dict[str, Any]] = {}
+    if previous is not None and changed_row_ids is not None and previous["metadata"]["exchangeRate"] == exchange_rate:
+        reusable = {r["_rowId"]: r for r in previous["convertedData"] if r["_rowId"] not in changed_row_ids}
 
-    converted_data: list[dict[str, Any]] = []
-    for row in normalized_rows:
-        row_id = row["_rowId"]
-        manual = manual_mappings.get(row_id, {})
-        has_manual = any(str(manual.get(k, "")).strip() for k in ("pgc", "pgcName", "grupo", "subgrupo"))
-        auto = find_mapping(row["code"])
-        mapping = (
-            {
-                "pgc": str(manual.get("pgc", "")).strip() or "SIN MAPEO",
-                "pgcName": str(manual.get("pgcName", "")).strip() or "Sin equivalencia PGC",
-                "grupo": str(manual.get("grupo", "")).strip() or "Sin clasificar",
-                "subgrupo": str(manual.get("subgrupo", "")).strip() or "Sin clasificar",
-            }
-            if has_manual
-            else auto
-        )
-
-        saldo = row["sfd"] - row["sfa"]
-        group = mapping["grupo"] if mapping else "Sin clasificar"
-        display_mxn = _account_display_value(group, saldo)
-        summary = _detect_summary_line(row, normalized_rows)
-        exclude = bool(row.get("_excludeFromAnalysis", False) or summary)
+    normalized_rows: list[dict[str, Any]] = []
+    for i, r in enumerate(rows):
+        if not str(r.get("code", "")).strip():
+            continue
+        prev = reusable.get(r.get("_rowId"))  # type: ignore[arg-type]
+        normalized_rows.append(prev if prev is not None else _normalize_row(r, i))
+    flags = summary_flags(normalized_rows, pruned_codes)
+    # Todas las sumas se hacen en centimos int64; una fila por linea en el orden de AMOUNT_FIELDS.
+    # El redondeo al centimo se hace aqui en bloque; solo se reescriben las filas que cambian.
+    raw_amounts = np.fromiter(
+        (r[f] for r in normalized_rows for f in AMOUNT_FIELDS), dtype=np.float64, count=len(normalized_rows) * len(AMOUNT_FIELDS)
+    ).reshape(-1, len(AMOUNT_FIELDS))
+    row_amounts = cents_array(raw_amounts)
+    quantized = row_amounts / CENTS
+    for i in np.flatnonzero((quantized != raw_amounts).any(axis=1)).tolist():
+        normalized_rows[i].update(zip(AMOUNT_FIELDS, quantized[i].tolist()))
+    saldos = row_amounts[:, 4] - row_amounts[:, 5]
+    saldos_eur = eur_cents(saldos, exchange_rate)
+    saldo_pairs = zip(saldos.tolist(), saldos_eur.tolist())
+    hierarchy = build_account_hierarchy(normalized_rows, flags, row_amounts)
+    # Reglas evaluadas en bloque sobre todas las lineas (el signo sale del saldo en centimos)
+    autos, rule_ranks = mappings.auto_mappings(
+        [r["code"] for r in normalized_rows], [r["name"] for r in normalized_rows], saldos
+    )
 
-        converted_data.append(
-            {
-                **row,
-                "mapping": mapping,
-                "pgcCode": mapping["pgc"] if mapping else "SIN MAPEO",
-                "pgcName": mapping["pgcName"] if mapping else "Sin equivalencia PGC",
-                "grupo": group,
-                "subgrupo": mapping["subgrupo"] if mapping else "Sin clasificar",
-                "saldo": saldo,
-                "saldoEur": saldo * exchange_rate,
-                "displayMXN": display_mxn,
-                "displayEUR": display_mxn * exchange_rate,
-                "manualMappingApplied": has_manual,
-                "isSummaryLine": summary,
-                "excludeFromAnalysis": exclude,
-            }
-        )
+    converted_data: list[dict[str, Any]] = []
+    by_rule = np.zeros(len(normalized_rows), dtype=bool)
+    for i, (row, summary, (saldo, saldo_eur), auto) in enumerate(zip(normalized_rows, flags, saldo_pairs, autos)):
+        manual = _manual_mapping(manual_mappings.get(row["_rowId"], {}))
+        by_rule[i] = manual is None
+        if (
+            row is reusable.get(row["_rowId"])
+            and row["isSummaryLine"] == summary
+            and (row["mapping"] if row["manualMappingApplied"] else None) == manual
+            and (manual is not None or row["mapping"] == auto)
+        ):
+            converted_data.append(row)
+            continue
+        converted_data.append(_convert_row(row, summary, manual, saldo, saldo_eur, auto))
 
-    rows_for_analysis = [r for r in converted_data if not r["excludeFromAnalysis"]]
+    analyzed = [i for i, r in enumerate(converted_data) if not r["excludeFromAnalysis"]]
+    rows_for_analysis = [converted_data[i] for i in analyzed]
+    amounts = row_amounts[analyzed]
+    # [displayMXN, displayEUR, saldo, saldoEur] por linea analizada
+    signs = np.fromiter((-1 if r["grupo"] in CREDIT_GROUPS else 1 for r in rows_for_analysis), dtype=np.int64, count=len(analyzed))
+    values = np.column_stack((saldos[analyzed] * signs, saldos_eur[analyzed] * signs, saldos[analyzed], saldos_eur[analyzed]))
 
     aggregate_map: dict[str, dict[str, Any]] = {}
+    leaf_ids: list[int] = []
+    leaf_of: dict[str, int] = {}
     for row in rows_for_analysis:
         key = row["pgcCode"]
         if key not in aggregate_map:
+            leaf_of[key] = len(leaf_of)
             aggregate_map[key] = {
                 "pgcCode": row["pgcCode"],
                 "pgcName": row["pgcName"],
@@ -276,32 +537,26 @@ def convert_rows(
                 "totalEUR": 0.0,
                 "details": [],
             }
-        aggregate_map[key]["totalMXN"] += row["displayMXN"]
-        aggregate_map[key]["totalEUR"] += row["displayEUR"]
+        leaf_ids.append(leaf_of[key])
         aggregate_map[key]["details"].append(row)
+    leaf_totals = np.zeros((len(leaf_of), 4), dtype=np.int64)
+    np.add.at(leaf_totals, np.asarray(leaf_ids, dtype=np.intp), values)
+    for key, leaf in leaf_of.items():
+        aggregate_map[key]["totalMXN"] = from_cents(int(leaf_totals[leaf, 0]))
+        aggregate_map[key]["totalEUR"] = from_cents(int(leaf_totals[leaf, 1]))
 
     pgc_aggregated = sorted(aggregate_map.values(), key=lambda x: str(x["pgcCode"]))
-
-    balance_groups = deepcopy(BALANCE_GROUPS_TEMPLATE)
-    for row in pgc_aggregated:
-        if row["grupo"] not in balance_groups:
-            continue
-        balance_groups[row["grupo"]]["items"].append(row)
-        balance_groups[row["grupo"]]["totalMXN"] += row["totalMXN"]
-        balance_groups[row["grupo"]]["totalEUR"] += row["totalEUR"]
-
-    total_activo_mxn = balance_groups["Activo No Corriente"]["totalMXN"] + balance_groups["Activo Corriente"]["totalMXN"]
-    total_pasivo_pn_mxn = (
-        balance_groups["Patrimonio Neto"]["totalMXN"]
-        + balance_groups["Pasivo No Corriente"]["totalMXN"]
-        + balance_groups["Pasivo Corriente"]["totalMXN"]
-    )
-    total_activo_eur = balance_groups["Activo No Corriente"]["totalEUR"] + balance_groups["Activo Corriente"]["totalEUR"]
-    total_pasivo_pn_eur = (
-        balance_groups["Patrimonio Neto"]["totalEUR"]
-        + balance_groups["Pasivo No Corriente"]["totalEUR"]
-        + balance_groups["Pasivo Corriente"]["totalEUR"]
-    )
+    statements = build_statements(pgc_aggregated, leaf_totals[[leaf_of[r["pgcCode"]] for r in pgc_aggregated]])
+    legacy_balance, legacy_pnl = (statements.pop(key) for key in LEGACY_KEYS)
+
+    balance_lines = line_map(legacy_balance)
+    balance_groups = {
+        line["key"]: {"items": line["items"], "totalMXN": line["totalMXN"], "totalEUR": line["totalEUR"]}
+        for line in legacy_balance["lines"]
+        if not line["isTotal"]
+    }
+    total_activo_mxn, total_activo_eur = balance_lines["totalActivo"]["cents"]
+    total_pasivo_pn_mxn, total_pasivo_pn_eur = balance_lines["totalPasivoPN"]["cents"]
 
     diff_mxn = total_activo_mxn - total_pasivo_pn_mxn
     diff_eur = total_activo_eur - total_pasivo_pn_eur
@@ -309,66 +564,45 @@ def convert_rows(
     adjusted_total_pasivo_pn_mxn = total_pasivo_pn_mxn
     adjusted_total_pasivo_pn_eur = total_pasivo_pn_eur
     auto_result_line = None
-    if abs(diff_mxn) > 0.01:
+    if abs(diff_mxn) > TOLERANCE_CENTS:
         auto_result_line = {
             "pgcCode": "129",
             "pgcName": "Resultado del periodo pendiente de cierre",
             "grupo": "Patrimonio Neto",
             "subgrupo": "Fondos propios",
-            "totalMXN": diff_mxn,
-            "totalEUR": diff_eur,
+            "totalMXN": from_cents(diff_mxn),
+            "totalEUR": from_cents(diff_eur),
             "details": [],
         }
         adjusted_total_pasivo_pn_mxn += diff_mxn
         adjusted_total_pasivo_pn_eur += diff_eur
 
-    pnl_sections = deepcopy(PNL_SECTIONS_TEMPLATE)
-    for row in pgc_aggregated:
-        sub = row["subgrupo"]
-        if sub in pnl_sections:
-            pnl_sections[sub]["items"].append(row)
-            pnl_sections[sub]["totalMXN"] += row["totalMXN"]
-            pnl_sections[sub]["totalEUR"] += row["totalEUR"]
-
-    ingresos_mx = pnl_sections["Importe neto cifra negocios"]["totalMXN"] + pnl_sections["Otros ingresos de explotacion"]["totalMXN"]
-    gastos_mx = (
-        pnl_sections["Gastos de personal"]["totalMXN"]
-        + pnl_sections["Servicios exteriores"]["totalMXN"]
-        + pnl_sections["Tributos"]["totalMXN"]
-        + pnl_sections["Amortizaciones"]["totalMXN"]
-        + pnl_sections["Gastos excepcionales"]["totalMXN"]
-    )
-    resultado_fin_mx = pnl_sections["Resultado financiero"]["totalMXN"]
-    otros_res_mx = pnl_sections["Otros resultados"]["totalMXN"]
-    resultado_antes_mx = ingresos_mx - gastos_mx + resultado_fin_mx + otros_res_mx
-
-    ingresos_eur = pnl_sections["Importe neto cifra negocios"]["totalEUR"] + pnl_sections["Otros ingresos de explotacion"]["totalEUR"]
-    gastos_eur = (
-        pnl_sections["Gastos de personal"]["totalEUR"]
-        + pnl_sections["Servicios exteriores"]["totalEUR"]
-        + pnl_sections["Tributos"]["totalEUR"]
-        + pnl_sections["Amortizaciones"]["totalEUR"]
-        + pnl_sections["Gastos excepcionales"]["totalEUR"]
-    )
-    resultado_fin_eur = pnl_sections["Resultado financiero"]["totalEUR"]
-    otros_res_eur = pnl_sections["Otros resultados"]["totalEUR"]
-    resultado_antes_eur = ingresos_eur - gastos_eur + resultado_fin_eur + otros_res_eur
+    pnl_lines = line_map(legacy_pnl)
+    pnl_sections = {
+        line["key"]: {"items": line["items"], "totalMXN": line["totalMXN"], "totalEUR": line["totalEUR"]}
+        for line in legacy_pnl["lines"]
+        if not line["isTotal"]
+    }
 
     unmapped_rows = [r for r in rows_for_analysis if r["pgcCode"] == "SIN MAPEO"]
 
-    total_debe_inicial = sum(r["sid"] for r in rows_for_analysis)
-    total_haber_inicial = sum(r["sia"] for r in rows_for_analysis)
-    total_debe_final = sum(r["sfd"] for r in rows_for_analysis)
-    total_haber_final = sum(r["sfa"] for r in rows_for_analysis)
+    sid, sia, _, _, sfd, sfa = (int(total) for total in amounts.sum(axis=0))
+    initial_difference = sid - sia
+    final_difference = sfd - sfa
 
     return {
         "metadata": {
             "exchangeRate": exchange_rate,
             "rowCount": len(converted_data),
+            "prunedZeroCount": len(pruned_codes),
             "analyzedRowCount": len(rows_for_analysis),
             "summaryExcludedCount": sum(1 for r in converted_data if r["isSummaryLine"]),
+            "summaryMismatchCount": len(hierarchy["mismatches"]),
+            "hierarchyDepth": hierarchy["maxDepth"],
             "unmappedCount": len(unmapped_rows),
             "manualMappingCount": sum(1 for r in converted_data if r["manualMappingApplied"]),
+            # Lineas resueltas por cada regla de mapeo (por id); las de mapeo manual no cuentan
+            "mappingRuleHits": mappings.rules.hit_counts(rule_ranks[by_rule]) if len(mappings.rules) else {},
             "mappedCoveragePct": ((len(rows_for_analysis) - len(unmapped_rows)) / len(rows_for_analysis) * 100) if rows_for_analysis else 0.0,
             "period": period,
         },
@@ -376,43 +610,63 @@ def convert_rows(
         "pgcAggregated": pgc_aggregated,
         "balanceSheet": {
             "groups": balance_groups,
-            "totalActivoMXN": total_activo_mxn,
-            "totalPasivoPNMXN": total_pasivo_pn_mxn,
-            "totalActivoEUR": total_activo_eur,
-            "totalPasivoPNEUR": total_pasivo_pn_eur,
-            "differenceMXN": diff_mxn,
-            "differenceEUR": diff_eur,
+            "totalActivoMXN": from_cents(total_activo_mxn),
+            "totalPasivoPNMXN": from_cents(total_pasivo_pn_mxn),
+            "totalActivoEUR": from_cents(total_activo_eur),
+            "totalPasivoPNEUR": from_cents(total_pasivo_pn_eur),
+            "differenceMXN": from_cents(diff_mxn),
+            "differenceEUR": from_cents(diff_eur),
             "autoResultLine": auto_result_line,
-            "adjustedTotalPasivoPNMXN": adjusted_total_pasivo_pn_mxn,
-            "adjustedTotalPasivoPNEUR": adjusted_total_pasivo_pn_eur,
-            "adjustedDifferenceMXN": total_activo_mxn - adjusted_total_pasivo_pn_mxn,
-            "adjustedDifferenceEUR": total_activo_eur - adjusted_total_pasivo_pn_eur,
+            "adjustedTotalPasivoPNMXN": from_cents(adjusted_total_pasivo_pn_mxn),
+            "adjustedTotalPasivoPNEUR": from_cents(adjusted_total_pasivo_pn_eur),
+            "adjustedDifferenceMXN": from_cents(total_activo_mxn - adjusted_total_pasivo_pn_mxn),
+            "adjustedDifferenceEUR": from_cents(total_activo_eur - adjusted_total_pasivo_pn_eur),
         },
         "pnl": {
             "sections": pnl_sections,
-            "ingresosMx": ingresos_mx,
-            "gastosMx": gastos_mx,
-            "resultadoExplotacionMx": ingresos_mx - gastos_mx,
-            "resultadoFinancieroMx": resultado_fin_mx,
-            "otrosResultadosMx": otros_res_mx,
-            "resultadoAntesImpuestosMx": resultado_antes_mx,
-            "ingresosEur": ingresos_eur,
-            "gastosEur": gastos_eur,
-            "resultadoExplotacionEur": ingresos_eur - gastos_eur,
-            "resultadoFinancieroEur": resultado_fin_eur,
-            "otrosResultadosEur": otros_res_eur,
-            "resultadoAntesImpuestosEur": resultado_antes_eur,
+            "ingresosMx": pnl_lines["ingresos"]["totalMXN"],
+            "gastosMx": pnl_lines["gastos"]["totalMXN"],
+            "resultadoExplotacionMx": pnl_lines["resultadoExplotacion"]["totalMXN"],
+            "resultadoFinancieroMx": pnl_lines["Resultado financiero"]["totalMXN"],
+            "otrosResultadosMx": pnl_lines["Otros resultados"]["totalMXN"],
+            "resultadoAntesImpuestosMx": pnl_lines["resultadoAntesImpuestos"]["totalMXN"],
+            "ingresosEur": pnl_lines["ingresos"]["totalEUR"],
+            "gastosEur": pnl_lines["gastos"]["totalEUR"],
+            "resultadoExplotacionEur": pnl_lines["resultadoExplotacion"]["totalEUR"],
+            "resultadoFinancieroEur": pnl_lines["Resultado financiero"]["totalEUR"],
+            "otrosResultadosEur": pnl_lines["Otros resultados"]["totalEUR"],
+            "resultadoAntesImpuestosEur": pnl_lines["resultadoAntesImpuestos"]["totalEUR"],
         },
+        "statements": statements,
         "validations": {
-            "trialBalanceInitialDifference": total_debe_inicial - total_haber_inicial,
-            "trialBalanceFinalDifference": total_debe_final - total_haber_final,
+            "trialBalanceInitialDifference": from_cents(initial_difference),
+            "trialBalanceFinalDifference": from_cents(final_difference),
+            "trialBalanceInitialDifferenceCents": initial_difference,
+            "trialBalanceFinalDifferenceCents": final_difference,
             "unmappedRows": unmapped_rows,
+            "summaryMismatches": hierarchy["mismatches"],
         },
+        "hierarchy": hierarchy,
     }
 
 
-def export_conversion_xlsx(conversion: dict[str, Any]) -> bytes:
-    output = io.BytesIO()
+def can_save(conversion: dict[str, Any] | None) -> tuple[bool, str]:
+    if not conversion:
+        return False, "Sin analisis"
+    analyzed = conversion["metadata"]["analyzedRowCount"]
+    unmapped = conversion["metadata"]["unmappedCount"]
+    trial = abs(conversion["validations"]["trialBalanceFinalDifferenceCents"])
+    if analyzed <= 0:
+        return False, "No hay lineas analizadas"
+    if unmapped > 0:
+        return False, "Hay lineas sin mapear"
+    if trial > TOLERANCE_CENTS:
+        return False, "La balanza final no cuadra"
+    return True, "Listo para guardar"
+
+
+def write_conversion_xlsx(conversion: dict[str, Any], output: str | Path | BinaryIO) -> None:
+    """Libro xlsx de la conversion (detalle, balanza PGC y validaciones) escrito en `output`."""
     with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
         pd.DataFrame(conversion["convertedData"]).to_excel(writer, index=False, sheet_name="Mapeo_Detalle")
         pd.DataFrame(conversion["pgcAggregated"]).to_excel(writer, index=False, sheet_name="Balanza_PGC")
@@ -423,4 +677,9 @@ def export_conversion_xlsx(conversion: dict[str, Any]) -> bytes:
             {"Control": "Cobertura %", "Valor": conversion["metadata"]["mappedCoveragePct"]},
             {"Control": "Dif. balanza final", "Valor": conversion["validations"]["trialBalanceFinalDifference"]},
         ]).to_excel(writer, index=False, sheet_name="Validaciones")
+
+
+def export_conversion_xlsx(conversion: dict[str, Any]) -> bytes:
+    output = io.BytesIO()
+    write_conversion_xlsx(conversion, output)
     return output.getvalue()
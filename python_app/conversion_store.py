@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from db import DATA_DIR
+
+DEFAULT_MEMORY_BUDGET = int(os.environ.get("CONTABILIDAD_STORE_MEMORY_MB", "512")) * 1024 * 1024
+SPILL_DIR = DATA_DIR / "store"
+SESSION_TTL_SECONDS = 12 * 3600
+# Elementos de una lista/tupla larga que se miden para estimar su tamano (el resto se extrapola)
+SIZE_SAMPLE = 64
+
+
+def content_key(*parts: Any) -> str:
+    return hashlib.blake2b(pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL), digest_size=20).hexdigest()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def resident_size(value: Any) -> int:
+    """Bytes que ocupa `value` en memoria (sys.getsizeof recursivo, cada objeto una vez).
+
+    En listas y tuplas largas se mide una muestra de `SIZE_SAMPLE` elementos repartidos y se
+    extrapola, asi que con miles de filas es una estimacion y no un recorrido completo.
+    """
+    seen: set[int] = set()
+
+    def size(obj: Any) -> int:
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, np.ndarray):
+            return total if obj.base is None else total + obj.nbytes
+        if isinstance(obj, dict):
+            return total + sum(size(k) + size(v) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)) and len(obj) > SIZE_SAMPLE:
+            step = len(obj) // SIZE_SAMPLE
+            return total + sum(size(obj[i]) for i in range(0, step * SIZE_SAMPLE, step)) * len(obj) // SIZE_SAMPLE
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            return total + sum(size(item) for item in obj)
+        return total
+
+    return size(value)
+
+
+class ConversionStore:
+    """Almacen compartido entre sesiones de filas y conversiones, direccionado por hash de contenido.
+
+    Las sesiones solo guardan claves (`bind`). Los valores se tratan como inmutables. Cuando el
+    tamano residente estimado (`resident_size`) supera `memory_budget` se sacan de memoria los
+    menos usados: los que alguna sesion referencia se vuelcan a disco y se recargan al pedirlos;
+    los que no referencia ninguna se descartan sin volcar (son caches que `get_or_compute`
+    vuelve a calcular) y `get` devuelve None para ellos.
+    """
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, spill_dir: Path = SPILL_DIR) -> None:
+        self.memory_budget = memory_budget
+        # Cada proceso vuelca en su subdirectorio (`<pid>`): otro proceso que arranque no lo toca.
+        # Al arrancar solo se limpian el propio y los de procesos que ya no existen
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        for stale in spill_dir.iterdir():
+            if stale.is_dir() and stale.name.isdigit() and (int(stale.name) == os.getpid() or not _pid_alive(int(stale.name))):
+                shutil.rmtree(stale, ignore_errors=True)
+        self.spill_dir = spill_dir / str(os.getpid())
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._memory: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        # clave -> bytes del fichero volcado
+        self._disk: dict[str, int] = {}
+        self._memory_bytes = 0
+        self._sessions: dict[str, dict[str, str]] = {}
+        self._last_seen: dict[str, float] = {}
+        self._stats = {"hits": 0, "misses": 0, "spills": 0, "discards": 0, "reloads": 0}
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{key}.pkl"
+
+    def _insert(self, key: str, value: Any) -> None:
+        size = resident_size(value)
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+            old_key, (old_value, old_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_size
+            if old_key in self._disk:
+                continue
+            if not self._is_referenced(old_key):
+                self._stats["discards"] += 1
+                continue
+            payload = pickle.dumps(old_value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._spill_path(old_key).write_bytes(payload)
+            self._disk[old_key] = len(payload)
+            self._stats["spills"] += 1
+
+    def _is_referenced(self, key: str) -> bool:
+        return any(key in slots.values() for slots in self._sessions.values())
+
+    def put(self, value: Any, key: str | None = None) -> str:
+        key = key or hashlib.blake2b(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), digest_size=20).hexdigest()
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+            else:
+                self._insert(key, value)
+        return key
+
+    def get(self, key: str | None, session_id: str | None = None) -> Any:
+        """Valor de `key` (None si no existe); con `session_id` la sesion cuenta como activa."""
+        if key is None:
+            return None
+        with self._lock:
+            if session_id is not None and session_id in self._last_seen:
+                self._last_seen[session_id] = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            if key not in self._disk:
+                self._stats["misses"] += 1
+                return None
+            value = pickle.loads(self._spill_path(key).read_bytes())
+            self._stats["reloads"] += 1
+            self._insert(key, value)
+            return value
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], session_id: str | None = None) -> Any:
+        value = self.get(key, session_id)
+        if value is None:
+            value = compute()
+            self.put(value, key)
+        return value
+
+    def bind(self, session_id: str, slot: str, key: str | None) -> None:
+        with self._lock:
+            slots = self._sessions.setdefault(session_id, {})
+            if key is None:
+                slots.pop(slot, None)
+            else:
+                slots[slot] = key
+            self._last_seen[session_id] = time.time()
+            self._prune_sessions()
+
+    def _prune_sessions(self) -> None:
+        cutoff = time.time() - SESSION_TTL_SECONDS
+        for session_id in [s for s, seen in self._last_seen.items() if seen < cutoff]:
+            self._sessions.pop(session_id, None)
+            self._last_seen.pop(session_id, None)
+        referenced = {k for slots in self._sessions.values() for k in slots.values()}
+        for key in [k for k in self._disk if k not in referenced and k not in self._memory]:
+            self._spill_path(key).unlink(missing_ok=True)
+            del self._disk[key]
+
+    def _entry_size(self, key: str) -> int:
+        entry = self._memory.get(key)
+        return entry[1] if entry is not None else self._disk.get(key, 0)
+
+    def metrics(self) -> dict[str, Any]:
+        with self._lock:
+            sessions = {
+                session_id: {
+                    "bytes": sum(self._entry_size(k) for k in set(slots.values())),
+                    "slots": dict(slots),
+                }
+                for session_id, slots in self._sessions.items()
+            }
+            return {
+                "memoryBudgetBytes": self.memory_budget,
+                "memoryBytes": self._memory_bytes,
+                "memoryEntries": len(self._memory),
+                "diskBytes": sum(self._disk.values()),
+                "diskEntries": len(self._disk),
+                **self._stats,
+                "sessions": sessions,
+            }
@@ -1,35 +1,139 @@
 from __future__ import annotations
 
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
 import sqlite3
+import time
+from collections.abc import Callable, Collection, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, TypeVar
+
+from mapping_rules import CompiledRules
+from money import from_cents, to_cents
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-DB_PATH = DATA_DIR / "contabilidad.db"
+DB_PATH = Path(os.environ.get("CONTABILIDAD_DB_PATH") or DATA_DIR / "contabilidad.db")
+POOL_SIZE = int(os.environ.get("CONTABILIDAD_DB_POOL_SIZE", "8"))
+# Espera de SQLite ante un bloqueo (busy_timeout); si aun asi sigue bloqueada, la escritura se
+# reintenta WRITE_RETRIES veces con espera exponencial desde WRITE_RETRY_BASE_SECONDS
+BUSY_TIMEOUT_SECONDS = int(os.environ.get("CONTABILIDAD_DB_BUSY_TIMEOUT_MS", "5000")) / 1000
+WRITE_RETRIES = 5
+WRITE_RETRY_BASE_SECONDS = 0.05
+# 1: importes de period_rows en centimos INTEGER (antes REAL en unidades)
+# 2: historial de versiones por periodo (period_versions, period_row_history y periods.version)
+# 3: mapeo de cuentas en account_mappings (sembrado desde account_mapping.json) con version en mapping_state
+SCHEMA_VERSION = 3
+MAPPING_SEED_FILE = BASE_DIR / "account_mapping.json"
+AMOUNT_COLUMNS = ("sid", "sia", "cargos", "abonos", "sfd", "sfa")
+MAPPING_COLUMNS = ("pgc", "pgc_name", "grupo", "subgrupo")
+# Contenido versionado de una linea (sin sort_order: reordenar no crea version de la linea)
+# Lineas por consulta al buscar en el historial las de un guardado en delta (limite de parametros de SQLite)
+HISTORY_LOOKUP_CHUNK = 500
+HISTORY_COLUMNS = ("code", "name", *AMOUNT_COLUMNS, "is_new", "exclude_from_analysis", "has_mapping", *MAPPING_COLUMNS)
+
+_pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(maxsize=POOL_SIZE)
+# Pools heredados por procesos hijos de un fork: sus conexiones no se usan ni se cierran alli
+_forked_pools: list[queue.LifoQueue[sqlite3.Connection]] = []
+T = TypeVar("T")
+
+
+def _reset_pool_after_fork() -> None:
+    """Un hijo de fork empieza con un pool vacio: SQLite no admite usar una conexion a traves de
+    un fork y el cerrojo de la cola se pudo copiar tomado."""
+    global _pool
+    _forked_pools.append(_pool)
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+class PeriodConflictError(Exception):
+    """Guardado que parte de una version del periodo que ya no es la vigente (otra sesion guardo antes)."""
+
+    def __init__(self, period_key: str, expected_version: int, current_version: int) -> None:
+        super().__init__(
+            f"El periodo {period_key} ya va por la version {current_version} y tus cambios parten de la "
+            f"{expected_version}: otra sesion lo guardo antes. Carga la version actual y vuelve a aplicar tus cambios."
+        )
+        self.period_key = period_key
+        self.expected_version = expected_version
+        self.current_version = current_version
 
 
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT_SECONDS)
     conn.row_factory = sqlite3.Row
+    # En WAL (ver init_db) basta con sincronizar en cada checkpoint
+    conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
 
-def init_db() -> None:
-    conn = get_conn()
+@contextmanager
+def pooled_conn() -> Iterator[sqlite3.Connection]:
     try:
-        conn.executescript(
-            """
-            CREATE TABLE IF NOT EXISTS periods (
-              period_key TEXT PRIMARY KEY,
-              year INTEGER NOT NULL,
-              month INTEGER NOT NULL,
-              filename TEXT,
-              exchange_rate REAL NOT NULL,
-              uploaded_at TEXT NOT NULL
-            );
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = get_conn()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_pool() -> None:
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+def _write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Ejecuta `fn` en una transaccion de escritura corta y la confirma.
+
+    BEGIN IMMEDIATE toma el bloqueo de escritura al empezar (una transaccion que empieza leyendo y
+    luego escribe puede fallar sin esperar a busy_timeout). Si la BBDD sigue bloqueada tras
+    busy_timeout, se reintenta con espera exponencial y jitter. Los datos se preparan antes de llamar.
+    """
+    for attempt in itertools.count():
+        with pooled_conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                result = fn(conn)
+                conn.commit()
+                return result
+            except sqlite3.OperationalError as exc:
+                if "locked" not in str(exc) or attempt >= WRITE_RETRIES:
+                    raise
+        time.sleep(WRITE_RETRY_BASE_SECONDS * 2**attempt * (0.5 + random.random()))
+    raise AssertionError("unreachable")
 
+
+def _check_version(conn: sqlite3.Connection, period_key: str, expected_version: int | None) -> None:
+    """Bloqueo optimista: `expected_version` es la version de la que parten los cambios (0 = periodo nuevo)."""
+    if expected_version is None:
+        return
+    row = conn.execute("SELECT version FROM periods WHERE period_key = ?", (period_key,)).fetchone()
+    current = int(row[0]) if row else 0
+    if current != int(expected_version):
+        raise PeriodConflictError(period_key, int(expected_version), current)
+
+
+PERIOD_ROWS_DDL = """
             CREATE TABLE IF NOT EXISTS period_rows (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               period_key TEXT NOT NULL,
@@ -37,17 +141,206 @@ def init_db() -> None:
               sort_order INTEGER NOT NULL,
               code TEXT NOT NULL,
               name TEXT,
-              sid REAL NOT NULL,
-              sia REAL NOT NULL,
-              cargos REAL NOT NULL,
-              abonos REAL NOT NULL,
-              sfd REAL NOT NULL,
-              sfa REAL NOT NULL,
+              sid INTEGER NOT NULL,
+              sia INTEGER NOT NULL,
+              cargos INTEGER NOT NULL,
+              abonos INTEGER NOT NULL,
+              sfd INTEGER NOT NULL,
+              sfa INTEGER NOT NULL,
               is_new INTEGER NOT NULL DEFAULT 0,
               exclude_from_analysis INTEGER NOT NULL DEFAULT 0,
               UNIQUE(period_key, row_id)
+            )"""
+
+
+HISTORY_DDL = f"""
+            CREATE TABLE IF NOT EXISTS period_versions (
+              period_key TEXT NOT NULL,
+              version INTEGER NOT NULL,
+              saved_at TEXT NOT NULL,
+              saved_by TEXT NOT NULL DEFAULT '',
+              filename TEXT,
+              exchange_rate REAL NOT NULL,
+              note TEXT NOT NULL DEFAULT '',
+              row_count INTEGER NOT NULL,
+              added_count INTEGER NOT NULL,
+              changed_count INTEGER NOT NULL,
+              removed_count INTEGER NOT NULL,
+              PRIMARY KEY (period_key, version)
+            );
+
+            CREATE TABLE IF NOT EXISTS period_row_history (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              period_key TEXT NOT NULL,
+              row_id TEXT NOT NULL,
+              row_hash TEXT NOT NULL,
+              valid_from INTEGER NOT NULL,
+              valid_to INTEGER,
+              sort_order INTEGER NOT NULL,
+              code TEXT NOT NULL,
+              name TEXT,
+              {", ".join(f"{c} INTEGER NOT NULL" for c in AMOUNT_COLUMNS)},
+              is_new INTEGER NOT NULL,
+              exclude_from_analysis INTEGER NOT NULL,
+              has_mapping INTEGER NOT NULL,
+              {", ".join(f"{c} TEXT" for c in MAPPING_COLUMNS)}
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_row_history_from ON period_row_history(period_key, valid_from);
+            CREATE INDEX IF NOT EXISTS idx_row_history_to ON period_row_history(period_key, valid_to);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_row_history_open ON period_row_history(period_key, row_id)
+              WHERE valid_to IS NULL"""
+
+
+# Cualquier cambio en account_mappings (tambien editando la BBDD a mano) sube mapping_state.version
+MAPPINGS_DDL = """
+            CREATE TABLE IF NOT EXISTS account_mappings (
+              code TEXT PRIMARY KEY,
+              pgc TEXT NOT NULL,
+              pgc_name TEXT NOT NULL,
+              grupo TEXT NOT NULL,
+              subgrupo TEXT NOT NULL,
+              updated_at TEXT NOT NULL DEFAULT '',
+              updated_by TEXT NOT NULL DEFAULT ''
+            );
+
+            CREATE TABLE IF NOT EXISTS mapping_state (
+              id INTEGER PRIMARY KEY CHECK (id = 1),
+              version INTEGER NOT NULL
+            );
+
+            INSERT OR IGNORE INTO mapping_state(id, version) VALUES (1, 0);
+
+            CREATE TRIGGER IF NOT EXISTS account_mappings_ai AFTER INSERT ON account_mappings BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS account_mappings_au AFTER UPDATE ON account_mappings BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS account_mappings_ad AFTER DELETE ON account_mappings BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END"""
+
+
+# Contador de cambios de los mapeos manuales por linea (el historico de las sugerencias): lo sube
+# cualquier alta, cambio o baja, tambien el ON CONFLICT DO UPDATE del guardado en delta
+MANUAL_MAPPINGS_STATE_DDL = """
+            CREATE TABLE IF NOT EXISTS manual_mapping_state (
+              id INTEGER PRIMARY KEY CHECK (id = 1),
+              version INTEGER NOT NULL
+            );
+
+            INSERT OR IGNORE INTO manual_mapping_state(id, version) VALUES (1, 0);
+
+            CREATE TRIGGER IF NOT EXISTS period_manual_mappings_ai AFTER INSERT ON period_manual_mappings BEGIN
+              UPDATE manual_mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS period_manual_mappings_au AFTER UPDATE ON period_manual_mappings BEGIN
+              UPDATE manual_mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS period_manual_mappings_ad AFTER DELETE ON period_manual_mappings BEGIN
+              UPDATE manual_mapping_state SET version = version + 1 WHERE id = 1;
+            END"""
+
+
+# Reglas de mapeo (ver mapping_rules): rango de cuentas o patron de nombre, signo y prioridad.
+# Forman parte del mapeo: cualquier cambio tambien sube mapping_state.version
+MAPPING_RULES_DDL = """
+            CREATE TABLE IF NOT EXISTS mapping_rules (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              priority INTEGER NOT NULL DEFAULT 0,
+              code_from TEXT NOT NULL DEFAULT '',
+              code_to TEXT NOT NULL DEFAULT '',
+              name_pattern TEXT NOT NULL DEFAULT '',
+              sign TEXT NOT NULL DEFAULT '',
+              pgc TEXT NOT NULL,
+              pgc_name TEXT NOT NULL,
+              grupo TEXT NOT NULL,
+              subgrupo TEXT NOT NULL,
+              note TEXT NOT NULL DEFAULT '',
+              updated_at TEXT NOT NULL DEFAULT '',
+              updated_by TEXT NOT NULL DEFAULT ''
+            );
+
+            CREATE TRIGGER IF NOT EXISTS mapping_rules_ai AFTER INSERT ON mapping_rules BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS mapping_rules_au AFTER UPDATE ON mapping_rules BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS mapping_rules_ad AFTER DELETE ON mapping_rules BEGIN
+              UPDATE mapping_state SET version = version + 1 WHERE id = 1;
+            END"""
+RULE_COLUMNS = ("priority", "code_from", "code_to", "name_pattern", "sign", "pgc", "pgc_name", "grupo", "subgrupo", "note")
+RULE_KEYS = ("priority", "codeFrom", "codeTo", "namePattern", "sign", "pgc", "pgcName", "grupo", "subgrupo", "note")
+
+
+# Importes de las lineas de los estados PGC de cada periodo guardado, validos para su version, los
+# estados compilados (`layout_digest`) y los mapeos que usan sus cuentas (`mapping_fingerprint`)
+STATEMENT_CACHE_DDL = """
+            CREATE TABLE IF NOT EXISTS period_statement_cache (
+              period_key TEXT PRIMARY KEY,
+              version INTEGER NOT NULL,
+              layout_digest TEXT NOT NULL,
+              mapping_version INTEGER NOT NULL,
+              mapping_fingerprint TEXT NOT NULL,
+              line_cents TEXT NOT NULL
+            )"""
+
+
+def _migrate_amounts_to_cents(conn: sqlite3.Connection) -> None:
+    """Reconstruye period_rows con importes INTEGER en centimos conservando ids (y asi el FTS)."""
+    cents = ", ".join(f"CAST(ROUND({c} * 100) AS INTEGER)" for c in AMOUNT_COLUMNS)
+    conn.executescript(
+        f"""
+        BEGIN;
+        DROP TRIGGER IF EXISTS period_rows_fts_ai;
+        DROP TRIGGER IF EXISTS period_rows_fts_ad;
+        DROP TRIGGER IF EXISTS period_rows_fts_au;
+        DROP INDEX IF EXISTS idx_period_rows_code;
+        DROP INDEX IF EXISTS idx_period_rows_saldo;
+        ALTER TABLE period_rows RENAME TO period_rows_real;
+        {PERIOD_ROWS_DDL};
+        INSERT INTO period_rows(
+          id, period_key, row_id, sort_order, code, name, {", ".join(AMOUNT_COLUMNS)}, is_new, exclude_from_analysis
+        )
+        SELECT id, period_key, row_id, sort_order, code, name, {cents}, is_new, exclude_from_analysis
+        FROM period_rows_real;
+        DROP TABLE period_rows_real;
+        COMMIT;
+        """
+    )
+
+
+def init_db() -> None:
+    with pooled_conn() as conn:
+        # WAL: list_periods y las cargas no esperan a un guardado en curso (queda fijado en el fichero)
+        conn.execute("PRAGMA journal_mode = WAL")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        has_rows = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'period_rows'").fetchone()
+        if has_rows and version < 1:
+            _migrate_amounts_to_cents(conn)
+        fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'period_rows_fts'").fetchone()
+        conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS periods (
+              period_key TEXT PRIMARY KEY,
+              year INTEGER NOT NULL,
+              month INTEGER NOT NULL,
+              filename TEXT,
+              exchange_rate REAL NOT NULL,
+              uploaded_at TEXT NOT NULL,
+              version INTEGER NOT NULL DEFAULT 0
             );
 
+            {PERIOD_ROWS_DDL};
+
             CREATE TABLE IF NOT EXISTS period_manual_mappings (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               period_key TEXT NOT NULL,
@@ -58,11 +351,83 @@ def init_db() -> None:
               subgrupo TEXT,
               UNIQUE(period_key, row_id)
             );
+
+            CREATE INDEX IF NOT EXISTS idx_period_rows_code ON period_rows(code, period_key);
+            CREATE INDEX IF NOT EXISTS idx_period_rows_saldo ON period_rows((sfd - sfa));
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS period_rows_fts USING fts5(
+              code,
+              name,
+              content = 'period_rows',
+              content_rowid = 'id',
+              tokenize = 'unicode61 remove_diacritics 2'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS period_rows_fts_ai AFTER INSERT ON period_rows BEGIN
+              INSERT INTO period_rows_fts(rowid, code, name) VALUES (new.id, new.code, new.name);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS period_rows_fts_ad AFTER DELETE ON period_rows BEGIN
+              INSERT INTO period_rows_fts(period_rows_fts, rowid, code, name) VALUES ('delete', old.id, old.code, old.name);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS period_rows_fts_au AFTER UPDATE OF code, name ON period_rows BEGIN
+              INSERT INTO period_rows_fts(period_rows_fts, rowid, code, name) VALUES ('delete', old.id, old.code, old.name);
+              INSERT INTO period_rows_fts(rowid, code, name) VALUES (new.id, new.code, new.name);
+            END;
+
+            {HISTORY_DDL};
+
+            {MAPPINGS_DDL};
+
+            {MANUAL_MAPPINGS_STATE_DDL};
+
+            {MAPPING_RULES_DDL};
+
+            {STATEMENT_CACHE_DDL};
             """
         )
+        if not fts_exists:
+            # Bases creadas antes del indice: se indexan una vez las filas ya guardadas
+            conn.execute("INSERT INTO period_rows_fts(period_rows_fts) VALUES ('rebuild')")
+        if version < 2:
+            _seed_period_history(conn)
+        if version < 3:
+            _seed_account_mappings(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
-    finally:
-        conn.close()
+
+
+def _seed_period_history(conn: sqlite3.Connection) -> None:
+    """Periodos guardados antes del historial: su estado actual pasa a ser la version 1."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(periods)")}
+    if "version" not in columns:
+        conn.execute("ALTER TABLE periods ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    pending = conn.execute(
+        """
+        SELECT period_key, filename, exchange_rate, uploaded_at FROM periods p
+        WHERE NOT EXISTS (SELECT 1 FROM period_versions v WHERE v.period_key = p.period_key)
+        """
+    ).fetchall()
+    for p in pending:
+        _record_version(
+            conn,
+            p["period_key"],
+            saved_at=p["uploaded_at"],
+            saved_by="",
+            filename=p["filename"],
+            exchange_rate=p["exchange_rate"],
+            note="Estado anterior al historial",
+        )
+
+
+def _seed_account_mappings(conn: sqlite3.Connection) -> None:
+    with MAPPING_SEED_FILE.open("r", encoding="utf-8") as f:
+        seed: dict[str, dict[str, str]] = json.load(f)
+    conn.executemany(
+        "INSERT OR IGNORE INTO account_mappings(code, pgc, pgc_name, grupo, subgrupo) VALUES (?, ?, ?, ?, ?)",
+        [(code, m["pgc"], m["pgcName"], m["grupo"], m["subgrupo"]) for code, m in seed.items()],
+    )
 
 
 def build_period_key(year: int, month: int) -> str:
@@ -70,8 +435,7 @@ def build_period_key(year: int, month: int) -> str:
 
 
 def list_periods() -> list[dict[str, Any]]:
-    conn = get_conn()
-    try:
+    with pooled_conn() as conn:
         cur = conn.execute(
             """
             SELECT
@@ -87,8 +451,13 @@ def list_periods() -> list[dict[str, Any]]:
             """
         )
         return [dict(r) for r in cur.fetchall()]
-    finally:
-        conn.close()
+
+
+def period_version(year: int, month: int) -> int:
+    """Version vigente del periodo (0 si no se ha guardado nunca)."""
+    with pooled_conn() as conn:
+        row = conn.execute("SELECT version FROM periods WHERE period_key = ?", (build_period_key(year, month),)).fetchone()
+    return int(row[0]) if row else 0
 
 
 def save_period_data(
@@ -100,11 +469,49 @@ def save_period_data(
     rows: list[dict[str, Any]],
     manual_mappings: dict[str, dict[str, Any]],
     uploaded_at: str,
-) -> None:
+    saved_by: str = "",
+    note: str = "",
+    expected_version: int | None = None,
+) -> int:
+    """Sustituye las lineas del periodo y registra la nueva version en el historial; devuelve su numero.
+
+    Con `expected_version` (la version cargada, 0 si el periodo es nuevo) falla con
+    `PeriodConflictError` si otra sesion guardo el periodo entre medias, en vez de pisar sus cambios.
+    """
     period_key = build_period_key(year, month)
-    conn = get_conn()
-    try:
-        conn.execute("BEGIN")
+    row_params = [
+        (
+            period_key,
+            row.get("_rowId"),
+            idx,
+            row.get("code"),
+            row.get("name"),
+            *(to_cents(row.get(c)) for c in AMOUNT_COLUMNS),
+            1 if row.get("_isNew") else 0,
+            1 if row.get("_excludeFromAnalysis") else 0,
+        )
+        for idx, row in enumerate(rows)
+    ]
+    mapping_params = [
+        (
+            period_key,
+            row_id,
+            mapping.get("pgc"),
+            mapping.get("pgcName"),
+            mapping.get("grupo"),
+            mapping.get("subgrupo"),
+        )
+        for row_id, mapping in (manual_mappings or {}).items()
+    ]
+    # El contenido versionado de cada linea (y su hash) se calcula aqui, fuera de la transaccion
+    mapped = {p[1]: p[2:] for p in mapping_params}
+    no_mapping = (None,) * len(MAPPING_COLUMNS)
+    history = _history_entries(
+        (p[1], p[2], (*p[3:], 1 if p[1] in mapped else 0, *mapped.get(p[1], no_mapping))) for p in row_params
+    )
+
+    def write(conn: sqlite3.Connection) -> int:
+        _check_version(conn, period_key, expected_version)
         conn.execute(
             """
             INSERT INTO periods(period_key, year, month, filename, exchange_rate, uploaded_at)
@@ -118,59 +525,194 @@ def save_period_data(
         )
         conn.execute("DELETE FROM period_rows WHERE period_key = ?", (period_key,))
         conn.execute("DELETE FROM period_manual_mappings WHERE period_key = ?", (period_key,))
+        conn.executemany(
+            """
+            INSERT INTO period_rows(
+              period_key, row_id, sort_order, code, name, sid, sia, cargos, abonos, sfd, sfa, is_new, exclude_from_analysis
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            row_params,
+        )
+        conn.executemany(
+            """
+            INSERT INTO period_manual_mappings(period_key, row_id, pgc, pgc_name, grupo, subgrupo)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            mapping_params,
+        )
+        return _record_version(
+            conn,
+            period_key,
+            saved_at=uploaded_at,
+            saved_by=saved_by,
+            filename=filename,
+            exchange_rate=exchange_rate,
+            note=note,
+            current=history,
+        )
 
-        for idx, row in enumerate(rows):
-            conn.execute(
-                """
-                INSERT INTO period_rows(
-                  period_key, row_id, sort_order, code, name, sid, sia, cargos, abonos, sfd, sfa, is_new, exclude_from_analysis
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    period_key,
-                    row.get("_rowId"),
-                    idx,
-                    row.get("code"),
-                    row.get("name"),
-                    float(row.get("sid", 0) or 0),
-                    float(row.get("sia", 0) or 0),
-                    float(row.get("cargos", 0) or 0),
-                    float(row.get("abonos", 0) or 0),
-                    float(row.get("sfd", 0) or 0),
-                    float(row.get("sfa", 0) or 0),
-                    1 if row.get("_isNew") else 0,
-                    1 if row.get("_excludeFromAnalysis") else 0,
-                ),
-            )
+    return _write(write)
 
-        for row_id, mapping in (manual_mappings or {}).items():
-            conn.execute(
-                """
-                INSERT INTO period_manual_mappings(period_key, row_id, pgc, pgc_name, grupo, subgrupo)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    period_key,
-                    row_id,
-                    mapping.get("pgc"),
-                    mapping.get("pgcName"),
-                    mapping.get("grupo"),
-                    mapping.get("subgrupo"),
-                ),
+
+def save_period_delta(
+    *,
+    year: int,
+    month: int,
+    filename: str,
+    exchange_rate: float,
+    rows: list[dict[str, Any]],
+    changed_row_ids: set[str],
+    removed_row_ids: set[str],
+    manual_mappings: dict[str, dict[str, Any]],
+    uploaded_at: str,
+    saved_by: str = "",
+    expected_version: int | None = None,
+    moved_row_ids: Collection[str] = frozenset(),
+) -> dict[str, int]:
+    """Guarda solo las lineas nuevas/modificadas/eliminadas y los mapeos que difieren de lo guardado.
+
+    El delta se calcula contra una version concreta: con `expected_version` falla con
+    `PeriodConflictError` si el periodo ya no esta en esa version. `sort_order` es la posicion de
+    la linea (0..n-1); de las lineas sin cambios solo se renumeran `moved_row_ids`, las que una alta
+    o baja intermedia ha desplazado (`diff_period_rows`). El historial tambien se anota solo con
+    las lineas tocadas, asi que el coste crece con los cambios y no con el tamano del periodo.
+    """
+    period_key = build_period_key(year, month)
+    positions = dict(zip([row.get("_rowId") for row in rows], range(len(rows))))
+
+    def row_param(row_id: str) -> tuple[Any, ...]:
+        idx = positions[row_id]
+        row = rows[idx]
+        return (
+            period_key,
+            row_id,
+            idx,
+            row.get("code"),
+            row.get("name"),
+            *(to_cents(row.get(c)) for c in AMOUNT_COLUMNS),
+            1 if row.get("_isNew") else 0,
+            1 if row.get("_excludeFromAnalysis") else 0,
+        )
+
+    row_params = [row_param(row_id) for row_id in changed_row_ids if row_id in positions]
+    removed_params = [(period_key, row_id) for row_id in removed_row_ids]
+    reordered = {
+        row_id: positions[row_id] for row_id in moved_row_ids if row_id in positions and row_id not in changed_row_ids
+    }
+    reorder_params = [(idx, period_key, row_id) for row_id, idx in reordered.items()]
+    current = {
+        row_id: (m.get("pgc"), m.get("pgcName"), m.get("grupo"), m.get("subgrupo"))
+        for row_id, m in (manual_mappings or {}).items()
+    }
+
+    def write(conn: sqlite3.Connection) -> dict[str, int]:
+        _check_version(conn, period_key, expected_version)
+        conn.execute(
+            """
+            UPDATE periods SET filename = ?, exchange_rate = ?, uploaded_at = ?
+            WHERE period_key = ?
+            """,
+            (filename, exchange_rate, uploaded_at, period_key),
+        )
+        conn.executemany(
+            """
+            INSERT INTO period_rows(
+              period_key, row_id, sort_order, code, name, sid, sia, cargos, abonos, sfd, sfa, is_new, exclude_from_analysis
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(period_key, row_id) DO UPDATE SET
+              sort_order = excluded.sort_order,
+              code = excluded.code,
+              name = excluded.name,
+              sid = excluded.sid,
+              sia = excluded.sia,
+              cargos = excluded.cargos,
+              abonos = excluded.abonos,
+              sfd = excluded.sfd,
+              sfa = excluded.sfa,
+              is_new = excluded.is_new,
+              exclude_from_analysis = excluded.exclude_from_analysis
+            """,
+            row_params,
+        )
+        conn.executemany("DELETE FROM period_rows WHERE period_key = ? AND row_id = ?", removed_params)
+        conn.executemany("UPDATE period_rows SET sort_order = ? WHERE period_key = ? AND row_id = ?", reorder_params)
+
+        stored = {
+            m["row_id"]: (m["pgc"], m["pgc_name"], m["grupo"], m["subgrupo"])
+            for m in conn.execute(
+                "SELECT row_id, pgc, pgc_name, grupo, subgrupo FROM period_manual_mappings WHERE period_key = ?",
+                (period_key,),
             )
+        }
+        mapping_upserts = [(period_key, row_id, *values) for row_id, values in current.items() if stored.get(row_id) != values]
+        mapping_deletes = [(period_key, row_id) for row_id in stored if row_id not in current]
+        conn.executemany(
+            """
+            INSERT INTO period_manual_mappings(period_key, row_id, pgc, pgc_name, grupo, subgrupo)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(period_key, row_id) DO UPDATE SET
+              pgc = excluded.pgc,
+              pgc_name = excluded.pgc_name,
+              grupo = excluded.grupo,
+              subgrupo = excluded.subgrupo
+            """,
+            mapping_upserts,
+        )
+        conn.executemany("DELETE FROM period_manual_mappings WHERE period_key = ? AND row_id = ?", mapping_deletes)
+        # Historial de las lineas tocadas: cambiadas o con el mapeo manual cambiado
+        touched = {p[1] for p in row_params} | {p[1] for p in mapping_upserts} | {p[1] for p in mapping_deletes}
+        no_mapping = (None,) * len(MAPPING_COLUMNS)
+        history = _history_entries(
+            (p[1], p[2], (*p[3:], 1 if p[1] in current else 0, *current.get(p[1], no_mapping)))
+            for p in map(row_param, touched & positions.keys())
+        )
+        version = _record_version(
+            conn,
+            period_key,
+            saved_at=uploaded_at,
+            saved_by=saved_by,
+            filename=filename,
+            exchange_rate=exchange_rate,
+            current=history,
+            partial=PartialHistory(removed_row_ids, reordered, len(rows)),
+        )
+        return {
+            "rowsWritten": len(row_params),
+            "rowsDeleted": len(removed_params),
+            "rowsReordered": len(reorder_params),
+            "mappingsWritten": len(mapping_upserts),
+            "mappingsDeleted": len(mapping_deletes),
+            "version": version,
+        }
 
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+    return _write(write)
+
+
+def _row_dict(r: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "_rowId": r["row_id"],
+        "_isNew": bool(r["is_new"]),
+        "_excludeFromAnalysis": bool(r["exclude_from_analysis"]),
+        "code": r["code"],
+        "name": r["name"],
+        **{c: from_cents(r[c] or 0) for c in AMOUNT_COLUMNS},
+    }
+
+
+def _mapping_dict(m: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "pgc": m["pgc"] or "",
+        "pgcName": m["pgc_name"] or "",
+        "grupo": m["grupo"] or "Sin clasificar",
+        "subgrupo": m["subgrupo"] or "Sin clasificar",
+    }
 
 
 def load_period_data(year: int, month: int) -> dict[str, Any] | None:
     period_key = build_period_key(year, month)
-    conn = get_conn()
-    try:
+    with pooled_conn() as conn:
+        # Una sola transaccion de lectura: la version del periodo corresponde a las lineas leidas
+        conn.execute("BEGIN")
         period = conn.execute("SELECT * FROM periods WHERE period_key = ?", (period_key,)).fetchone()
         if not period:
             return None
@@ -184,41 +726,578 @@ def load_period_data(year: int, month: int) -> dict[str, Any] | None:
             """,
             (period_key,),
         )
-        rows = []
-        for r in rows_cur.fetchall():
-            rows.append(
-                {
-                    "_rowId": r["row_id"],
-                    "_isNew": bool(r["is_new"]),
-                    "_excludeFromAnalysis": bool(r["exclude_from_analysis"]),
-                    "code": r["code"],
-                    "name": r["name"],
-                    "sid": float(r["sid"] or 0),
-                    "sia": float(r["sia"] or 0),
-                    "cargos": float(r["cargos"] or 0),
-                    "abonos": float(r["abonos"] or 0),
-                    "sfd": float(r["sfd"] or 0),
-                    "sfa": float(r["sfa"] or 0),
-                }
-            )
+        rows = [_row_dict(r) for r in rows_cur.fetchall()]
 
         mapping_cur = conn.execute(
             "SELECT row_id, pgc, pgc_name, grupo, subgrupo FROM period_manual_mappings WHERE period_key = ?",
             (period_key,),
         )
-        manual_mappings: dict[str, dict[str, Any]] = {}
-        for m in mapping_cur.fetchall():
-            manual_mappings[m["row_id"]] = {
-                "pgc": m["pgc"] or "",
-                "pgcName": m["pgc_name"] or "",
-                "grupo": m["grupo"] or "Sin clasificar",
-                "subgrupo": m["subgrupo"] or "Sin clasificar",
-            }
+        manual_mappings = {m["row_id"]: _mapping_dict(m) for m in mapping_cur.fetchall()}
 
         return {
             "period": dict(period),
             "rows": rows,
             "manualMappings": manual_mappings,
         }
-    finally:
-        conn.close()
+
+
+def _row_hash(values: tuple[Any, ...]) -> str:
+    return hashlib.blake2b("\x1f".join(map(str, values)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _version_filter(alias: str = "h") -> str:
+    return f"{alias}.period_key = ? AND {alias}.valid_from <= ? AND ({alias}.valid_to IS NULL OR {alias}.valid_to > ?)"
+
+
+# (row_id, sort_order, row_hash, valores en el orden de HISTORY_COLUMNS) de cada linea del periodo
+HistoryEntry = tuple[str, int, str, tuple[Any, ...]]
+
+
+def _history_entries(records: Iterable[tuple[str, int, tuple[Any, ...]]]) -> list[HistoryEntry]:
+    return [(row_id, sort_order, _row_hash(values), values) for row_id, sort_order, values in records]
+
+
+@dataclass(frozen=True)
+class PartialHistory:
+    """Guardado en delta para `_record_version`: lo que no esta en `current` sigue igual."""
+
+    removed_row_ids: Collection[str]
+    # row_id -> nueva posicion de las lineas que solo se movieron
+    reordered: dict[str, int]
+    row_count: int
+
+
+def _open_history(conn: sqlite3.Connection, period_key: str, row_ids: Iterable[str] | None) -> dict[str, tuple[int, str, int]]:
+    """Lineas abiertas del historial (id, hash, sort_order) de todo el periodo o solo de `row_ids`."""
+    query = "SELECT id, row_id, row_hash, sort_order FROM period_row_history WHERE period_key = ? AND valid_to IS NULL"
+    if row_ids is None:
+        return {r["row_id"]: (r["id"], r["row_hash"], r["sort_order"]) for r in conn.execute(query, (period_key,))}
+    ids = list(row_ids)
+    out: dict[str, tuple[int, str, int]] = {}
+    for start in range(0, len(ids), HISTORY_LOOKUP_CHUNK):
+        chunk = ids[start : start + HISTORY_LOOKUP_CHUNK]
+        for r in conn.execute(f"{query} AND row_id IN ({', '.join('?' for _ in chunk)})", (period_key, *chunk)):
+            out[r["row_id"]] = (r["id"], r["row_hash"], r["sort_order"])
+    return out
+
+
+def _record_version(
+    conn: sqlite3.Connection,
+    period_key: str,
+    *,
+    saved_at: str,
+    saved_by: str,
+    filename: str | None,
+    exchange_rate: float,
+    note: str = "",
+    current: list[HistoryEntry] | None = None,
+    partial: PartialHistory | None = None,
+) -> int:
+    """Anota en el historial el estado actual de period_rows + mapeos como una nueva version.
+
+    Cada linea del historial es valida en el intervalo de versiones [valid_from, valid_to); solo se
+    escriben las lineas cuyo hash de contenido cambia (nuevas o modificadas) y se cierran las
+    modificadas o eliminadas, asi que el historial crece con los cambios y no con el tamano del periodo.
+    Si una linea solo cambia de posicion se actualiza su sort_order sin crear version de la linea.
+    `current` es el contenido que acaba de escribirse, si se conoce; si no, se lee de period_rows.
+    Con `partial` (guardado en delta) `current` son solo las lineas tocadas: se leen y cierran
+    unicamente esas, las eliminadas y las movidas, y el resto del historial abierto sigue valido.
+    """
+    version = conn.execute(
+        "SELECT COALESCE(MAX(version), 0) + 1 FROM period_versions WHERE period_key = ?", (period_key,)
+    ).fetchone()[0]
+    if partial is not None and current is not None:
+        open_rows = _open_history(
+            conn, period_key, itertools.chain((e[0] for e in current), partial.removed_row_ids, partial.reordered)
+        )
+    else:
+        open_rows = _open_history(conn, period_key, None)
+    if current is None:
+        current = _history_entries(
+            (r[0], r[1], tuple(r[2:]))
+            for r in conn.execute(
+                f"""
+                SELECT r.row_id, r.sort_order, r.code, r.name, {", ".join(f"r.{c}" for c in AMOUNT_COLUMNS)},
+                  r.is_new, r.exclude_from_analysis, m.row_id IS NOT NULL AS has_mapping,
+                  {", ".join(f"m.{c}" for c in MAPPING_COLUMNS)}
+                FROM period_rows r
+                LEFT JOIN period_manual_mappings m ON m.period_key = r.period_key AND m.row_id = r.row_id
+                WHERE r.period_key = ?
+                """,
+                (period_key,),
+            )
+        )
+
+    inserts: list[tuple[Any, ...]] = []
+    closes: list[tuple[int, int]] = []
+    reorders: list[tuple[int, int]] = []
+    added = changed = 0
+    for row_id, sort_order, row_hash, values in current:
+        previous = open_rows.pop(row_id, None)
+        if previous is not None and previous[1] == row_hash:
+            if previous[2] != sort_order:
+                reorders.append((sort_order, previous[0]))
+            continue
+        if previous is None:
+            added += 1
+        else:
+            changed += 1
+            closes.append((version, previous[0]))
+        inserts.append((period_key, row_id, row_hash, version, sort_order, *values))
+    if partial is not None:
+        for row_id, sort_order in partial.reordered.items():
+            previous = open_rows.pop(row_id, None)
+            if previous is not None and previous[2] != sort_order:
+                reorders.append((sort_order, previous[0]))
+    # Lo que queda abierto sin aparecer en `current` (o, en delta, entre las eliminadas) se cierra
+    closes.extend((version, previous[0]) for previous in open_rows.values())
+
+    conn.executemany("UPDATE period_row_history SET valid_to = ? WHERE id = ?", closes)
+    conn.executemany("UPDATE period_row_history SET sort_order = ? WHERE id = ?", reorders)
+    conn.executemany(
+        f"""
+        INSERT INTO period_row_history(period_key, row_id, row_hash, valid_from, sort_order, {", ".join(HISTORY_COLUMNS)})
+        VALUES ({", ".join("?" for _ in range(5 + len(HISTORY_COLUMNS)))})
+        """,
+        inserts,
+    )
+    conn.execute(
+        """
+        INSERT INTO period_versions(
+          period_key, version, saved_at, saved_by, filename, exchange_rate, note,
+          row_count, added_count, changed_count, removed_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            period_key,
+            version,
+            saved_at,
+            saved_by or "",
+            filename,
+            exchange_rate,
+            note,
+            len(current) if partial is None else partial.row_count,
+            added,
+            changed,
+            len(open_rows),
+        ),
+    )
+    conn.execute("UPDATE periods SET version = ? WHERE period_key = ?", (version, period_key))
+    return int(version)
+
+
+def _version_dict(v: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "version": v["version"],
+        "savedAt": v["saved_at"],
+        "savedBy": v["saved_by"],
+        "filename": v["filename"],
+        "exchangeRate": v["exchange_rate"],
+        "note": v["note"],
+        "rowCount": v["row_count"],
+        "addedCount": v["added_count"],
+        "changedCount": v["changed_count"],
+        "removedCount": v["removed_count"],
+    }
+
+
+def list_period_versions(year: int, month: int) -> list[dict[str, Any]]:
+    with pooled_conn() as conn:
+        cur = conn.execute(
+            "SELECT * FROM period_versions WHERE period_key = ? ORDER BY version DESC",
+            (build_period_key(year, month),),
+        )
+        return [_version_dict(v) for v in cur.fetchall()]
+
+
+def load_period_version(year: int, month: int, version: int) -> dict[str, Any] | None:
+    """Reconstruye una version guardada con la misma forma que `load_period_data`."""
+    period_key = build_period_key(year, month)
+    with pooled_conn() as conn:
+        meta = conn.execute(
+            "SELECT * FROM period_versions WHERE period_key = ? AND version = ?", (period_key, int(version))
+        ).fetchone()
+        if not meta:
+            return None
+        records = conn.execute(
+            f"SELECT * FROM period_row_history h WHERE {_version_filter()} ORDER BY h.sort_order ASC",
+            (period_key, int(version), int(version)),
+        ).fetchall()
+    return {
+        "period": {
+            "period_key": period_key,
+            "year": year,
+            "month": month,
+            "filename": meta["filename"],
+            "exchange_rate": meta["exchange_rate"],
+            "uploaded_at": meta["saved_at"],
+            "version": meta["version"],
+            "saved_by": meta["saved_by"],
+        },
+        "rows": [_row_dict(r) for r in records],
+        "manualMappings": {r["row_id"]: _mapping_dict(r) for r in records if r["has_mapping"]},
+    }
+
+
+def _changed_fields(before: sqlite3.Row, after: sqlite3.Row) -> list[str]:
+    fields = [c for c in ("code", "name", *AMOUNT_COLUMNS, "is_new", "exclude_from_analysis") if before[c] != after[c]]
+    if any(before[c] != after[c] for c in ("has_mapping", *MAPPING_COLUMNS)):
+        fields.append("mapping")
+    return fields
+
+
+def _history_row(r: sqlite3.Row) -> dict[str, Any]:
+    return {**_row_dict(r), "mapping": _mapping_dict(r) if r["has_mapping"] else None}
+
+
+def diff_period_versions(year: int, month: int, from_version: int, to_version: int) -> dict[str, Any]:
+    """Lineas nuevas, eliminadas y modificadas entre dos versiones de un periodo.
+
+    Solo se leen las lineas del historial cuyo intervalo empieza o acaba entre ambas versiones.
+    """
+    period_key = build_period_key(year, month)
+    low, high = sorted((int(from_version), int(to_version)))
+    with pooled_conn() as conn:
+        only_low = conn.execute(
+            """
+            SELECT * FROM period_row_history
+            WHERE period_key = ? AND valid_from <= ? AND valid_to > ? AND valid_to <= ?
+            """,
+            (period_key, low, low, high),
+        ).fetchall()
+        only_high = conn.execute(
+            """
+            SELECT * FROM period_row_history
+            WHERE period_key = ? AND valid_from > ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)
+            """,
+            (period_key, low, high, high),
+        ).fetchall()
+    before_rows, after_rows = (only_low, only_high) if low == int(from_version) else (only_high, only_low)
+    before = {r["row_id"]: r for r in before_rows}
+    after = {r["row_id"]: r for r in after_rows}
+
+    changed = [
+        {
+            "_rowId": row_id,
+            "code": r["code"],
+            "name": r["name"] or "",
+            "fields": _changed_fields(before[row_id], r),
+            "before": _history_row(before[row_id]),
+            "after": _history_row(r),
+        }
+        for row_id, r in after.items()
+        if row_id in before
+    ]
+    changed = [c for c in changed if c["fields"]]
+    return {
+        "periodKey": period_key,
+        "fromVersion": int(from_version),
+        "toVersion": int(to_version),
+        "added": [_history_row(r) for row_id, r in after.items() if row_id not in before],
+        "removed": [_history_row(r) for row_id, r in before.items() if row_id not in after],
+        "changed": sorted(changed, key=lambda c: str(c["code"])),
+    }
+
+
+def rollback_period(
+    year: int,
+    month: int,
+    version: int,
+    *,
+    saved_by: str = "",
+    uploaded_at: str,
+    expected_version: int | None = None,
+) -> int:
+    """Vuelve el periodo al estado de `version` guardandolo como una version nueva (no se borra historial)."""
+    payload = load_period_version(year, month, version)
+    if payload is None:
+        raise ValueError(f"No existe la version {version} del periodo {build_period_key(year, month)}")
+    return save_period_data(
+        year=year,
+        month=month,
+        filename=payload["period"]["filename"],
+        exchange_rate=float(payload["period"]["exchange_rate"]),
+        rows=payload["rows"],
+        manual_mappings=payload["manualMappings"],
+        uploaded_at=uploaded_at,
+        saved_by=saved_by,
+        note=f"Restaurada la version {int(version)}",
+        expected_version=expected_version,
+    )
+
+
+def load_mapping_history() -> list[dict[str, Any]]:
+    with pooled_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT DISTINCT r.code, r.name, m.pgc, m.pgc_name, m.grupo, m.subgrupo
+            FROM period_manual_mappings m
+            JOIN period_rows r ON r.period_key = m.period_key AND r.row_id = m.row_id
+            WHERE COALESCE(TRIM(m.pgc), '') NOT IN ('', 'SIN MAPEO')
+            """
+        )
+        return [
+            {
+                "code": r["code"],
+                "name": r["name"] or "",
+                "pgc": r["pgc"],
+                "pgcName": r["pgc_name"] or "",
+                "grupo": r["grupo"] or "Sin clasificar",
+                "subgrupo": r["subgrupo"] or "Sin clasificar",
+            }
+            for r in cur.fetchall()
+        ]
+
+
+def mapping_history_fingerprint() -> int:
+    """Version de los mapeos manuales guardados (manual_mapping_state): cambia con cualquier escritura."""
+    with pooled_conn() as conn:
+        return int(conn.execute("SELECT version FROM manual_mapping_state WHERE id = 1").fetchone()[0])
+
+
+def _rule_dict(r: sqlite3.Row) -> dict[str, Any]:
+    return {"id": r["id"], **{key: r[column] for key, column in zip(RULE_KEYS, RULE_COLUMNS)}}
+
+
+def load_account_mappings() -> tuple[int, dict[str, dict[str, str]], list[dict[str, Any]]]:
+    """Version, mapeo de cuentas y reglas leidos en la misma transaccion (nunca una mezcla de dos versiones)."""
+    with pooled_conn() as conn:
+        conn.execute("BEGIN")
+        version = conn.execute("SELECT version FROM mapping_state WHERE id = 1").fetchone()[0]
+        cur = conn.execute("SELECT code, pgc, pgc_name, grupo, subgrupo FROM account_mappings ORDER BY code")
+        mappings = {
+            r["code"]: {"pgc": r["pgc"], "pgcName": r["pgc_name"], "grupo": r["grupo"], "subgrupo": r["subgrupo"]}
+            for r in cur.fetchall()
+        }
+        rules = [_rule_dict(r) for r in conn.execute("SELECT * FROM mapping_rules ORDER BY id")]
+        conn.commit()
+    return int(version), mappings, rules
+
+
+def account_mapping_version() -> int:
+    with pooled_conn() as conn:
+        return int(conn.execute("SELECT version FROM mapping_state WHERE id = 1").fetchone()[0])
+
+
+def save_account_mappings(
+    upserts: dict[str, dict[str, Any]],
+    deletes: list[str] | set[str],
+    *,
+    updated_by: str = "",
+    updated_at: str,
+) -> int:
+    """Alta/modificacion y baja de prefijos de cuenta; devuelve la nueva version del mapeo."""
+    params = []
+    for code, m in upserts.items():
+        values = [str(m.get(k) or "").strip() for k in ("pgc", "pgcName", "grupo", "subgrupo")]
+        if not str(code).strip() or not all(values):
+            raise ValueError(f"Mapeo incompleto para la cuenta {code!r}: pgc, pgcName, grupo y subgrupo son obligatorios")
+        params.append((str(code).strip(), *values, updated_at, updated_by or ""))
+
+    def write(conn: sqlite3.Connection) -> int:
+        conn.executemany(
+            """
+            INSERT INTO account_mappings(code, pgc, pgc_name, grupo, subgrupo, updated_at, updated_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(code) DO UPDATE SET
+              pgc = excluded.pgc,
+              pgc_name = excluded.pgc_name,
+              grupo = excluded.grupo,
+              subgrupo = excluded.subgrupo,
+              updated_at = excluded.updated_at,
+              updated_by = excluded.updated_by
+            WHERE (pgc, pgc_name, grupo, subgrupo) IS NOT (excluded.pgc, excluded.pgc_name, excluded.grupo, excluded.subgrupo)
+            """,
+            params,
+        )
+        conn.executemany("DELETE FROM account_mappings WHERE code = ?", [(str(code).strip(),) for code in deletes])
+        return int(conn.execute("SELECT version FROM mapping_state WHERE id = 1").fetchone()[0])
+
+    return _write(write)
+
+
+def save_mapping_rules(rules: list[dict[str, Any]], *, updated_by: str = "", updated_at: str) -> int:
+    """Sustituye el juego de reglas: con `id` se actualizan, sin `id` se dan de alta y
+    las que no vienen se borran. Solo se escriben las que cambian; devuelve la nueva version del mapeo."""
+    # Compilarlas valida cada regla y que los patrones de nombre se puedan combinar
+    rules = CompiledRules(rules).rules
+    params = [tuple(rule[key] for key in RULE_KEYS) for rule in rules]
+
+    def write(conn: sqlite3.Connection) -> int:
+        stored = {r["id"]: r for r in conn.execute("SELECT * FROM mapping_rules")}
+        keep = {int(rule["id"]) for rule in rules if rule.get("id") is not None}
+        unknown = keep - stored.keys()
+        if unknown:
+            raise ValueError(f"No existen las reglas {sorted(unknown)}")
+        conn.executemany("DELETE FROM mapping_rules WHERE id = ?", [(rule_id,) for rule_id in stored if rule_id not in keep])
+        for rule, values in zip(rules, params):
+            if rule.get("id") is None:
+                conn.execute(
+                    f"INSERT INTO mapping_rules({', '.join(RULE_COLUMNS)}, updated_at, updated_by) "
+                    f"VALUES ({', '.join('?' * (len(RULE_COLUMNS) + 2))})",
+                    (*values, updated_at, updated_by or ""),
+                )
+            elif tuple(stored[int(rule["id"])][c] for c in RULE_COLUMNS) != values:
+                conn.execute(
+                    f"UPDATE mapping_rules SET {', '.join(f'{c} = ?' for c in RULE_COLUMNS)}, updated_at = ?, updated_by = ? WHERE id = ?",
+                    (*values, updated_at, updated_by or "", int(rule["id"])),
+                )
+        return int(conn.execute("SELECT version FROM mapping_state WHERE id = 1").fetchone()[0])
+
+    return _write(write)
+
+
+def load_statement_cache() -> list[dict[str, Any]]:
+    """Periodos guardados (por fecha) con su version actual y lo cacheado de sus estados, si hay."""
+    with pooled_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT p.period_key, p.year, p.month, p.version, p.exchange_rate,
+                   c.version AS cached_version, c.layout_digest, c.mapping_version, c.mapping_fingerprint, c.line_cents
+            FROM periods p
+            LEFT JOIN period_statement_cache c ON c.period_key = p.period_key
+            ORDER BY p.year ASC, p.month ASC
+            """
+        )
+        return [
+            {
+                "periodKey": r["period_key"],
+                "year": r["year"],
+                "month": r["month"],
+                "version": r["version"],
+                "exchangeRate": r["exchange_rate"],
+                "cachedVersion": r["cached_version"],
+                "layoutDigest": r["layout_digest"],
+                "mappingVersion": r["mapping_version"],
+                "mappingFingerprint": r["mapping_fingerprint"],
+                "lineCents": json.loads(r["line_cents"]) if r["line_cents"] else None,
+            }
+            for r in cur.fetchall()
+        ]
+
+
+def save_statement_cache(
+    period_key: str,
+    *,
+    version: int,
+    layout_digest: str,
+    mapping_version: int,
+    mapping_fingerprint: str,
+    line_cents: list[list[int]],
+) -> bool:
+    """Guarda los importes de los estados de `version`; no escribe nada si el periodo ya va por otra."""
+    params = (
+        period_key,
+        version,
+        layout_digest,
+        mapping_version,
+        mapping_fingerprint,
+        json.dumps(line_cents, separators=(",", ":")),
+        period_key,
+        version,
+    )
+
+    def write(conn: sqlite3.Connection) -> bool:
+        cur = conn.execute(
+            """
+            INSERT INTO period_statement_cache(period_key, version, layout_digest, mapping_version, mapping_fingerprint, line_cents)
+            SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM periods WHERE period_key = ? AND version = ?)
+            ON CONFLICT(period_key) DO UPDATE SET
+              version = excluded.version,
+              layout_digest = excluded.layout_digest,
+              mapping_version = excluded.mapping_version,
+              mapping_fingerprint = excluded.mapping_fingerprint,
+              line_cents = excluded.line_cents
+            """,
+            params,
+        )
+        return cur.rowcount > 0
+
+    return _write(write)
+
+
+def touch_statement_cache(period_key: str, *, version: int, mapping_version: int) -> None:
+    """El mapeo cambio pero no en las cuentas del periodo: lo cacheado sigue valido para la nueva version."""
+
+    def write(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "UPDATE period_statement_cache SET mapping_version = ? WHERE period_key = ? AND version = ?",
+            (mapping_version, period_key, version),
+        )
+
+    _write(write)
+
+
+def period_codes(period_key: str) -> list[str]:
+    with pooled_conn() as conn:
+        return [r[0] for r in conn.execute("SELECT DISTINCT code FROM period_rows WHERE period_key = ?", (period_key,))]
+
+
+def _fts_query(text: str) -> str:
+    tokens = [t.replace('"', "") for t in str(text or "").split()]
+    return " ".join(f'"{t}"*' for t in tokens if t)
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def search_period_rows(
+    *,
+    text: str = "",
+    code_prefix: str = "",
+    min_saldo: float | None = None,
+    max_saldo: float | None = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> dict[str, Any]:
+    """Busca lineas en todos los periodos guardados, paginado.
+
+    `text` busca palabras (o su inicio) en codigo y nombre sin distinguir acentos; `code_prefix`
+    acepta `601` o `601-*`; el saldo es `sfd - sfa`.
+    """
+    where: list[str] = []
+    params: list[Any] = []
+    match = _fts_query(text)
+    if match:
+        where.append("r.id IN (SELECT rowid FROM period_rows_fts WHERE period_rows_fts MATCH ?)")
+        params.append(match)
+    prefix = str(code_prefix or "").strip().rstrip("*")
+    if prefix:
+        where.append("r.code >= ? AND r.code < ?")
+        params.extend([prefix, _prefix_upper_bound(prefix)])
+    if min_saldo is not None:
+        where.append("(r.sfd - r.sfa) >= ?")
+        params.append(to_cents(min_saldo))
+    if max_saldo is not None:
+        where.append("(r.sfd - r.sfa) <= ?")
+        params.append(to_cents(max_saldo))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    with pooled_conn() as conn:
+        total = conn.execute(f"SELECT COUNT(1) FROM period_rows r {where_sql}", params).fetchone()[0]
+        cur = conn.execute(
+            f"""
+            SELECT p.period_key, p.year, p.month, r.row_id, r.code, r.name, r.sid, r.sia, r.cargos, r.abonos, r.sfd, r.sfa
+            FROM period_rows r
+            JOIN periods p ON p.period_key = r.period_key
+            {where_sql}
+            ORDER BY p.year DESC, p.month DESC, r.sort_order ASC
+            LIMIT ? OFFSET ?
+            """,
+            [*params, int(limit), int(offset)],
+        )
+        rows = [
+            {
+                "periodKey": r["period_key"],
+                "year": r["year"],
+                "month": r["month"],
+                "_rowId": r["row_id"],
+                "code": r["code"],
+                "name": r["name"] or "",
+                **{c: from_cents(r[c] or 0) for c in AMOUNT_COLUMNS},
+                "saldo": from_cents((r["sfd"] or 0) - (r["sfa"] or 0)),
+            }
+            for r in cur.fetchall()
+        ]
+    return {"total": int(total), "limit": int(limit), "offset": int(offset), "rows": rows}
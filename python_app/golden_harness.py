@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import hashlib
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+# Sin BBDD el mapeo es la semilla account_mapping.json: los snapshots no dependen de ediciones locales del mapeo.
+# Es un fichero temporal y no ":memory:", que daria una BBDD vacia distinta a cada conexion del pool
+_DB_DIR = tempfile.TemporaryDirectory(prefix="golden-")
+os.environ.setdefault("CONTABILIDAD_DB_PATH", str(Path(_DB_DIR.name) / "golden.db"))
+
+from openpyxl import load_workbook  # noqa: E402
+
+from conversion_engine import convert_rows, export_conversion_xlsx, parse_workbook  # noqa: E402
+from sample_data import AMOUNT_FIELDS, build_synthetic_rows, build_synthetic_workbook  # noqa: E402
+
+GOLDEN_DIR = Path(__file__).resolve().parent / "golden"
+SNAPSHOT_DIR = GOLDEN_DIR / "snapshots"
+CORPUS_DIR = GOLDEN_DIR / "corpus"
+CORPUS_SUFFIXES = (".xlsx", ".xls", ".csv")
+CANONICAL_KEYS = ("metadata", "pgcAggregated", "balanceSheet", "pnl", "statements", "validations")
+DEFAULT_TOLERANCE = 0.005
+MAX_REPORTED_DIFFS = 20
+
+# Corpus sintetico: cada caso se genera de forma determinista a partir de su semilla
+SYNTHETIC_CASES: list[dict[str, Any]] = [
+    {"name": "sintetico-300", "rows": 300, "seed": 1, "unmappedRatio": 0.1},
+    {"name": "sintetico-5000-ceros", "rows": 5000, "seed": 2, "zeroRatio": 0.3},
+    {"name": "sintetico-2000-mapeo-manual", "rows": 2000, "seed": 3, "unmappedRatio": 0.2, "manualMappings": 25, "exchangeRate": 0.0512},
+    {"name": "sintetico-xlsx-3-hojas", "rows": 1500, "seed": 4, "source": "xlsx", "sheets": 3},
+    {"name": "sintetico-csv-europeo", "rows": 3000, "seed": 5, "source": "csv"},
+    {"name": "sintetico-20000", "rows": 20000, "seed": 6, "unmappedRatio": 0.05},
+]
+
+
+def _digest(values: list[Any]) -> dict[str, Any]:
+    payload = json.dumps(values, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return {"count": len(values), "digest": hashlib.blake2b(payload, digest_size=12).hexdigest()}
+
+
+def _european_csv(rows: list[dict[str, Any]]) -> bytes:
+    lines = ["Cuenta;Nombre;Saldo inicial deudor;Saldo inicial acreedor;Cargos;Abonos;Saldo final deudor;Saldo final acreedor"]
+    for row in rows:
+        amounts = (f"{row[f]:,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".") for f in AMOUNT_FIELDS)
+        lines.append(";".join([row["code"], row["name"], *amounts]))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _manual_mappings(rows: list[dict[str, Any]], count: int) -> dict[str, dict[str, str]]:
+    unmapped = [r for r in rows if r["code"].startswith("9") and not r["code"].endswith("-000")]
+    return {
+        r["_rowId"]: {"pgc": "629", "pgcName": "Otros servicios", "grupo": "Gastos", "subgrupo": "Otros gastos de explotacion"}
+        for r in unmapped[:count]
+    }
+
+
+def synthetic_case(spec: dict[str, Any]) -> dict[str, Any]:
+    source = spec.get("source", "rows")
+    if source == "xlsx":
+        sheets = {f"Entidad{i+1}": build_synthetic_rows(spec["rows"], seed=spec["seed"] + i) for i in range(spec.get("sheets", 1))}
+        payload: Any = build_synthetic_workbook(sheets)
+    else:
+        rows = build_synthetic_rows(
+            spec["rows"],
+            seed=spec["seed"],
+            unmapped_ratio=spec.get("unmappedRatio", 0.0),
+            zero_ratio=spec.get("zeroRatio", 0.0),
+        )
+        payload = _european_csv(rows) if source == "csv" else rows
+    return {
+        "name": spec["name"],
+        "source": source,
+        "payload": payload,
+        "allSheets": source == "xlsx",
+        "exchangeRate": spec.get("exchangeRate", 0.046),
+        "manualMappings": _manual_mappings(payload, spec["manualMappings"]) if spec.get("manualMappings") else {},
+    }
+
+
+def corpus_cases(corpus_dir: Path) -> list[dict[str, Any]]:
+    """Balanzas reales en `corpus_dir`; un `<archivo>.json` al lado puede fijar exchangeRate, allSheets y manualMappings."""
+    if not corpus_dir.is_dir():
+        return []
+    cases: list[dict[str, Any]] = []
+    for path in sorted(p for p in corpus_dir.iterdir() if p.suffix.lower() in CORPUS_SUFFIXES):
+        sidecar = path.with_name(path.name + ".json")
+        options = json.loads(sidecar.read_text(encoding="utf-8")) if sidecar.exists() else {}
+        cases.append(
+            {
+                "name": f"real-{path.stem}",
+                "source": path.suffix.lower().lstrip("."),
+                "payload": path.read_bytes(),
+                "allSheets": bool(options.get("allSheets", True)),
+                "exchangeRate": float(options.get("exchangeRate", 0.046)),
+                "manualMappings": options.get("manualMappings") or {},
+            }
+        )
+    return cases
+
+
+def _canonical(value: Any) -> Any:
+    """Forma estable y comparable: claves ordenadas, lineas de detalle reducidas a sus `_rowId`."""
+    if isinstance(value, dict):
+        if "_rowId" in value and "pgcCode" in value:
+            return value["_rowId"]
+        out: dict[str, Any] = {}
+        for key in sorted(value):
+            item = value[key]
+            out[key] = _digest([r["_rowId"] for r in item]) if key in ("details", "unmappedRows") else _canonical(item)
+        return out
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def canonical_conversion(conversion: dict[str, Any]) -> dict[str, Any]:
+    return {key: _canonical(conversion.get(key)) for key in CANONICAL_KEYS}
+
+
+def canonical_export(xlsx_bytes: bytes) -> dict[str, Any]:
+    """Por hoja: cabecera, numero de filas, sumas de columnas numericas y digest de las celdas redondeadas."""
+    wb = load_workbook(io.BytesIO(xlsx_bytes), read_only=True, data_only=True)
+    try:
+        sheets: dict[str, Any] = {}
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = [str(h) for h in next(rows, ())]
+            sums = [0.0] * len(header)
+            cells: list[list[Any]] = []
+            for row in rows:
+                normalized = []
+                for i, v in enumerate(row):
+                    if isinstance(v, float):
+                        sums[i] += v
+                        v = round(v, 2)
+                    elif isinstance(v, int) and not isinstance(v, bool):
+                        sums[i] += v
+                    normalized.append(v)
+                cells.append(normalized)
+            sheets[ws.title] = {
+                "header": header,
+                "columnSums": {h: round(s, 6) for h, s in zip(header, sums) if s},
+                "cells": _digest(cells),
+            }
+        return sheets
+    finally:
+        wb.close()
+
+
+def diff_values(expected: Any, actual: Any, tolerance: float, path: str = "", out: list[str] | None = None) -> list[str]:
+    """Diferencias entre snapshot y salida; los numeros se comparan con tolerancia absoluta."""
+    out = [] if out is None else out
+    if len(out) >= MAX_REPORTED_DIFFS:
+        return out
+    numbers = (int, float)
+    if isinstance(expected, numbers) and isinstance(actual, numbers) and not isinstance(expected, bool) and not isinstance(actual, bool):
+        if abs(expected - actual) > tolerance:
+            out.append(f"{path}: {expected!r} -> {actual!r}")
+    elif isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual)):
+            if key not in actual:
+                out.append(f"{path}/{key}: falta en la salida")
+            elif key not in expected:
+                out.append(f"{path}/{key}: clave nueva")
+            else:
+                diff_values(expected[key], actual[key], tolerance, f"{path}/{key}", out)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            out.append(f"{path}: longitud {len(expected)} -> {len(actual)}")
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            diff_values(e, a, tolerance, f"{path}[{i}]", out)
+    elif expected != actual:
+        out.append(f"{path}: {expected!r} -> {actual!r}")
+    return out
+
+
+def _load_callable(spec: str | None, default: Callable[..., Any]) -> Callable[..., Any]:
+    if not spec:
+        return default
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise SystemExit(f"Formato esperado modulo:funcion, recibido {spec!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _timed(fn: Callable[[], Any], repeat: int) -> tuple[Any, float]:
+    times: list[float] = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def run_case(case: dict[str, Any], engine: dict[str, Callable[..., Any]], repeat: int) -> dict[str, Any]:
+    """Ejecuta parseo (si la entrada es un fichero), conversion y exportacion; devuelve salida canonica y tiempos."""
+    timings: dict[str, float] = {}
+    snapshot: dict[str, Any] = {"case": case["name"], "source": case["source"]}
+    if case["source"] == "rows":
+        rows = case["payload"]
+    else:
+        rows, timings["parse"] = _timed(lambda: engine["parse"](case["payload"], all_sheets=case["allSheets"], workers=1), repeat)
+        snapshot["parsed"] = _digest(rows)
+    period = {"year": 2024, "month": 1}
+    conversion, timings["convert"] = _timed(
+        lambda: engine["convert"](rows, case["exchangeRate"], case["manualMappings"], period), repeat
+    )
+    xlsx_bytes, timings["export"] = _timed(lambda: engine["export"](conversion), repeat)
+    snapshot["conversion"] = canonical_conversion(conversion)
+    snapshot["export"] = canonical_export(xlsx_bytes)
+    return {"snapshot": snapshot, "timings": timings}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Salida de referencia (golden) del motor de conversion: equivalencia y tiempos")
+    parser.add_argument("--update", action="store_true", help="reescribe los snapshots con la salida actual")
+    parser.add_argument("--case", action="append", default=[], help="patron de nombre de caso (fnmatch); repetible")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR, help="directorio con balanzas reales")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="tolerancia absoluta para importes")
+    parser.add_argument("--repeat", type=int, default=1, help="repeticiones por fase (se informa la mediana)")
+    parser.add_argument("--parse", help="parser alternativo modulo:funcion (firma de parse_workbook)")
+    parser.add_argument("--convert", help="motor alternativo modulo:funcion (firma de convert_rows)")
+    parser.add_argument("--export", help="exportador alternativo modulo:funcion (firma de export_conversion_xlsx)")
+    args = parser.parse_args()
+
+    baseline = {"parse": parse_workbook, "convert": convert_rows, "export": export_conversion_xlsx}
+    candidate = {
+        "parse": _load_callable(args.parse, parse_workbook),
+        "convert": _load_callable(args.convert, convert_rows),
+        "export": _load_callable(args.export, export_conversion_xlsx),
+    }
+    compare = candidate != baseline
+    if compare and args.update:
+        raise SystemExit("--update solo reescribe snapshots con el motor actual; no se combina con --parse/--convert/--export")
+
+    cases = [synthetic_case(spec) for spec in SYNTHETIC_CASES] + corpus_cases(args.corpus)
+    if args.case:
+        cases = [c for c in cases if any(fnmatch.fnmatch(c["name"], pattern) for pattern in args.case)]
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+
+    failures = 0
+    for case in cases:
+        path = SNAPSHOT_DIR / f"{case['name']}.json"
+        result = run_case(case, candidate, args.repeat)
+        phases = " ".join(f"{phase} {seconds * 1000:8.1f} ms" for phase, seconds in result["timings"].items())
+        if args.update:
+            path.write_text(json.dumps(result["snapshot"], ensure_ascii=False, indent=1, sort_keys=True) + "\n", encoding="utf-8")
+            print(f"{case['name']:<32} actualizado   {phases}")
+            continue
+        if not path.exists():
+            failures += 1
+            print(f"{case['name']:<32} SIN SNAPSHOT  {phases}  (ejecuta con --update)")
+            continue
+        expected = json.loads(path.read_text(encoding="utf-8"))
+        diffs = diff_values(expected, json.loads(json.dumps(result["snapshot"], default=str)), args.tolerance)
+        failures += bool(diffs)
+        print(f"{case['name']:<32} {'ok' if not diffs else 'DIFERENTE':<13} {phases}")
+        if compare:
+            reference = run_case(case, baseline, args.repeat)["timings"]
+            speedups = " ".join(f"{phase} x{reference[phase] / seconds if seconds else 0:.2f}" for phase, seconds in result["timings"].items())
+            print(f"    aceleracion frente al motor actual: {speedups}")
+        for line in diffs:
+            print(f"    {line}")
+
+    print(f"{len(cases)} casos, {failures} con diferencias")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Sequence
+
+import numpy as np
+
+from conversion_engine import convert_rows
+from db import (
+    build_period_key,
+    load_period_data,
+    load_statement_cache,
+    period_codes,
+    save_statement_cache,
+    touch_statement_cache,
+)
+from mapping_store import MappingSnapshot, current_snapshot
+from money import CENTS
+from statement_layouts import CURRENCIES, LAYOUTS, LEGACY_KEYS, STATEMENTS
+
+# Lineas de los estados PGC (`estado:clave`) en el orden de la matriz periodo x linea
+LINE_KEYS = tuple(f"{line['layout']}:{line['key']}" for line in STATEMENTS.lines if line["layout"] not in LEGACY_KEYS)
+# Lo cacheado solo vale para los mismos estados compilados
+LAYOUT_DIGEST = hashlib.blake2b(json.dumps(LAYOUTS, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+UNITS = ("ratio", "pct", "amount")
+
+
+def _ratio(
+    key: str,
+    label: str,
+    numerator: tuple[str, ...],
+    denominator: tuple[str, ...] = (),
+    *,
+    unit: str = "ratio",
+) -> dict[str, Any]:
+    """KPI: suma de las lineas de `numerator` entre la suma de las de `denominator`.
+
+    Las lineas son `estado:clave` de `statement_layouts` (`"-"` delante resta). Sin denominador el
+    KPI es un importe (`unit="amount"`); `"pct"` multiplica el cociente por 100.
+    """
+    return {"key": key, "label": label, "numerator": numerator, "denominator": denominator, "unit": unit}
+
+
+RATIOS: list[dict[str, Any]] = [
+    _ratio("liquidez", "Liquidez general", ("balance_normal:B",), ("balance_normal:PC",)),
+    _ratio("pruebaAcida", "Prueba acida", ("balance_normal:B", "-balance_normal:B.II"), ("balance_normal:PC",)),
+    _ratio("tesoreria", "Tesoreria inmediata", ("balance_normal:B.VII",), ("balance_normal:PC",)),
+    _ratio("fondoManiobra", "Fondo de maniobra", ("balance_normal:B", "-balance_normal:PC"), unit="amount"),
+    _ratio("endeudamiento", "Endeudamiento (pasivo / PN)", ("balance_normal:PNC", "balance_normal:PC"), ("balance_normal:PN",)),
+    _ratio("solvencia", "Solvencia (activo / pasivo)", ("balance_normal:TA",), ("balance_normal:PNC", "balance_normal:PC")),
+    _ratio("autonomia", "Autonomia financiera (PN / total)", ("balance_normal:PN",), ("balance_normal:TPN",), unit="pct"),
+    _ratio("cifraNegocios", "Importe neto de la cifra de negocios", ("pyg_normal:1",), unit="amount"),
+    _ratio("margenBruto", "Margen bruto", ("pyg_normal:1", "pyg_normal:4"), ("pyg_normal:1",), unit="pct"),
+    _ratio("margenExplotacion", "Margen de explotacion", ("pyg_normal:A1",), ("pyg_normal:1",), unit="pct"),
+    _ratio("margenNeto", "Margen neto", ("pyg_normal:A5",), ("pyg_normal:1",), unit="pct"),
+    _ratio("resultado", "Resultado del ejercicio", ("pyg_normal:A5",), unit="amount"),
+    _ratio("roa", "Rentabilidad economica (ROA)", ("pyg_normal:A1",), ("balance_normal:TA",), unit="pct"),
+    _ratio("roe", "Rentabilidad financiera (ROE)", ("pyg_normal:A5",), ("balance_normal:PN",), unit="pct"),
+]
+
+
+class CompiledRatios:
+    """Ratios compilados en dos matrices de coeficientes (ratio x linea): numerador y denominador.
+
+    Con la matriz de importes periodo x linea, todos los ratios de todos los periodos son dos
+    productos de matrices en centimos (exactos) y una division.
+    """
+
+    def __init__(self, ratios: Sequence[dict[str, Any]]) -> None:
+        index = {key: i for i, key in enumerate(LINE_KEYS)}
+        if not all(isinstance(r, dict) for r in ratios):
+            raise ValueError("Cada ratio debe ser un objeto con key, numerator y denominator")
+        self.ratios = [dict(r) for r in ratios]
+        self.numerator = np.zeros((len(self.ratios), len(LINE_KEYS)), dtype=np.int64)
+        self.denominator = np.zeros_like(self.numerator)
+        self.is_amount = np.zeros(len(self.ratios), dtype=bool)
+        self.scale = np.ones(len(self.ratios), dtype=np.float64)
+        keys: set[str] = set()
+        for i, ratio in enumerate(self.ratios):
+            key = str(ratio.get("key") or "").strip()
+            if not key or key in keys:
+                raise ValueError(f"Ratio sin clave o repetido: {key!r}")
+            keys.add(key)
+            unit = ratio.setdefault("unit", "ratio")
+            if unit not in UNITS:
+                raise ValueError(f"Unidad desconocida en el ratio {key}: {unit!r} (usa {', '.join(UNITS)})")
+            if not all(isinstance(ratio.get(f) or (), (list, tuple)) for f in ("numerator", "denominator")):
+                raise ValueError(f"En el ratio {key}, numerator y denominator son listas de lineas")
+            if not ratio.get("numerator") or (unit == "amount") == bool(ratio.get("denominator")):
+                raise ValueError(f"El ratio {key} necesita numerador y, salvo los importes, denominador")
+            for target, refs in ((self.numerator, ratio["numerator"]), (self.denominator, ratio.get("denominator") or ())):
+                for ref in refs:
+                    name = str(ref).strip()
+                    line = index.get(name.lstrip("-"))
+                    if line is None:
+                        raise ValueError(f"Ratio {key} con linea desconocida: {name.lstrip('-')}")
+                    target[i, line] += -1 if name.startswith("-") else 1
+            self.is_amount[i] = unit == "amount"
+            self.scale[i] = 100.0 if unit == "pct" else 1.0
+
+    def compute(self, matrix: np.ndarray) -> np.ndarray:
+        """Valores (periodo x ratio) a partir de la matriz periodo x linea en centimos; NaN si el denominador es 0."""
+        numerator = matrix @ self.numerator.T
+        denominator = matrix @ self.denominator.T
+        out = np.full(numerator.shape, np.nan)
+        np.divide(numerator, denominator, out=out, where=denominator != 0)
+        out *= self.scale
+        out[:, self.is_amount] = numerator[:, self.is_amount] / CENTS
+        return out
+
+
+COMPILED_RATIOS = CompiledRatios(RATIOS)
+
+
+def statement_line_cents(conversion: dict[str, Any]) -> list[list[int]]:
+    """[MXN, EUR] en centimos de cada linea de `LINE_KEYS` de una conversion."""
+    statements = conversion["statements"]
+    lines = {
+        f"{layout_key}:{line['key']}": line["cents"] for layout_key, statement in statements.items() for line in statement["lines"]
+    }
+    return [list(lines[key]) for key in LINE_KEYS]
+
+
+def cache_period_statements(
+    year: int,
+    month: int,
+    version: int,
+    conversion: dict[str, Any],
+    codes: Sequence[str],
+    snapshot: MappingSnapshot,
+) -> bool:
+    """Cachea los estados de la version recien guardada (la conversion debe venir de `snapshot`)."""
+    return save_statement_cache(
+        build_period_key(year, month),
+        version=version,
+        layout_digest=LAYOUT_DIGEST,
+        mapping_version=snapshot.version,
+        mapping_fingerprint=snapshot.fingerprint(codes),
+        line_cents=statement_line_cents(conversion),
+    )
+
+
+def _refresh(entry: dict[str, Any], snapshot: MappingSnapshot) -> tuple[list[list[int]] | None, str]:
+    """Importes vigentes del periodo y como se obtuvieron: cache, cache revalidada o conversion."""
+    if entry["lineCents"] is not None and entry["cachedVersion"] == entry["version"] and entry["layoutDigest"] == LAYOUT_DIGEST:
+        if entry["mappingVersion"] == snapshot.version:
+            return entry["lineCents"], "hit"
+        # Otro mapeo: solo hay que reconvertir si cambio alguno de los que usan sus cuentas
+        if snapshot.fingerprint(period_codes(entry["periodKey"])) == entry["mappingFingerprint"]:
+            touch_statement_cache(entry["periodKey"], version=entry["version"], mapping_version=snapshot.version)
+            return entry["lineCents"], "revalidated"
+    payload = load_period_data(entry["year"], entry["month"])
+    if payload is None:
+        return None, "missing"
+    period = payload["period"]
+    conversion = convert_rows(
+        payload["rows"],
+        float(period["exchange_rate"] or 0.046),
+        payload["manualMappings"],
+        {"year": period["year"], "month": period["month"]},
+        snapshot=snapshot,
+    )
+    line_cents = statement_line_cents(conversion)
+    save_statement_cache(
+        entry["periodKey"],
+        version=int(period["version"]),
+        layout_digest=LAYOUT_DIGEST,
+        mapping_version=snapshot.version,
+        mapping_fingerprint=snapshot.fingerprint(r["code"] for r in payload["rows"]),
+        line_cents=line_cents,
+    )
+    return line_cents, "converted"
+
+
+def period_line_matrix() -> tuple[list[dict[str, Any]], np.ndarray, dict[str, int]]:
+    """Periodos guardados y su matriz (periodo, linea, moneda) de importes en centimos.
+
+    Solo se convierten los periodos sin cache valida (version, estados o mapeos de sus cuentas
+    distintos); el resto se lee tal cual.
+    """
+    snapshot = current_snapshot()
+    periods: list[dict[str, Any]] = []
+    values: list[list[list[int]]] = []
+    stats = {"hit": 0, "revalidated": 0, "converted": 0}
+    for entry in load_statement_cache():
+        line_cents, source = _refresh(entry, snapshot)
+        if line_cents is None:
+            continue
+        stats[source] += 1
+        periods.append({k: entry[k] for k in ("periodKey", "year", "month", "version")})
+        values.append(line_cents)
+    matrix = np.asarray(values, dtype=np.int64).reshape(len(values), len(LINE_KEYS), len(CURRENCIES))
+    return periods, matrix, stats
+
+
+def _json_values(values: np.ndarray) -> list[float | None]:
+    return [None if np.isnan(v) else round(float(v), 6) for v in values.tolist()]
+
+
+def kpi_trend(currency: str = "MXN", ratios: Sequence[dict[str, Any]] | None = None) -> dict[str, Any]:
+    """Evolucion de los KPIs en todos los periodos guardados y su variacion frente al periodo anterior.
+
+    Con `ratios` se calcula otro juego de ratios (misma forma que `RATIOS`) sobre la misma matriz.
+    """
+    if currency not in CURRENCIES:
+        raise ValueError(f"Moneda desconocida: {currency!r} (usa {', '.join(CURRENCIES)})")
+    compiled = COMPILED_RATIOS if ratios is None else CompiledRatios(ratios)
+    periods, matrix, stats = period_line_matrix()
+    values = compiled.compute(matrix[:, :, CURRENCIES.index(currency)])
+    variations = np.full(values.shape, np.nan)
+    relative = np.full(values.shape, np.nan)
+    if len(periods) > 1:
+        variations[1:] = values[1:] - values[:-1]
+        previous = np.abs(values[:-1])
+        np.divide(variations[1:], previous, out=relative[1:], where=previous != 0)
+        relative[1:] *= 100
+    return {
+        "currency": currency,
+        "periods": periods,
+        "ratios": [
+            {
+                "key": ratio["key"],
+                "label": ratio.get("label") or ratio["key"],
+                "unit": ratio["unit"],
+                "values": _json_values(values[:, i]),
+                "variations": _json_values(variations[:, i]),
+                "variationsPct": _json_values(relative[:, i]),
+            }
+            for i, ratio in enumerate(compiled.ratios)
+        ],
+        "cache": stats,
+    }
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Sequence
+
+import numpy as np
+
+SIGNS = ("", "deudor", "acreedor")
+MAPPING_FIELDS = ("pgc", "pgcName", "grupo", "subgrupo")
+# Sucesor de "-" en ASCII: `c < codigo + "."` equivale a "c empieza por el segmento `codigo`"
+# (los codigos solo llevan digitos, letras y guiones, que ordenan por encima o son "-")
+_SEGMENT_END = "."
+# Clase de signo de cada linea por su saldo (sfd - sfa): acreedor, cero, deudor
+_SIGN_CLASSES = {"": (0, 1, 2), "acreedor": (0,), "deudor": (2,)}
+
+
+def normalize_rule(rule: dict[str, Any]) -> dict[str, Any]:
+    """Regla validada: rango de codigos (`codeFrom`..`codeTo`, un prefijo si solo hay `codeFrom`) o
+    expresion regular sobre el nombre (`namePattern`), con `sign` opcional y `priority` (mayor gana)."""
+    code_from = str(rule.get("codeFrom") or "").strip()
+    code_to = str(rule.get("codeTo") or "").strip() or code_from
+    pattern = str(rule.get("namePattern") or "").strip()
+    sign = str(rule.get("sign") or "").strip().lower()
+    label = rule.get("id") or code_from or pattern
+    if bool(code_from) == bool(pattern):
+        raise ValueError(f"Regla {label!r}: indica un rango de cuentas (codeFrom/codeTo) o un patron de nombre, no ambos")
+    if sign not in SIGNS:
+        raise ValueError(f"Regla {label!r}: signo desconocido {sign!r} (usa deudor, acreedor o vacio)")
+    if code_from and code_from.count("-") != code_to.count("-"):
+        raise ValueError(f"Regla {label!r}: codeFrom y codeTo deben tener los mismos segmentos")
+    if code_from > code_to:
+        raise ValueError(f"Regla {label!r}: codeFrom ({code_from}) es mayor que codeTo ({code_to})")
+    if pattern:
+        try:
+            re.compile(f"(?:{pattern})")
+        except re.error as exc:
+            raise ValueError(f"Regla {label!r}: patron de nombre invalido ({exc})") from exc
+    mapping = {k: str(rule.get(k) or "").strip() for k in MAPPING_FIELDS}
+    if not all(mapping.values()):
+        raise ValueError(f"Regla {label!r}: pgc, pgcName, grupo y subgrupo son obligatorios")
+    try:
+        priority = int(rule.get("priority") or 0)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"Regla {label!r}: la prioridad debe ser un entero") from exc
+    return {
+        "id": rule.get("id"),
+        "priority": priority,
+        "codeFrom": code_from,
+        "codeTo": code_to if code_from else "",
+        "namePattern": pattern,
+        "sign": sign,
+        **mapping,
+        "note": str(rule.get("note") or "").strip(),
+    }
+
+
+class CompiledRules:
+    """Reglas de mapeo compiladas para evaluarse en bloque sobre todas las lineas.
+
+    Las reglas se ordenan por prioridad (mayor primero; a igualdad, la de menor id) y se identifican
+    por ese rango. Los rangos de codigos se funden en intervalos elementales ordenados, cada uno con
+    la regla ganadora ya resuelta para cada signo del saldo: una linea se resuelve con una busqueda
+    binaria (`np.searchsorted`) sobre todas las cuentas a la vez. Los patrones de nombre se prueban
+    en orden de prioridad tras un filtro con todos ellos combinados; cada nombre distinto se evalua
+    una sola vez y su resultado se memoriza. De las dos, gana la regla de mayor prioridad.
+    """
+
+    def __init__(self, rules: Sequence[dict[str, Any]]) -> None:
+        normalized = [normalize_rule(r) for r in rules]
+        self.rules = sorted(normalized, key=lambda r: (-r["priority"], r["id"] is None, r["id"] or 0))
+        self.none = len(self.rules)
+        self.mappings = [{k: r[k] for k in MAPPING_FIELDS} for r in self.rules]
+        self.digest = hashlib.blake2b(
+            json.dumps(self.rules, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+        code_rules = [(rank, r) for rank, r in enumerate(self.rules) if r["codeFrom"]]
+        bounds = sorted({b for _, r in code_rules for b in (r["codeFrom"], r["codeTo"] + _SEGMENT_END)})
+        # El primer intervalo ("" hasta el primer limite) no tiene reglas: todo codigo cae en alguno
+        self.points = np.asarray(["", *bounds], dtype=str)
+        self.code_winner = np.full((len(self.points), 3), self.none, dtype=np.int32)
+        for rank, r in reversed(code_rules):
+            start = int(np.searchsorted(self.points, r["codeFrom"]))
+            stop = int(np.searchsorted(self.points, r["codeTo"] + _SEGMENT_END))
+            self.code_winner[start:stop, list(_SIGN_CLASSES[r["sign"]])] = rank
+
+        # Un patron por regla de nombre (en orden de prioridad) y todos juntos como filtro previo:
+        # una sola pasada descarta los nombres que no casan con ninguno
+        self.name_rules = [
+            (rank, re.compile(r["namePattern"], re.IGNORECASE | re.DOTALL), _SIGN_CLASSES[r["sign"]])
+            for rank, r in enumerate(self.rules)
+            if r["namePattern"]
+        ]
+        self.name_filter: re.Pattern[str] | None = None
+        if len(self.name_rules) > 1:
+            try:
+                self.name_filter = re.compile(
+                    "|".join(f"(?:{pattern.pattern})" for _, pattern, _ in self.name_rules), re.IGNORECASE | re.DOTALL
+                )
+            except re.error as exc:
+                raise ValueError(f"Los patrones de nombre no se pueden combinar (grupos con nombre, referencias o flags): {exc}") from exc
+        # Memoria por nombre: indice de su fila (regla ganadora por signo) en `_name_table`
+        self._name_ids: dict[str, int] = {}
+        self._name_table = np.empty((0, 3), dtype=np.int32)
+        self._name_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _name_ranks(self, name: str) -> list[int]:
+        """Regla de nombre ganadora para cada clase de signo."""
+        ranks = [self.none] * 3
+        if self.name_filter is None or self.name_filter.search(name) is not None:
+            pending = 3
+            for rank, pattern, sign_classes in self.name_rules:
+                if pattern.search(name) is None:
+                    continue
+                for sign_class in sign_classes:
+                    if ranks[sign_class] == self.none:
+                        ranks[sign_class] = rank
+                        pending -= 1
+                if not pending:
+                    break
+        return ranks
+
+    def _name_index(self, names: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Fila de cada nombre en la tabla de reglas por nombre; solo se evaluan los nombres nuevos."""
+        missing = set(names).difference(self._name_ids)
+        if missing:
+            with self._name_lock:
+                missing.difference_update(self._name_ids)
+                ordered = list(missing)
+                start = len(self._name_table)
+                rows = np.array([self._name_ranks(n) for n in ordered], dtype=np.int32).reshape(len(ordered), 3)
+                self._name_table = np.concatenate((self._name_table, rows))
+                self._name_ids.update(zip(ordered, range(start, start + len(ordered))))
+        ids = np.fromiter(map(self._name_ids.__getitem__, names), dtype=np.intp, count=len(names))
+        return ids, self._name_table
+
+    def evaluate(self, codes: Sequence[str], names: Sequence[str], saldos: np.ndarray) -> np.ndarray:
+        """Rango de la regla que aplica a cada linea (`self.none` si ninguna); `saldos` en centimos."""
+        ranks = np.full(len(codes), self.none, dtype=np.int32)
+        if not self.rules or not len(codes):
+            return ranks
+        signs = np.sign(np.asarray(saldos)).astype(np.intp) + 1
+        if len(self.points) > 1:
+            segments = np.searchsorted(self.points, np.asarray(codes, dtype=str), side="right") - 1
+            ranks = self.code_winner[segments, signs]
+        if self.name_rules:
+            # Solo las lineas sin una regla de codigo mas prioritaria que cualquier regla de nombre
+            pending = np.flatnonzero(ranks > self.name_rules[0][0])
+            if len(pending):
+                if len(pending) < len(codes):
+                    names = np.asarray(names, dtype=object)[pending].tolist()
+                ids, table = self._name_index(names)
+                ranks[pending] = np.minimum(ranks[pending], table[ids, signs[pending]])
+        return ranks
+
+    def mapping(self, rank: int) -> dict[str, str] | None:
+        return self.mappings[rank] if rank < self.none else None
+
+    def hit_counts(self, ranks: np.ndarray) -> dict[str, int]:
+        """Lineas resueltas por cada regla (clave: id de la regla), incluidas las que no aciertan ninguna."""
+        counts = np.bincount(ranks[ranks < self.none], minlength=self.none).tolist()
+        return {str(r["id"]): hits for r, hits in zip(self.rules, counts)}
+
+
+EMPTY_RULES = CompiledRules(())
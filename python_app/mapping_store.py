@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable
+
+from db import MAPPING_SEED_FILE, account_mapping_version, load_account_mappings
+from mapping_rules import EMPTY_RULES, CompiledRules
+
+# Cada cuanto se consulta mapping_state.version como maximo; una consulta barata por intervalo y proceso
+MAPPING_CHECK_SECONDS = float(os.environ.get("CONTABILIDAD_MAPPING_CHECK_SECONDS", "2"))
+UNCLASSIFIED = "Sin clasificar"
+
+_lock = threading.Lock()
+_snapshot: "MappingSnapshot | None" = None
+_checked_at = 0.0
+
+
+def _candidates(code: str) -> list[str]:
+    parts = [p for p in code.split("-") if p]
+    return [code, *("-".join(parts[:ln]) for ln in range(len(parts), 0, -1))]
+
+
+def _options(values: Iterable[str]) -> tuple[str, ...]:
+    seen = dict.fromkeys(v for v in values if v and v != UNCLASSIFIED)
+    return (UNCLASSIFIED, *seen)
+
+
+class MappingSnapshot:
+    """Mapeo de cuentas compilado e inmutable de una version; se sustituye entero al recargar.
+
+    `find` resuelve por el prefijo mas largo y memoriza el resultado por codigo. Al pasar a una
+    version nueva solo se descartan las resoluciones de codigos con algun prefijo modificado.
+    Las reglas (rangos, nombres, signo) van compiladas en `rules` y ganan al prefijo (ver `auto_mappings`).
+    """
+
+    def __init__(
+        self,
+        version: int,
+        mappings: dict[str, dict[str, str]],
+        previous: MappingSnapshot | None = None,
+        rules: list[dict[str, Any]] | None = None,
+    ) -> None:
+        self.version = version
+        self.mappings = mappings
+        self.rules = CompiledRules(rules) if rules else EMPTY_RULES
+        self.group_options = _options(m["grupo"] for m in mappings.values())
+        self.subgroup_options = _options(m["subgrupo"] for m in mappings.values())
+        self._resolved: dict[str, str | None] = {}
+        if previous is not None:
+            changed = {k for k in previous.mappings.keys() | mappings.keys() if previous.mappings.get(k) != mappings.get(k)}
+            self._resolved = {
+                code: key for code, key in previous._resolved.items() if not any(c in changed for c in _candidates(code))
+            }
+
+    def resolve_key(self, code: str) -> str | None:
+        """Prefijo de `account_mappings` que aplica a la cuenta (o None)."""
+        safe = str(code or "").strip()
+        try:
+            return self._resolved[safe]
+        except KeyError:
+            pass
+        key = next((c for c in _candidates(safe) if c in self.mappings), None) if safe else None
+        self._resolved[safe] = key
+        return key
+
+    def find(self, code: str) -> dict[str, str] | None:
+        key = self.resolve_key(code)
+        return self.mappings[key] if key is not None else None
+
+    def auto_mappings(self, codes: list[str], names: list[str], saldos: Any) -> tuple[list[dict[str, str] | None], Any]:
+        """Mapeo automatico de cada linea (regla ganadora o, si no hay, prefijo) y el rango de regla por linea."""
+        ranks = self.rules.evaluate(codes, names, saldos)
+        if not len(self.rules):
+            return [self.find(code) for code in codes], ranks
+        rule_mapping, find = self.rules.mapping, self.find
+        return [rule_mapping(rank) or find(code) for code, rank in zip(codes, ranks.tolist())], ranks
+
+    def fingerprint(self, codes: Iterable[str]) -> str:
+        """Hash de los mapeos que usan estas cuentas: cambia solo si cambia alguno de ellos.
+        Con reglas, cualquier cambio en ellas tambien (dependen de nombres y saldos, no solo del codigo)."""
+        used = sorted({k for k in map(self.resolve_key, set(codes)) if k is not None})
+        entries: list[Any] = [[k, self.mappings[k]] for k in used]
+        if len(self.rules):
+            entries.append(["rules", self.rules.digest])
+        payload = json.dumps(entries, sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _load(previous: MappingSnapshot | None) -> MappingSnapshot:
+    try:
+        version, mappings, rules = load_account_mappings()
+    except sqlite3.OperationalError:
+        # BBDD sin inicializar (scripts sueltos): se usa la semilla JSON como version 0
+        with MAPPING_SEED_FILE.open("r", encoding="utf-8") as f:
+            version, mappings, rules = 0, json.load(f), []
+    return MappingSnapshot(version, mappings, previous, rules)
+
+
+def current_snapshot() -> MappingSnapshot:
+    """Snapshot vigente; si la version en BBDD cambio, se compila la nueva y se publica de forma atomica."""
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _checked_at < MAPPING_CHECK_SECONDS:
+        return snapshot
+    with _lock:
+        if _snapshot is None:
+            _snapshot = _load(None)
+        else:
+            try:
+                stale = account_mapping_version() != _snapshot.version
+            except sqlite3.OperationalError:
+                stale = False
+            if stale:
+                _snapshot = _load(_snapshot)
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def reload_snapshot() -> MappingSnapshot:
+    """Fuerza la comprobacion de version (tras guardar mapeos en este proceso)."""
+    global _checked_at
+    _checked_at = 0.0
+    return current_snapshot()
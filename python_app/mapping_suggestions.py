@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import math
+import threading
+import unicodedata
+from typing import Any
+
+import numpy as np
+
+from db import load_mapping_history, mapping_history_fingerprint
+from mapping_store import MappingSnapshot, current_snapshot
+
+CODE_WEIGHT = 0.35
+MIN_SCORE = 0.15
+# Confianza a partir de la cual una sugerencia se marca para aplicar (por debajo solo se muestra)
+APPLY_MIN_SCORE = 0.55
+
+_cache_lock = threading.Lock()
+_cached_index: tuple[Any, "SuggestionIndex"] | None = None
+
+
+def normalize_text(value: Any) -> str:
+    text = unicodedata.normalize("NFKD", str(value or "").lower())
+    text = "".join(ch if ch.isalnum() else " " for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split())
+
+
+def _grams(text: str) -> set[str]:
+    grams: set[str] = set()
+    for token in text.split():
+        grams.add(f"#{token}")
+        padded = f" {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _code_segments(code: Any) -> list[str]:
+    return [p for p in str(code or "").strip().split("-") if p]
+
+
+class SuggestionIndex:
+    """Indice invertido de palabras y trigramas sobre nombres PGC y mapeos manuales ya guardados."""
+
+    def __init__(self, documents: list[dict[str, Any]]) -> None:
+        self.documents = documents
+        postings: dict[str, list[int]] = {}
+        doc_grams: list[set[str]] = []
+        prefixes: dict[str, list[int]] = {}
+        segment_counts: list[int] = []
+        for doc_id, doc in enumerate(documents):
+            grams = _grams(normalize_text(doc["text"]))
+            doc_grams.append(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(doc_id)
+            segments = _code_segments(doc.get("code"))
+            segment_counts.append(len(segments))
+            for ln in range(1, len(segments) + 1):
+                prefixes.setdefault("-".join(segments[:ln]), []).append(doc_id)
+
+        total = max(len(documents), 1)
+        self.idf = {gram: math.log(1 + total / len(ids)) for gram, ids in postings.items()}
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.weights = {gram: np.full(len(ids), self.idf[gram]) for gram, ids in postings.items()}
+        self.norms = np.asarray([sum(self.idf[g] for g in grams) or 1.0 for grams in doc_grams], dtype=np.float64)
+        self.prefixes = {prefix: np.asarray(ids, dtype=np.int32) for prefix, ids in prefixes.items()}
+        self.segment_counts = np.asarray(segment_counts, dtype=np.float64)
+
+    def _name_scores(self, name: str) -> np.ndarray:
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        grams = [g for g in _grams(name) if g in self.postings]
+        if not grams:
+            return scores
+        ids = np.concatenate([self.postings[g] for g in grams])
+        weights = np.concatenate([self.weights[g] for g in grams])
+        shared = np.bincount(ids, weights=weights, minlength=len(self.documents))
+        query_norm = sum(self.idf[g] for g in grams)
+        return shared / np.sqrt(query_norm * self.norms)
+
+    def _code_scores(self, code: str, scores: np.ndarray) -> None:
+        segments = _code_segments(code)
+        for ln in range(1, len(segments) + 1):
+            ids = self.prefixes.get("-".join(segments[:ln]))
+            if ids is None:
+                break
+            scores[ids] += CODE_WEIGHT / np.maximum(len(segments), self.segment_counts[ids])
+
+    def suggest(self, code: str, name: str, limit: int = 3) -> list[dict[str, Any]]:
+        if not self.documents:
+            return []
+        scores = self._name_scores(normalize_text(name))
+        self._code_scores(code, scores)
+        top = min(len(scores), limit * 4)
+        candidates = np.argpartition(-scores, top - 1)[:top]
+        out: list[dict[str, Any]] = []
+        seen: set[tuple[str, str, str, str]] = set()
+        for doc_id in sorted(candidates, key=lambda i: -scores[i]):
+            score = float(scores[doc_id])
+            if score < MIN_SCORE:
+                break
+            doc = self.documents[doc_id]
+            mapping = doc["mapping"]
+            key = (mapping["pgc"], mapping["pgcName"], mapping["grupo"], mapping["subgrupo"])
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append({**mapping, "score": round(score, 4), "source": doc["source"], "matchedCode": doc["code"], "matchedName": doc["text"]})
+            if len(out) >= limit:
+                break
+        return out
+
+
+def _documents(snapshot: MappingSnapshot) -> list[dict[str, Any]]:
+    docs: list[dict[str, Any]] = []
+    for code, mapping in snapshot.mappings.items():
+        docs.append({"code": code, "text": mapping["pgcName"], "mapping": dict(mapping), "source": "mapeo"})
+    for item in load_mapping_history():
+        docs.append(
+            {
+                "code": item["code"],
+                "text": item["name"],
+                "mapping": {k: item[k] for k in ("pgc", "pgcName", "grupo", "subgrupo")},
+                "source": "historico",
+            }
+        )
+    return docs
+
+
+def get_suggestion_index() -> SuggestionIndex:
+    global _cached_index
+    snapshot = current_snapshot()
+    fingerprint = (snapshot.version, mapping_history_fingerprint())
+    with _cache_lock:
+        if _cached_index is None or _cached_index[0] != fingerprint:
+            _cached_index = (fingerprint, SuggestionIndex(_documents(snapshot)))
+        return _cached_index[1]
+
+
+def suggest_mappings(rows: list[dict[str, Any]], limit: int = 3) -> dict[str, list[dict[str, Any]]]:
+    """Candidatos PGC ordenados para cada linea sin mapear, en una sola llamada."""
+    index = get_suggestion_index()
+    memo: dict[tuple[str, str], list[dict[str, Any]]] = {}
+    out: dict[str, list[dict[str, Any]]] = {}
+    for row in rows:
+        key = (str(row.get("code", "")).strip(), normalize_text(row.get("name")))
+        if key not in memo:
+            memo[key] = index.suggest(key[0], key[1], limit)
+        out[row["_rowId"]] = memo[key]
+    return out
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import math
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any
+
+import numpy as np
+
+# Los importes se guardan y se suman como centimos enteros (int en Python, int64 en numpy y
+# INTEGER en SQLite). Los float de las filas solo transportan el valor ya redondeado al centimo.
+CENTS = 100
+TOLERANCE_CENTS = 1
+
+
+def to_cents(value: Any) -> int:
+    """Importe numerico a centimos, redondeando al mas cercano con las mitades lejos de cero."""
+    if type(value) is float:
+        # Camino rapido (el habitual): sin isinstance ni copysign; NaN/inf dan 0
+        if value - value != 0.0:
+            return 0
+        scaled = value * CENTS
+        return int(scaled + 0.5) if scaled >= 0 else -int(0.5 - scaled)
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, int):
+        return value * CENTS
+    number = float(value)
+    if not math.isfinite(number):
+        return 0
+    return int(math.copysign(math.floor(abs(number) * CENTS + 0.5), number))
+
+
+def parse_cents(text: str) -> int:
+    """Texto decimal con punto (`"-1234.565"`) a centimos, sin pasar por float."""
+    try:
+        return int(Decimal(text).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return 0
+
+
+def from_cents(cents: int) -> float:
+    return cents / CENTS
+
+
+def round_half_away(values: np.ndarray) -> np.ndarray:
+    return np.trunc(values + np.copysign(0.5, values)).astype(np.int64)
+
+
+def cents_array(values: Any) -> np.ndarray:
+    """Vector (o matriz) de importes float a centimos int64, con el mismo redondeo que `to_cents`."""
+    scaled = np.asarray(values, dtype=np.float64) * CENTS
+    return round_half_away(np.where(np.isfinite(scaled), scaled, 0.0))
+
+
+def eur_cents(cents: np.ndarray, exchange_rate: float) -> np.ndarray:
+    """Conversion explicita a EUR por linea: centimos MXN por el tipo de cambio, redondeado al centimo EUR."""
+    return round_half_away(np.asarray(cents, dtype=np.int64) * exchange_rate)
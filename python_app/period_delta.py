@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import Any
+
+from money import from_cents, to_cents
+
+
+def _row_signature(row: dict[str, Any]) -> tuple[Any, ...]:
+    """Nombre, importes en centimos y exclusion: dos lineas con la misma firma no han cambiado."""
+    get = row.get
+    return (
+        str(get("name", "")).strip(),
+        to_cents(get("sid")),
+        to_cents(get("sia")),
+        to_cents(get("cargos")),
+        to_cents(get("abonos")),
+        to_cents(get("sfd")),
+        to_cents(get("sfa")),
+        bool(get("_excludeFromAnalysis", False)),
+    )
+
+
+def _saldo(row: dict[str, Any]) -> float:
+    return from_cents(to_cents(row.get("sfd")) - to_cents(row.get("sfa")))
+
+
+def _code_keys(rows: list[dict[str, Any]]) -> list[tuple[str, int]]:
+    seen: dict[str, int] = {}
+    keys: list[tuple[str, int]] = []
+    for row in rows:
+        code = str(row.get("code", "")).strip()
+        seen[code] = seen.get(code, 0) + 1
+        keys.append((code, seen[code]))
+    return keys
+
+
+def diff_period_rows(
+    stored_rows: list[dict[str, Any]],
+    stored_mappings: dict[str, dict[str, Any]],
+    new_rows: list[dict[str, Any]],
+) -> dict[str, Any]:
+    """Compara una nueva subida con el periodo guardado por codigo de cuenta.
+
+    Las cuentas que ya existian conservan su `_rowId` guardado (y con el, su mapeo manual); solo las
+    lineas nuevas, modificadas o eliminadas aparecen en `changedRowIds`/`removedRowIds`.
+    `movedRowIds` son las lineas sin cambios cuya posicion ya no es la guardada (las desplaza una
+    alta o baja intermedia o un orden distinto en la subida).
+    """
+    stored_by_key = dict(zip(_code_keys(stored_rows), stored_rows))
+    used_ids = {str(r.get("_rowId")) for r in stored_rows}
+    next_id = len(stored_rows) + 1
+
+    rows: list[dict[str, Any]] = []
+    added: list[dict[str, Any]] = []
+    changed: list[dict[str, Any]] = []
+    moved: set[str] = set()
+    stored_pos = {r["_rowId"]: idx for idx, r in enumerate(stored_rows)}
+    unchanged = 0
+    new_keys = _code_keys(new_rows)
+    for key, row in zip(new_keys, new_rows):
+        stored = stored_by_key.get(key)
+        if stored is None:
+            while f"row-{next_id}" in used_ids:
+                next_id += 1
+            row_id = f"row-{next_id}"
+            used_ids.add(row_id)
+            merged = {**row, "_rowId": row_id}
+            added.append(merged)
+        else:
+            merged = {**row, "_rowId": stored["_rowId"], "_isNew": bool(stored.get("_isNew", False))}
+            if _row_signature(stored) == _row_signature(row):
+                unchanged += 1
+                merged = stored
+                if stored_pos[stored["_rowId"]] != len(rows):
+                    moved.add(stored["_rowId"])
+            else:
+                changed.append({"before": stored, "after": merged})
+        rows.append(merged)
+
+    new_key_set = set(new_keys)
+    removed = [row for key, row in stored_by_key.items() if key not in new_key_set]
+    kept_ids = {r["_rowId"] for r in rows}
+    manual_mappings = {row_id: m for row_id, m in stored_mappings.items() if row_id in kept_ids}
+
+    return {
+        "rows": rows,
+        "manualMappings": manual_mappings,
+        "changedRowIds": {r["_rowId"] for r in added} | {c["after"]["_rowId"] for c in changed},
+        "removedRowIds": {r["_rowId"] for r in removed},
+        "movedRowIds": moved,
+        "report": {
+            "unchangedCount": unchanged,
+            "added": [{"_rowId": r["_rowId"], "code": r.get("code"), "name": r.get("name")} for r in added],
+            "changed": [
+                {
+                    "_rowId": c["after"]["_rowId"],
+                    "code": c["after"].get("code"),
+                    "name": c["after"].get("name"),
+                    "saldoAntes": _saldo(c["before"]),
+                    "saldoDespues": _saldo(c["after"]),
+                }
+                for c in changed
+            ],
+            "removed": [{"_rowId": r["_rowId"], "code": r.get("code"), "name": r.get("name")} for r in removed],
+            "carriedMappingCount": len(manual_mappings),
+        },
+    }
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import io
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, BinaryIO, Sequence
+
+import numpy as np
+import xlsxwriter
+
+from conversion_engine import convert_rows
+from db import build_period_key, list_periods, load_period_data
+from kpis import COMPILED_RATIOS, LINE_KEYS, period_line_matrix, statement_line_cents
+from money import CENTS
+from statement_layouts import CURRENCIES, LAYOUTS, LEGACY_KEYS, STATEMENTS
+
+# Columnas de las hojas de detalle (mismos nombres que Mapeo_Detalle de export_conversion_xlsx)
+DETAIL_COLUMNS = (
+    "code",
+    "name",
+    "sid",
+    "sia",
+    "cargos",
+    "abonos",
+    "sfd",
+    "sfa",
+    "pgcCode",
+    "pgcName",
+    "grupo",
+    "subgrupo",
+    "saldo",
+    "saldoEur",
+    "manualMappingApplied",
+    "isSummaryLine",
+    "excludeFromAnalysis",
+)
+DETAIL_AMOUNTS = frozenset(("sid", "sia", "cargos", "abonos", "sfd", "sfa", "saldo", "saldoEur"))
+DETAIL_FLAGS = frozenset(("manualMappingApplied", "isSummaryLine", "excludeFromAnalysis"))
+# Controles de la hoja Validaciones: (nombre, unidad, valor a partir del periodo y su conversion)
+VALIDATIONS = (
+    ("Version", "count", lambda p, c: p.get("version")),
+    ("Tipo de cambio", "rate", lambda p, c: c["metadata"]["exchangeRate"] if c else None),
+    ("Lineas totales", "count", lambda p, c: c["metadata"]["rowCount"] if c else None),
+    ("Lineas analizadas", "count", lambda p, c: c["metadata"]["analyzedRowCount"] if c else None),
+    ("Sin mapear", "count", lambda p, c: c["metadata"]["unmappedCount"] if c else None),
+    ("Cobertura %", "pct", lambda p, c: c["metadata"]["mappedCoveragePct"] if c else None),
+    ("Dif. balanza final", "amount", lambda p, c: c["validations"]["trialBalanceFinalDifference"] if c else None),
+)
+NUMBER_FORMATS = {"amount": "#,##0.00", "pct": "0.00", "ratio": "0.000", "rate": "0.000000", "count": "0"}
+
+
+def _sheet_title(layout: dict[str, Any]) -> str:
+    return layout["title"].replace("Cuenta de perdidas y ganancias", "PyG").replace(" PGC", "")[:31]
+
+
+def _period_list(periods: Sequence[tuple[int, int]] | None) -> list[tuple[int, int]]:
+    """Periodos pedidos en orden cronologico; por defecto todos los guardados."""
+    if periods is None:
+        periods = [(int(p["year"]), int(p["month"])) for p in list_periods()]
+    return sorted({(int(y), int(m)) for y, m in periods})
+
+
+def _iter_conversions(periods: Sequence[tuple[int, int]]) -> Iterator[tuple[dict[str, Any], dict[str, Any]]]:
+    """Carga y convierte los periodos de uno en uno: solo hay una conversion viva a la vez."""
+    for year, month in periods:
+        payload = load_period_data(year, month)
+        if payload is None:
+            continue
+        period = payload["period"]
+        conversion = convert_rows(
+            payload["rows"],
+            float(period["exchange_rate"] or 0.046),
+            payload["manualMappings"],
+            {"year": period["year"], "month": period["month"]},
+        )
+        del payload
+        yield {"periodKey": period["period_key"], "year": year, "month": month, "version": period["version"]}, conversion
+        # Sin esto el generador retendria esta conversion mientras se calcula la siguiente
+        del conversion
+
+
+class _Comparative:
+    """Hoja comparativa: conceptos en filas, un periodo por columna y la variacion del ultimo frente al anterior."""
+
+    def __init__(self, workbook: xlsxwriter.Workbook, name: str, heads: Sequence[str], formats: dict[str, Any]) -> None:
+        self.sheet = workbook.add_worksheet(name)
+        self.heads = list(heads)
+        self.formats = formats
+        if len(self.heads) > 1:
+            self.sheet.set_column(0, len(self.heads) - 2, 12)
+        self.sheet.set_column(len(self.heads) - 1, len(self.heads) - 1, 48)
+
+    def write(self, labels: Sequence[str], rows: Sequence[Sequence[Any]], values: np.ndarray, units: Sequence[str] | None = None) -> None:
+        """`values` es concepto x periodo (NaN = sin dato); se escribe de una vez al final (filas en orden)."""
+        ws, fmt = self.sheet, self.formats
+        first, count = len(self.heads), values.shape[1]
+        ws.set_column(first, first + count + 1, 16)
+        ws.write_row(0, 0, [*self.heads, *labels], fmt["head"])
+        if count > 1:
+            ws.write_row(0, first + count, [f"Var. {labels[-1]} / {labels[-2]}", "Var. %"], fmt["head"])
+        ws.freeze_panes(1, first)
+        for r, (head, line) in enumerate(zip(rows, values), start=1):
+            ws.write_row(r, 0, head)
+            number = fmt[units[r - 1] if units else "amount"]
+            for c, value in enumerate(line.tolist(), start=first):
+                if not np.isnan(value):
+                    ws.write_number(r, c, value, number)
+            if count > 1 and not np.isnan(line[-1]) and not np.isnan(line[-2]):
+                ws.write_number(r, first + count, line[-1] - line[-2], number)
+                if line[-2]:
+                    ws.write_number(r, first + count + 1, (line[-1] - line[-2]) / abs(line[-2]) * 100, fmt["pct"])
+
+
+def write_report_pack(
+    output: str | Path | BinaryIO,
+    periods: Sequence[tuple[int, int]] | None = None,
+    *,
+    currency: str = "MXN",
+    detail: bool = True,
+) -> dict[str, Any]:
+    """Pack de informes de varios periodos en un solo libro xlsx.
+
+    Hojas comparativas (estados PGC, KPIs, balanza PGC y validaciones, un periodo por columna) y,
+    con `detail`, una hoja de detalle por periodo. Los periodos se leen y convierten de uno en uno
+    y xlsxwriter escribe en modo `constant_memory`: las filas van a disco segun se escriben, asi que
+    la memoria depende del periodo mas grande y no del numero de periodos. Sin `detail` los estados
+    salen de la cache de `kpis` y solo se convierten los periodos con la cache caducada.
+    """
+    if currency not in CURRENCIES:
+        raise ValueError(f"Moneda desconocida: {currency!r} (usa {', '.join(CURRENCIES)})")
+    wanted = _period_list(periods)
+    cur = CURRENCIES.index(currency)
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    formats = {unit: workbook.add_format({"num_format": num_format}) for unit, num_format in NUMBER_FORMATS.items()}
+    formats["head"] = workbook.add_format({"bold": True, "bottom": 1})
+    # Las comparativas van delante pero se escriben al final, cuando ya se conocen todos los periodos
+    layouts = [layout for layout in LAYOUTS if layout["key"] not in LEGACY_KEYS]
+    statement_sheets = {
+        layout["key"]: _Comparative(workbook, _sheet_title(layout), ("Clave", "Concepto"), formats) for layout in layouts
+    }
+    kpi_sheet = _Comparative(workbook, "KPIs", ("Unidad", "KPI"), formats)
+    pgc_sheet = _Comparative(workbook, "Balanza_PGC", ("PGC", "Grupo", "Subgrupo", "Cuenta PGC"), formats) if detail else None
+    validation_sheet = _Comparative(workbook, "Validaciones", ("Control",), formats)
+
+    done: list[dict[str, Any]] = []
+    line_cents: list[list[list[int]]] = []
+    checks: list[list[Any]] = []
+    pgc: dict[str, tuple[str, str, str]] = {}
+    pgc_totals: list[dict[str, float]] = []
+    detail_rows = 0
+    if detail:
+        total_field = f"total{currency}"
+        for period, conversion in _iter_conversions(wanted):
+            ws = workbook.add_worksheet(f"Detalle_{period['periodKey']}")
+            ws.write_row(0, 0, DETAIL_COLUMNS, formats["head"])
+            ws.freeze_panes(1, 2)
+            # Escritura por tipo de columna: `write` generico analiza cada texto (formulas, URLs...)
+            amounts = [(c, column) for c, column in enumerate(DETAIL_COLUMNS) if column in DETAIL_AMOUNTS]
+            flags = [(c, column) for c, column in enumerate(DETAIL_COLUMNS) if column in DETAIL_FLAGS]
+            texts = [(c, column) for c, column in enumerate(DETAIL_COLUMNS) if column not in DETAIL_AMOUNTS | DETAIL_FLAGS]
+            amount = formats["amount"]
+            for r, row in enumerate(conversion["convertedData"], start=1):
+                for c, column in texts:
+                    if row.get(column):
+                        ws.write_string(r, c, str(row[column]))
+                for c, column in amounts:
+                    ws.write_number(r, c, row.get(column) or 0.0, amount)
+                for c, column in flags:
+                    ws.write_boolean(r, c, bool(row.get(column)))
+            detail_rows += len(conversion["convertedData"])
+            line_cents.append(statement_line_cents(conversion))
+            checks.append([check(period, conversion) for _, _, check in VALIDATIONS])
+            totals: dict[str, float] = {}
+            for item in conversion["pgcAggregated"]:
+                pgc.setdefault(item["pgcCode"], (item["grupo"], item["subgrupo"], item["pgcName"]))
+                totals[item["pgcCode"]] = item[total_field]
+            pgc_totals.append(totals)
+            done.append(period)
+            del conversion
+    else:
+        keys = {build_period_key(y, m) for y, m in wanted}
+        cached, matrix, _ = period_line_matrix()
+        for i, period in enumerate(cached):
+            if period["periodKey"] in keys:
+                done.append(period)
+                line_cents.append(matrix[i].tolist())
+                checks.append([check(period, None) for _, _, check in VALIDATIONS])
+
+    labels = [f"{p['year']}-{p['month']:02d}" for p in done]
+    matrix = np.asarray(line_cents, dtype=np.int64).reshape(len(done), len(LINE_KEYS), len(CURRENCIES))[:, :, cur]
+    amounts = matrix.T / CENTS
+    positions = {key: i for i, key in enumerate(LINE_KEYS)}
+    for layout in layouts:
+        lines = [line for line in STATEMENTS.lines if line["layout"] == layout["key"]]
+        heads = [(line["key"], "  " * max(0, line["level"] - 1) + line["label"]) for line in lines]
+        statement_sheets[layout["key"]].write(labels, heads, amounts[[positions[f"{layout['key']}:{line['key']}"] for line in lines]])
+    kpi_sheet.write(
+        labels,
+        [(r["unit"], r.get("label") or r["key"]) for r in COMPILED_RATIOS.ratios],
+        COMPILED_RATIOS.compute(matrix).T,
+        [r["unit"] for r in COMPILED_RATIOS.ratios],
+    )
+    if pgc_sheet is not None:
+        codes = sorted(pgc)
+        pgc_sheet.write(
+            labels,
+            [(code, *pgc[code]) for code in codes],
+            np.array([[totals.get(code, np.nan) for totals in pgc_totals] for code in codes], dtype=np.float64).reshape(len(codes), len(done)),
+        )
+    # Sin conversion (estados desde la cache) solo se conoce la version
+    known = [i for i, column in enumerate(zip(*checks)) if any(v is not None for v in column)] if checks else []
+    validation_sheet.write(
+        labels,
+        [(VALIDATIONS[i][0],) for i in known],
+        np.array([[np.nan if p[i] is None else float(p[i]) for p in checks] for i in known], dtype=np.float64).reshape(
+            len(known), len(done)
+        ),
+        [VALIDATIONS[i][1] for i in known],
+    )
+    workbook.close()
+    return {
+        "currency": currency,
+        "periods": labels,
+        "missing": [build_period_key(y, m) for y, m in wanted if build_period_key(y, m) not in {p["periodKey"] for p in done}],
+        "sheets": [ws.get_name() for ws in workbook.worksheets()],
+        "detailRows": detail_rows,
+    }
+
+
+def export_report_pack(
+    periods: Sequence[tuple[int, int]] | None = None,
+    *,
+    currency: str = "MXN",
+    detail: bool = True,
+) -> bytes:
+    """`write_report_pack` en memoria (para descargas); para packs grandes mejor escribir a un fichero."""
+    output = io.BytesIO()
+    write_report_pack(output, periods, currency=currency, detail=detail)
+    return output.getvalue()
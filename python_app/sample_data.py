@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import io
+import os
+import random
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from openpyxl import Workbook
+
+import db
+from mapping_store import current_snapshot
+
+AMOUNT_FIELDS = ("sid", "sia", "cargos", "abonos", "sfd", "sfa")
+
+
+def _leaf_amounts(rnd: random.Random, zero: bool) -> dict[str, float]:
+    if zero:
+        return {f: 0.0 for f in AMOUNT_FIELDS}
+    initial = round(rnd.uniform(-250_000, 250_000), 2)
+    cargos = round(rnd.uniform(0, 120_000), 2)
+    abonos = round(rnd.uniform(0, 120_000), 2)
+    final = round(initial + cargos - abonos, 2)
+    return {
+        "sid": max(initial, 0.0),
+        "sia": max(-initial, 0.0),
+        "cargos": cargos,
+        "abonos": abonos,
+        "sfd": max(final, 0.0),
+        "sfa": max(-final, 0.0),
+    }
+
+
+def _summary_amounts(children: list[dict[str, Any]]) -> dict[str, float]:
+    initial = round(sum(c["sid"] - c["sia"] for c in children), 2)
+    final = round(sum(c["sfd"] - c["sfa"] for c in children), 2)
+    return {
+        "sid": max(initial, 0.0),
+        "sia": max(-initial, 0.0),
+        "cargos": round(sum(c["cargos"] for c in children), 2),
+        "abonos": round(sum(c["abonos"] for c in children), 2),
+        "sfd": max(final, 0.0),
+        "sfa": max(-final, 0.0),
+    }
+
+
+def build_synthetic_rows(
+    count: int,
+    *,
+    seed: int = 0,
+    unmapped_ratio: float = 0.0,
+    zero_ratio: float = 0.0,
+) -> list[dict[str, Any]]:
+    """Balanza CONTPAQi sintetica con sumatorias `xxx-000-000`/`xxx-yyy-000` y balanza final cuadrada."""
+    rnd = random.Random(seed)
+    roots = sorted({k.split("-")[0] for k in current_snapshot().mappings})
+    leaves_per_sub = 8
+    subs_per_root = max(1, count // (len(roots) * leaves_per_sub) + 1)
+
+    tree: list[tuple[str, list[tuple[int, list[dict[str, Any]]]]]] = []
+    leaves: list[dict[str, Any]] = []
+    for root in roots:
+        if len(leaves) >= count:
+            break
+        root_code = root if rnd.random() >= unmapped_ratio else f"9{root}"
+        subs: list[tuple[int, list[dict[str, Any]]]] = []
+        for s in range(1, subs_per_root + 1):
+            sub_leaves: list[dict[str, Any]] = []
+            for leaf in range(1, leaves_per_sub + 1):
+                if len(leaves) >= count:
+                    break
+                row = {
+                    "code": f"{root_code}-{s:03d}-{leaf:03d}",
+                    "name": f"Cuenta {root_code} {s:03d} {leaf:03d}",
+                    **_leaf_amounts(rnd, rnd.random() < zero_ratio),
+                }
+                sub_leaves.append(row)
+                leaves.append(row)
+            if sub_leaves:
+                subs.append((s, sub_leaves))
+        tree.append((root_code, subs))
+
+    if leaves:
+        balancing = leaves[-1]
+        for debit, credit in (("sid", "sia"), ("sfd", "sfa")):
+            diff = round(sum(r[debit] - r[credit] for r in leaves), 2)
+            value = round(balancing[debit] - balancing[credit] - diff, 2)
+            balancing[debit] = max(value, 0.0)
+            balancing[credit] = max(-value, 0.0)
+
+    out: list[dict[str, Any]] = []
+    for root_code, subs in tree:
+        out.append(
+            {
+                "code": f"{root_code}-000-000",
+                "name": f"Cuenta mayor {root_code}",
+                **_summary_amounts([r for _, sub_leaves in subs for r in sub_leaves]),
+            }
+        )
+        for s, sub_leaves in subs:
+            out.append({"code": f"{root_code}-{s:03d}-000", "name": f"Subcuenta {root_code} {s:03d}", **_summary_amounts(sub_leaves)})
+            out.extend(sub_leaves)
+
+    return [
+        {"_rowId": f"row-{i+1}", "_isNew": False, "_excludeFromAnalysis": False, **row}
+        for i, row in enumerate(out)
+    ]
+
+
+def build_synthetic_workbook(sheets: dict[str, list[dict[str, Any]]]) -> bytes:
+    """xlsx con el formato de exportacion CONTPAQi (cabecera de empresa + fila `Cuenta | Nombre | ...`)."""
+    wb = Workbook(write_only=True)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        ws.append(["EMPRESA DEMO SA DE CV"])
+        ws.append(["Balanza de Comprobacion"])
+        ws.append([])
+        ws.append(["Cuenta", "Nombre", "Saldo inicial deudor", "Saldo inicial acreedor", "Cargos", "Abonos", "Saldo final deudor", "Saldo final acreedor"])
+        ws.append([])
+        for row in rows:
+            ws.append([row["code"], row["name"], *(row[f] or None for f in AMOUNT_FIELDS)])
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+@contextmanager
+def temp_database(name: str = "benchmark.db") -> Iterator[Path]:
+    """BBDD vacia en un directorio temporal (que se devuelve) para benchmarks y pruebas de estres.
+
+    `db` ya esta importado: se le cambia la ruta y se vacia su pool; la variable de entorno la
+    heredan los procesos que se lancen dentro.
+    """
+    previous_env, previous_path = os.environ.get("CONTABILIDAD_DB_PATH"), db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / name
+        os.environ["CONTABILIDAD_DB_PATH"] = str(path)
+        db.close_pool()
+        db.DB_PATH = path
+        try:
+            yield Path(tmp)
+        finally:
+            db.close_pool()
+            db.DB_PATH = previous_path
+            if previous_env is None:
+                os.environ.pop("CONTABILIDAD_DB_PATH", None)
+            else:
+                os.environ["CONTABILIDAD_DB_PATH"] = previous_env
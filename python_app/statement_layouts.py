@@ -0,0 +1,511 @@
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+from money import from_cents
+
+# Base de importes de cada hoja de `pgcAggregated`: "display" son los totales con el signo de
+# presentacion del grupo (el de las pestañas Balance y P&G); "saldo" es debe - haber.
+BASES = ("display", "saldo")
+CURRENCIES = ("MXN", "EUR")
+
+
+def _l(
+    level: int,
+    key: str,
+    label: str,
+    *pgc: str,
+    grupos: tuple[str, ...] = (),
+    subgrupos: tuple[str, ...] = (),
+    formula: tuple[str, ...] = (),
+    detail: bool = False,
+    sign: int | None = None,
+) -> dict[str, Any]:
+    """Linea de estado: se asigna por prefijo PGC (el mas largo gana), subgrupo o grupo.
+
+    Su importe es lo asignado directamente mas la suma de sus hijas y de los terminos de `formula`
+    (`"-clave"` resta; `"estado:clave"` referencia una linea de otro estado). `detail` marca las
+    lineas que solo aparecen en el modelo normal; en el abreviado se funden en su madre.
+    """
+    return {
+        "level": level,
+        "key": key,
+        "label": label,
+        "pgc": pgc,
+        "grupos": grupos,
+        "subgrupos": subgrupos,
+        "formula": formula,
+        "detail": detail,
+        "sign": sign,
+    }
+
+
+def _range(*prefixes: str, start: int, stop: int) -> tuple[str, ...]:
+    return tuple(f"{p}{d}" for p in prefixes for d in range(start, stop + 1))
+
+
+LEGACY_BALANCE = {
+    "key": "legacy_balance",
+    "title": "Balance por grupos",
+    "basis": "display",
+    "lines": [
+        _l(1, "Activo No Corriente", "Activo No Corriente", grupos=("Activo No Corriente",)),
+        _l(1, "Activo Corriente", "Activo Corriente", grupos=("Activo Corriente",)),
+        _l(1, "Patrimonio Neto", "Patrimonio Neto", grupos=("Patrimonio Neto",)),
+        _l(1, "Pasivo No Corriente", "Pasivo No Corriente", grupos=("Pasivo No Corriente",)),
+        _l(1, "Pasivo Corriente", "Pasivo Corriente", grupos=("Pasivo Corriente",)),
+        _l(0, "totalActivo", "Total activo", formula=("Activo No Corriente", "Activo Corriente")),
+        _l(0, "totalPasivoPN", "Total pasivo y PN", formula=("Patrimonio Neto", "Pasivo No Corriente", "Pasivo Corriente")),
+    ],
+}
+
+LEGACY_PNL = {
+    "key": "legacy_pnl",
+    "title": "P&G por secciones",
+    "basis": "display",
+    "lines": [
+        *(
+            _l(1, name, name, subgrupos=(name,))
+            for name in (
+                "Importe neto cifra negocios",
+                "Otros ingresos de explotacion",
+                "Gastos de personal",
+                "Servicios exteriores",
+                "Tributos",
+                "Amortizaciones",
+                "Gastos excepcionales",
+                "Resultado financiero",
+                "Otros resultados",
+            )
+        ),
+        _l(0, "ingresos", "Ingresos", formula=("Importe neto cifra negocios", "Otros ingresos de explotacion")),
+        _l(
+            0,
+            "gastos",
+            "Gastos",
+            formula=("Gastos de personal", "Servicios exteriores", "Tributos", "Amortizaciones", "Gastos excepcionales"),
+        ),
+        _l(0, "resultadoExplotacion", "Resultado de explotacion", formula=("ingresos", "-gastos")),
+        _l(0, "resultadoAntesImpuestos", "Resultado antes de impuestos", formula=("resultadoExplotacion", "Resultado financiero", "Otros resultados")),
+    ],
+}
+
+
+def _balance_lines(pyg_key: str) -> list[dict[str, Any]]:
+    return [
+        _l(1, "A", "A) ACTIVO NO CORRIENTE", sign=1),
+        _l(2, "A.I", "I. Inmovilizado intangible", "20", "280", "290"),
+        _l(3, "A.I.1", "1. Desarrollo", "201", "2801", "2901", detail=True),
+        _l(3, "A.I.2", "2. Concesiones", "202", "2802", "2902", detail=True),
+        _l(3, "A.I.3", "3. Patentes, licencias, marcas y similares", "203", "2803", "2903", detail=True),
+        _l(3, "A.I.4", "4. Fondo de comercio", "204", detail=True),
+        _l(3, "A.I.5", "5. Aplicaciones informaticas", "206", "2806", "2906", detail=True),
+        _l(3, "A.I.6", "6. Investigacion", "200", "2800", detail=True),
+        _l(3, "A.I.7", "7. Otro inmovilizado intangible", "205", "209", "2805", "2905", detail=True),
+        _l(2, "A.II", "II. Inmovilizado material", "21", "281", "291", "23"),
+        _l(3, "A.II.1", "1. Terrenos y construcciones", "210", "211", "2811", "2910", "2911", detail=True),
+        _l(
+            3,
+            "A.II.2",
+            "2. Instalaciones tecnicas y otro inmovilizado material",
+            *_range("21", "281", "291", start=2, stop=9),
+            detail=True,
+        ),
+        _l(3, "A.II.3", "3. Inmovilizado en curso y anticipos", "23", detail=True),
+        _l(2, "A.III", "III. Inversiones inmobiliarias", "22", "282", "292"),
+        _l(
+            2,
+            "A.IV",
+            "IV. Inversiones en empresas del grupo y asociadas a largo plazo",
+            "2403", "2404", "2413", "2414", "2423", "2424", "2493", "2494", "293", "2943", "2944", "2953", "2954",
+        ),
+        _l(
+            2,
+            "A.V",
+            "V. Inversiones financieras a largo plazo",
+            "2405", "2415", "2425", "2495", "250", "251", "252", "253", "254", "255", "257", "258", "259", "26",
+            "2945", "2955", "297", "298",
+        ),
+        _l(2, "A.VI", "VI. Activos por impuesto diferido", "474"),
+        _l(1, "B", "B) ACTIVO CORRIENTE", sign=1),
+        _l(2, "B.I", "I. Activos no corrientes mantenidos para la venta", "580", "581", "582", "583", "584", "599"),
+        _l(2, "B.II", "II. Existencias", "30", "31", "32", "33", "34", "35", "36", "39", "407"),
+        _l(3, "B.II.1", "1. Comerciales", "30", "390", detail=True),
+        _l(3, "B.II.2", "2. Materias primas y otros aprovisionamientos", "31", "32", "391", "392", detail=True),
+        _l(3, "B.II.3", "3. Productos en curso", "33", "34", "393", "394", detail=True),
+        _l(3, "B.II.4", "4. Productos terminados", "35", "395", detail=True),
+        _l(3, "B.II.5", "5. Subproductos, residuos y materiales recuperados", "36", "396", detail=True),
+        _l(3, "B.II.6", "6. Anticipos a proveedores", "407", detail=True),
+        _l(2, "B.III", "III. Deudores comerciales y otras cuentas a cobrar"),
+        _l(3, "B.III.1", "1. Clientes por ventas y prestaciones de servicios", "430", "431", "432", "435", "436", "437", "490", "4935"),
+        _l(3, "B.III.2", "2. Clientes, empresas del grupo y asociadas", "433", "434", "4933", "4934", detail=True),
+        _l(3, "B.III.3", "3. Deudores varios", "44", "5531", "5533"),
+        _l(3, "B.III.4", "4. Personal", "460", "544", detail=True),
+        _l(3, "B.III.5", "5. Activos por impuesto corriente", "4709", "473", detail=True),
+        _l(3, "B.III.6", "6. Otros creditos con las Administraciones Publicas", "4700", "4708", "471", "472", detail=True),
+        _l(3, "B.III.7", "7. Accionistas (socios) por desembolsos exigidos", "5580"),
+        _l(
+            2,
+            "B.IV",
+            "IV. Inversiones en empresas del grupo y asociadas a corto plazo",
+            *_range("53", start=0, stop=5), "5393", "5394", "593", "5943", "5944", "5953", "5954",
+        ),
+        _l(
+            2,
+            "B.V",
+            "V. Inversiones financieras a corto plazo",
+            "5305", "5315", "5325", "5335", "5345", "5355", "5395", "540", "541", "542", "543", "545", "546", "547",
+            "548", "549", "5590", "5593", "565", "566", "5945", "5955", "597", "598",
+        ),
+        _l(2, "B.VI", "VI. Periodificaciones a corto plazo", "480", "567"),
+        _l(2, "B.VII", "VII. Efectivo y otros activos liquidos equivalentes", "57"),
+        _l(3, "B.VII.1", "1. Tesoreria", "570", "571", "572", "573", "574", "575", detail=True),
+        _l(3, "B.VII.2", "2. Otros activos liquidos equivalentes", "576", detail=True),
+        _l(0, "TA", "TOTAL ACTIVO (A + B)", formula=("A", "B")),
+        _l(1, "PN", "A) PATRIMONIO NETO", sign=-1),
+        _l(2, "PN.1", "A-1) Fondos propios"),
+        _l(3, "PN.1.I", "I. Capital", "100", "101", "102", "1030", "1040"),
+        _l(4, "PN.1.I.1", "1. Capital escriturado", "100", "101", "102", detail=True),
+        _l(4, "PN.1.I.2", "2. (Capital no exigido)", "1030", "1040", detail=True),
+        _l(3, "PN.1.II", "II. Prima de emision", "110"),
+        _l(3, "PN.1.III", "III. Reservas", "112", "113", "114", "115", "119"),
+        _l(4, "PN.1.III.1", "1. Legal y estatutarias", "112", "1141", detail=True),
+        _l(4, "PN.1.III.2", "2. Otras reservas", "113", "1140", "1142", "1143", "1144", "115", "119", detail=True),
+        _l(3, "PN.1.IV", "IV. (Acciones y participaciones en patrimonio propias)", "108", "109"),
+        _l(3, "PN.1.V", "V. Resultados de ejercicios anteriores", "120", "121"),
+        _l(3, "PN.1.VI", "VI. Otras aportaciones de socios", "118"),
+        # Con el periodo sin cerrar, el resultado vivo de los grupos 6 y 7 forma parte del PN
+        _l(3, "PN.1.VII", "VII. Resultado del ejercicio", "129", formula=(f"{pyg_key}:A5",)),
+        _l(3, "PN.1.VIII", "VIII. (Dividendo a cuenta)", "557"),
+        _l(3, "PN.1.IX", "IX. Otros instrumentos de patrimonio neto", "111"),
+        _l(2, "PN.2", "A-2) Ajustes por cambios de valor", "133", "1340", "137"),
+        _l(2, "PN.3", "A-3) Subvenciones, donaciones y legados recibidos", "130", "131", "132"),
+        _l(1, "PNC", "B) PASIVO NO CORRIENTE", sign=-1),
+        _l(2, "PNC.I", "I. Provisiones a largo plazo", "14"),
+        _l(2, "PNC.II", "II. Deudas a largo plazo", "1605", "1615", "1625", "1635", "17", "180", "185", "189"),
+        _l(3, "PNC.II.1", "1. Obligaciones y otros valores negociables", "177", "178", "179", detail=True),
+        _l(3, "PNC.II.2", "2. Deudas con entidades de credito", "1605", "170", detail=True),
+        _l(3, "PNC.II.3", "3. Acreedores por arrendamiento financiero", "1625", "174", detail=True),
+        _l(3, "PNC.II.4", "4. Derivados", "176", detail=True),
+        _l(3, "PNC.II.5", "5. Otros pasivos financieros", "1615", "1635", "171", "172", "173", "175", "180", "185", "189", detail=True),
+        _l(2, "PNC.III", "III. Deudas con empresas del grupo y asociadas a largo plazo", "1603", "1604", "1613", "1614", "1623", "1624", "1633", "1634"),
+        _l(2, "PNC.IV", "IV. Pasivos por impuesto diferido", "479"),
+        _l(2, "PNC.V", "V. Periodificaciones a largo plazo", "181"),
+        _l(1, "PC", "C) PASIVO CORRIENTE", sign=-1),
+        _l(2, "PC.I", "I. Pasivos vinculados con activos no corrientes mantenidos para la venta", "585", "586", "587", "588", "589"),
+        _l(2, "PC.II", "II. Provisiones a corto plazo", "499", "529"),
+        _l(2, "PC.III", "III. Deudas a corto plazo", "50", "5105", "5115", "5125", "5135", "5145", "52", "551", "555", "56"),
+        _l(3, "PC.III.1", "1. Obligaciones y otros valores negociables", "500", "501", "505", "506", detail=True),
+        _l(3, "PC.III.2", "2. Deudas con entidades de credito", "5105", "520", "527", detail=True),
+        _l(3, "PC.III.3", "3. Acreedores por arrendamiento financiero", "5125", "524", detail=True),
+        _l(3, "PC.III.4", "4. Derivados", "5595", "5598", detail=True),
+        _l(
+            3,
+            "PC.III.5",
+            "5. Otros pasivos financieros",
+            "1034", "1044", "190", "192", "194", "509", "5115", "5135", "5145", "521", "522", "523", "525", "526",
+            "528", "551", "5525", "5530", "5532", "555", "5565", "5566", "560", "561", "569",
+            detail=True,
+        ),
+        _l(
+            2,
+            "PC.IV",
+            "IV. Deudas con empresas del grupo y asociadas a corto plazo",
+            "5103", "5104", "5113", "5114", "5123", "5124", "5133", "5134", "5143", "5144", "5523", "5524", "5563", "5564",
+        ),
+        _l(2, "PC.V", "V. Acreedores comerciales y otras cuentas a pagar"),
+        _l(3, "PC.V.1", "1. Proveedores", "400", "401", "403", "404", "405", "406"),
+        _l(4, "PC.V.1.a", "a) Proveedores a corto plazo", "400", "401", "405", "406", detail=True),
+        _l(4, "PC.V.1.b", "b) Proveedores, empresas del grupo y asociadas", "403", "404", detail=True),
+        _l(3, "PC.V.2", "2. Otros acreedores", "41", "438", "465", "466", "4750", "4751", "4752", "4758", "476", "477"),
+        _l(4, "PC.V.2.1", "Acreedores varios", "41", detail=True),
+        _l(4, "PC.V.2.2", "Personal (remuneraciones pendientes de pago)", "465", "466", detail=True),
+        _l(4, "PC.V.2.3", "Pasivos por impuesto corriente", "4752", detail=True),
+        _l(4, "PC.V.2.4", "Otras deudas con las Administraciones Publicas", "4750", "4751", "4758", "476", "477", detail=True),
+        _l(4, "PC.V.2.5", "Anticipos de clientes", "438", detail=True),
+        _l(2, "PC.VI", "VI. Periodificaciones a corto plazo", "485", "568"),
+        _l(0, "TPN", "TOTAL PATRIMONIO NETO Y PASIVO (A + B + C)", formula=("PN", "PNC", "PC")),
+    ]
+
+
+# Ingresos en positivo y gastos en negativo: todas las lineas llevan signo haber - debe
+_PYG_LINES = [
+    _l(1, "1", "1. Importe neto de la cifra de negocios", "70"),
+    _l(2, "1.a", "a) Ventas", "700", "701", "702", "703", "704", "706", "708", "709", detail=True),
+    _l(2, "1.b", "b) Prestaciones de servicios", "705", detail=True),
+    _l(1, "2", "2. Variacion de existencias de productos terminados y en curso de fabricacion", "6930", "71", "7930"),
+    _l(1, "3", "3. Trabajos realizados por la empresa para su activo", "73"),
+    _l(1, "4", "4. Aprovisionamientos", "60", "61", "6931", "6932", "6933", "7931", "7932", "7933"),
+    _l(2, "4.a", "a) Consumo de mercaderias", "600", "6060", "6080", "6090", "610", detail=True),
+    _l(2, "4.b", "b) Consumo de materias primas y otras materias consumibles", "601", "602", "6061", "6062", "6081", "6082", "6091", "6092", "611", "612", detail=True),
+    _l(2, "4.c", "c) Trabajos realizados por otras empresas", "607", detail=True),
+    _l(2, "4.d", "d) Deterioro de mercaderias, materias primas y otros aprovisionamientos", "6931", "6932", "6933", "7931", "7932", "7933", detail=True),
+    _l(1, "5", "5. Otros ingresos de explotacion", "75", "740", "747"),
+    _l(2, "5.a", "a) Ingresos accesorios y otros de gestion corriente", "75", detail=True),
+    _l(2, "5.b", "b) Subvenciones de explotacion incorporadas al resultado del ejercicio", "740", "747", detail=True),
+    _l(1, "6", "6. Gastos de personal", "64", "7950", "7957"),
+    _l(2, "6.a", "a) Sueldos, salarios y asimilados", "640", "641", "6450", "7950", detail=True),
+    _l(2, "6.b", "b) Cargas sociales", "642", "643", "649", detail=True),
+    _l(2, "6.c", "c) Provisiones", "644", "6457", "7957", detail=True),
+    _l(1, "7", "7. Otros gastos de explotacion", "62", "631", "634", "636", "639", "65", "694", "695", "794", "7954"),
+    _l(2, "7.a", "a) Servicios exteriores", "62", detail=True),
+    _l(2, "7.b", "b) Tributos", "631", "634", "636", "639", detail=True),
+    _l(2, "7.c", "c) Perdidas, deterioro y variacion de provisiones por operaciones comerciales", "650", "694", "695", "794", "7954", detail=True),
+    _l(2, "7.d", "d) Otros gastos de gestion corriente", "651", "659", detail=True),
+    _l(1, "8", "8. Amortizacion del inmovilizado", "68"),
+    _l(1, "9", "9. Imputacion de subvenciones de inmovilizado no financiero y otras", "746"),
+    _l(1, "10", "10. Excesos de provisiones", "7951", "7952", "7955", "7956"),
+    _l(1, "11", "11. Deterioro y resultado por enajenaciones del inmovilizado", "670", "671", "672", "690", "691", "692", "770", "771", "772", "790", "791", "792"),
+    _l(2, "11.a", "a) Deterioros y perdidas", "690", "691", "692", "790", "791", "792", detail=True),
+    _l(2, "11.b", "b) Resultados por enajenaciones y otras", "670", "671", "672", "770", "771", "772", detail=True),
+    _l(1, "12", "12. Diferencia negativa de combinaciones de negocio", "774"),
+    _l(1, "13", "13. Otros resultados", "678", "778"),
+    _l(0, "A1", "A.1) RESULTADO DE EXPLOTACION", formula=tuple(str(i) for i in range(1, 14))),
+    _l(1, "14", "14. Ingresos financieros", "760", "761", "762", "767", "769"),
+    _l(1, "15", "15. Gastos financieros", "660", "661", "662", "664", "665", "669"),
+    _l(1, "16", "16. Variacion de valor razonable en instrumentos financieros", "663", "763"),
+    _l(1, "17", "17. Diferencias de cambio", "668", "768"),
+    _l(
+        1,
+        "18",
+        "18. Deterioro y resultado por enajenaciones de instrumentos financieros",
+        "666", "667", "673", "675", "696", "697", "698", "699", "766", "773", "775", "796", "797", "798", "799",
+    ),
+    _l(0, "A2", "A.2) RESULTADO FINANCIERO", formula=("14", "15", "16", "17", "18")),
+    _l(0, "A3", "A.3) RESULTADO ANTES DE IMPUESTOS (A.1 + A.2)", formula=("A1", "A2")),
+    _l(1, "19", "19. Impuestos sobre beneficios", "6300", "6301", "633", "638"),
+    _l(0, "A4", "A.4) RESULTADO DEL EJERCICIO PROCEDENTE DE OPERACIONES CONTINUADAS", formula=("A3", "19")),
+    _l(1, "20", "20. Resultado del ejercicio procedente de operaciones interrumpidas"),
+    _l(0, "A5", "A.5) RESULTADO DEL EJERCICIO (A.4 + 20)", formula=("A4", "20")),
+]
+
+
+def _pgc_layouts(model: str, title: str) -> list[dict[str, Any]]:
+    pyg_key = f"pyg_{model}"
+    detail = model == "normal"
+    return [
+        {
+            "key": f"balance_{model}",
+            "title": f"Balance PGC ({title})",
+            "basis": "saldo",
+            "detail": detail,
+            "scope": ("1", "2", "3", "4", "5"),
+            "lines": _balance_lines(pyg_key),
+        },
+        {
+            "key": pyg_key,
+            "title": f"Cuenta de perdidas y ganancias PGC ({title})",
+            "basis": "saldo",
+            "detail": detail,
+            "sign": -1,
+            "scope": ("6", "7"),
+            "lines": _PYG_LINES,
+        },
+    ]
+
+
+LAYOUTS: list[dict[str, Any]] = [
+    LEGACY_BALANCE,
+    LEGACY_PNL,
+    *_pgc_layouts("normal", "modelo normal"),
+    *_pgc_layouts("abreviado", "modelo abreviado"),
+]
+LEGACY_KEYS = (LEGACY_BALANCE["key"], LEGACY_PNL["key"])
+
+
+def _collapse(layout: dict[str, Any]) -> list[dict[str, Any]]:
+    """Lineas visibles del modelo con la madre de cada una; las de detalle se funden si no aplican."""
+    keep_detail = layout.get("detail", True)
+    lines: list[dict[str, Any]] = []
+    stack: list[dict[str, Any]] = []
+    sign = int(layout.get("sign", 1))
+    for spec in layout["lines"]:
+        while stack and stack[-1]["level"] >= spec["level"]:
+            stack.pop()
+        if spec["level"] <= 1 and spec["sign"] is not None:
+            sign = spec["sign"]
+        if spec["detail"] and not keep_detail:
+            parent = stack[-1]
+            for field in ("pgc", "grupos", "subgrupos", "formula"):
+                parent[field] += spec[field]
+            continue
+        line = {**spec, "parent": stack[-1]["key"] if stack else None, "sign": sign}
+        lines.append(line)
+        if line["level"] > 0:
+            stack.append(line)
+    return lines
+
+
+class CompiledStatements:
+    """Todos los estados compilados una vez en un indice hoja -> linea y una matriz lineal.
+
+    `matrix[i, j]` es el peso (entero) con el que lo asignado directamente a la linea `j` entra en
+    la linea `i` (hijas y formulas ya desplegadas), asi que rellenar todos los estados en MXN y EUR
+    es un `np.add.at` en centimos sobre las hojas mas un producto de matrices, ambos exactos.
+    """
+
+    def __init__(self, layouts: list[dict[str, Any]]) -> None:
+        self.layouts: list[dict[str, Any]] = []
+        self.lines: list[dict[str, Any]] = []
+        self._index: dict[str, int] = {}
+        self._selectors: list[tuple[dict[str, int], dict[str, int], dict[str, int]]] = []
+        for layout in layouts:
+            start = len(self.lines)
+            prefixes: dict[str, int] = {}
+            subgrupos: dict[str, int] = {}
+            grupos: dict[str, int] = {}
+            for line in _collapse(layout):
+                gidx = len(self.lines)
+                qualified = f"{layout['key']}:{line['key']}"
+                if qualified in self._index:
+                    raise ValueError(f"Linea duplicada en estados: {qualified}")
+                self._index[qualified] = gidx
+                self.lines.append({**line, "layout": layout["key"]})
+                for target, values in ((prefixes, line["pgc"]), (subgrupos, line["subgrupos"]), (grupos, line["grupos"])):
+                    for value in values:
+                        # Una hija declarada despues de su madre se queda los prefijos que repite
+                        target[value] = gidx
+            self._selectors.append((prefixes, subgrupos, grupos))
+            self.layouts.append(
+                {
+                    "key": layout["key"],
+                    "title": layout["title"],
+                    "basis": BASES.index(layout["basis"]),
+                    "scope": tuple(layout.get("scope", ())),
+                    "start": start,
+                    "stop": len(self.lines),
+                }
+            )
+
+        size = len(self.lines)
+        self.signs = np.asarray([line["sign"] for line in self.lines] + [0], dtype=np.int64)
+        self.basis = np.asarray([layout["basis"] for layout in self.layouts], dtype=np.intp)
+        self.matrix = self._expand(size)
+        self._assign_cache: dict[tuple[str, str, str], tuple[int, ...]] = {}
+
+    def _resolve(self, layout_key: str, ref: str) -> tuple[int, int]:
+        coef = -1 if ref.startswith("-") else 1
+        name = ref.lstrip("-")
+        qualified = name if ":" in name else f"{layout_key}:{name}"
+        if qualified not in self._index:
+            raise ValueError(f"Formula con linea desconocida: {qualified}")
+        return coef, self._index[qualified]
+
+    def _expand(self, size: int) -> np.ndarray:
+        children: dict[int, list[int]] = {}
+        for gidx, line in enumerate(self.lines):
+            if line["parent"] is not None:
+                children.setdefault(self._index[f"{line['layout']}:{line['parent']}"], []).append(gidx)
+
+        rows: dict[int, np.ndarray] = {}
+        visiting: set[int] = set()
+
+        def row(gidx: int) -> np.ndarray:
+            if gidx in rows:
+                return rows[gidx]
+            if gidx in visiting:
+                raise ValueError(f"Formula circular en estados: {self.lines[gidx]['layout']}:{self.lines[gidx]['key']}")
+            visiting.add(gidx)
+            out = np.zeros(size, dtype=np.int64)
+            out[gidx] = 1
+            for child in children.get(gidx, []):
+                out += row(child)
+            line = self.lines[gidx]
+            for ref in line["formula"]:
+                coef, target = self._resolve(line["layout"], ref)
+                out += coef * row(target)
+            visiting.discard(gidx)
+            rows[gidx] = out
+            return out
+
+        return np.vstack([row(i) for i in range(size)]) if size else np.zeros((0, 0), dtype=np.int64)
+
+    def assign(self, pgc: str, grupo: str, subgrupo: str) -> tuple[int, ...]:
+        """Linea directa de una hoja en cada estado; `len(lines)` si no encaja en ninguna."""
+        key = (pgc, grupo, subgrupo)
+        cached = self._assign_cache.get(key)
+        if cached is not None:
+            return cached
+        missing = len(self.lines)
+        out: list[int] = []
+        for prefixes, subgrupos, grupos in self._selectors:
+            target = next((prefixes[pgc[:n]] for n in range(len(pgc), 0, -1) if pgc[:n] in prefixes), None)
+            if target is None:
+                target = subgrupos.get(subgrupo, grupos.get(grupo, missing))
+            out.append(target)
+        self._assign_cache[key] = tuple(out)
+        return self._assign_cache[key]
+
+    def fill(self, leaves: list[dict[str, Any]], values: np.ndarray) -> dict[str, dict[str, Any]]:
+        """Rellena todos los estados.
+
+        `values` tiene forma (hojas, base, moneda): por cada hoja de `pgcAggregated`, sus importes
+        en centimos (int64) en base display y saldo, en MXN y EUR.
+        """
+        size = len(self.lines)
+        if leaves:
+            idx = np.asarray(
+                [self.assign(str(leaf["pgcCode"]), str(leaf["grupo"]), str(leaf["subgrupo"])) for leaf in leaves],
+                dtype=np.intp,
+            )
+        else:
+            idx = np.zeros((0, len(self.layouts)), dtype=np.intp)
+        leaf_values = values[:, self.basis, :] * self.signs[idx][:, :, None]
+        direct = np.zeros((size + 1, len(CURRENCIES)), dtype=np.int64)
+        np.add.at(direct, idx.ravel(), leaf_values.reshape(-1, len(CURRENCIES)))
+        totals = (self.matrix @ direct[:size]).tolist()
+
+        out: dict[str, dict[str, Any]] = {}
+        for pos, layout in enumerate(self.layouts):
+            items: dict[int, list[dict[str, Any]]] = {}
+            unassigned: list[str] = []
+            for leaf_pos, (leaf, gidx) in enumerate(zip(leaves, idx[:, pos].tolist())):
+                if gidx == size:
+                    if str(leaf["pgcCode"]).startswith(layout["scope"]):
+                        unassigned.append(str(leaf["pgcCode"]))
+                    continue
+                if layout["basis"] == 0:
+                    items.setdefault(gidx, []).append(leaf)
+                else:
+                    mxn, eur = leaf_values[leaf_pos, pos].tolist()
+                    items.setdefault(gidx, []).append(
+                        {"pgcCode": leaf["pgcCode"], "pgcName": leaf["pgcName"], "totalMXN": from_cents(mxn), "totalEUR": from_cents(eur)}
+                    )
+            out[layout["key"]] = {
+                "key": layout["key"],
+                "title": layout["title"],
+                "lines": [
+                    {
+                        "key": self.lines[gidx]["key"],
+                        "label": self.lines[gidx]["label"],
+                        "level": self.lines[gidx]["level"],
+                        "parent": self.lines[gidx]["parent"],
+                        "isTotal": bool(self.lines[gidx]["formula"]) and self.lines[gidx]["level"] == 0,
+                        "totalMXN": from_cents(totals[gidx][0]),
+                        "totalEUR": from_cents(totals[gidx][1]),
+                        "cents": totals[gidx],
+                        "items": items.get(gidx, []),
+                    }
+                    for gidx in range(layout["start"], layout["stop"])
+                ],
+                "unassigned": unassigned,
+            }
+        return out
+
+
+STATEMENTS = CompiledStatements(LAYOUTS)
+
+
+def build_statements(pgc_aggregated: list[dict[str, Any]], leaf_cents: np.ndarray) -> dict[str, dict[str, Any]]:
+    """Todos los estados de una conversion.
+
+    `leaf_cents` trae por hoja de `pgcAggregated` los centimos [displayMXN, displayEUR, saldo, saldoEur].
+    """
+    values = np.asarray(leaf_cents, dtype=np.int64).reshape(len(pgc_aggregated), len(BASES), len(CURRENCIES))
+    return STATEMENTS.fill(pgc_aggregated, values)
+
+
+def line_map(statement: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    return {line["key"]: line for line in statement["lines"]}
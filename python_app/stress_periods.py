@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import multiprocessing
+import statistics
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+from db import PeriodConflictError, init_db, list_periods, load_period_data, period_version, save_period_data
+from sample_data import build_synthetic_rows, temp_database
+
+# La linea cuyo `cargos` hace de contador: cada guardado correcto le suma 1.00
+COUNTER_ROW = 0
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _session(session: int, periods: int, saves: int, lock: bool) -> dict[str, Any]:
+    """Una sesion: carga el periodo, suma 1.00 al contador y guarda; ante un conflicto recarga y reintenta."""
+    year, month = 2000 + session % periods, 1
+    conflicts = 0
+    latencies: list[float] = []
+    for _ in range(saves):
+        while True:
+            payload = load_period_data(year, month)
+            rows = payload["rows"]
+            rows[COUNTER_ROW]["cargos"] = round(rows[COUNTER_ROW]["cargos"] + 1, 2)
+            started = time.perf_counter()
+            try:
+                save_period_data(
+                    year=year,
+                    month=month,
+                    filename="stress",
+                    exchange_rate=float(payload["period"]["exchange_rate"]),
+                    rows=rows,
+                    manual_mappings=payload["manualMappings"],
+                    uploaded_at=dt.datetime.now().isoformat(),
+                    saved_by=f"sesion-{session}",
+                    expected_version=int(payload["period"]["version"]) if lock else None,
+                )
+            except PeriodConflictError:
+                conflicts += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            break
+    return {"conflicts": conflicts, "saveMs": latencies}
+
+
+def _reader(stop: threading.Event, latencies: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        list_periods()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+def run_stress(sessions: int, periods: int, saves: int, rows: int, readers: int, processes: bool, lock: bool) -> dict[str, Any]:
+    init_db()
+    base = build_synthetic_rows(rows, seed=3)
+    initial = round(base[COUNTER_ROW]["cargos"], 2)
+    for p in range(periods):
+        save_period_data(
+            year=2000 + p,
+            month=1,
+            filename="stress",
+            exchange_rate=0.046,
+            rows=base,
+            manual_mappings={},
+            uploaded_at=dt.datetime.now().isoformat(),
+        )
+
+    stop = threading.Event()
+    read_ms: list[float] = []
+    reader_threads = [threading.Thread(target=_reader, args=(stop, read_ms)) for _ in range(readers)]
+    pool: Executor = (
+        ProcessPoolExecutor(max_workers=sessions, mp_context=multiprocessing.get_context("spawn"))
+        if processes
+        else ThreadPoolExecutor(max_workers=sessions)
+    )
+    for t in reader_threads:
+        t.start()
+    started = time.perf_counter()
+    try:
+        with pool:
+            futures = [pool.submit(_session, s, periods, saves, lock) for s in range(sessions)]
+            results = [f.result() for f in futures]
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for t in reader_threads:
+            t.join()
+
+    saved = sessions * saves
+    # Sin actualizaciones perdidas, cada periodo suma tantos 1.00 (y versiones) como guardados recibio
+    lost = 0
+    for p in range(periods):
+        expected_saves = sum(saves for s in range(sessions) if s % periods == p)
+        counter = load_period_data(2000 + p, 1)["rows"][COUNTER_ROW]["cargos"]
+        lost += expected_saves - round(counter - initial)
+        if period_version(2000 + p, 1) != 1 + expected_saves:
+            raise AssertionError(f"Periodo {2000 + p}-01 con {period_version(2000 + p, 1)} versiones, se esperaban {1 + expected_saves}")
+    save_ms = [ms for r in results for ms in r["saveMs"]]
+    return {
+        "saves": saved,
+        "conflicts": sum(r["conflicts"] for r in results),
+        "lostUpdates": lost,
+        "savesPerSecond": saved / elapsed if elapsed else 0.0,
+        "saveP50Ms": _percentile(save_ms, 50),
+        "saveP99Ms": _percentile(save_ms, 99),
+        "reads": len(read_ms),
+        "readP50Ms": _percentile(read_ms, 50),
+        "readP99Ms": _percentile(read_ms, 99),
+        "readMeanMs": statistics.fmean(read_ms) if read_ms else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sesiones concurrentes guardando y cargando periodos (bloqueo optimista)")
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--periods", type=int, default=2, help="periodos que se reparten las sesiones")
+    parser.add_argument("--saves", type=int, default=10, help="guardados correctos por sesion")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--readers", type=int, default=2, help="hilos llamando a list_periods mientras tanto")
+    parser.add_argument("--processes", action="store_true", help="una sesion por proceso en vez de por hilo")
+    parser.add_argument("--no-lock", action="store_true", help="guardar sin expectedVersion (el ultimo gana)")
+    args = parser.parse_args()
+
+    with temp_database("stress.db"):
+        report = run_stress(args.sessions, args.periods, args.saves, args.rows, args.readers, args.processes, not args.no_lock)
+
+    print(
+        f"sessions={args.sessions} periods={args.periods} saves={args.saves} rows={args.rows} "
+        f"readers={args.readers} {'procesos' if args.processes else 'hilos'} {'sin bloqueo' if args.no_lock else 'bloqueo optimista'}"
+    )
+    for key, value in report.items():
+        print(f"  {key:>14}: {value:,.2f}")
+    if report["lostUpdates"] and not args.no_lock:
+        raise SystemExit("Se perdieron actualizaciones con el bloqueo optimista activo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# La BBDD de los tests es un fichero temporal (no data/contabilidad.db); se fija antes de importar db
+os.environ.setdefault("CONTABILIDAD_DB_PATH", str(Path(tempfile.mkdtemp(prefix="contabilidad-tests-")) / "tests.db"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from account_hierarchy import build_account_hierarchy, drill_down
+from conversion_engine import convert_rows
+
+# 102-000-000 dice 300 pero sus cuentas suman 310; la sumatoria intermedia 102-001-000 si cuadra
+ROWS = [
+    ("102-000-000", "Bancos", 300.0),
+    ("102-001-000", "Bancos nacionales", 250.0),
+    ("102-001-001", "Banco A", 100.0),
+    ("102-001-002", "Banco B", 150.0),
+    ("102-002-001", "Banco extranjero", 60.0),
+]
+
+
+def _rows() -> list[dict]:
+    return [
+        {"_rowId": f"row-{i + 1}", "code": code, "name": name, "sid": 0.0, "sia": 0.0, "cargos": sfd, "abonos": 0.0, "sfd": sfd, "sfa": 0.0}
+        for i, (code, name, sfd) in enumerate(ROWS)
+    ]
+
+
+def test_subtotals_roll_up_and_report_the_mismatched_summary():
+    hierarchy = build_account_hierarchy(_rows())
+    nodes = hierarchy["nodes"]
+    assert hierarchy["maxDepth"] == 3
+    assert nodes["102"]["totals"]["sfd"] == 310.0
+    assert nodes["102-001"]["totals"]["sfd"] == 250.0
+    assert nodes["102"]["summaryRowIds"] == ["row-1"]
+    assert nodes["102-001"]["summaryRowIds"] == ["row-2"]
+
+    [mismatch] = hierarchy["mismatches"]
+    assert (mismatch["_rowId"], mismatch["node"]) == ("row-1", "102")
+    assert mismatch["fields"] == ["cargos", "saldoFinal"]
+    assert (mismatch["statedSaldo"], mismatch["childrenSaldo"], mismatch["differenceSaldo"]) == (300.0, 310.0, -10.0)
+
+
+def test_drill_down_returns_path_and_children():
+    hierarchy = build_account_hierarchy(_rows())
+    leaf = drill_down(hierarchy, "102-001-002")
+    assert [p["key"] for p in leaf["path"]] == ["102", "102-001"]
+    assert leaf["children"] == []
+    assert leaf["node"]["rowIds"] == ["row-4"]
+
+    # una sumatoria se resuelve al nodo de su prefijo significativo
+    summary = drill_down(hierarchy, "102-001-000")
+    assert summary["node"]["key"] == "102-001"
+    assert [c["key"] for c in summary["children"]] == ["102-001-001", "102-001-002"]
+    assert summary["node"]["saldo"] == 250.0
+
+    root = drill_down(hierarchy)
+    assert [c["key"] for c in root["children"]] == ["102"]
+    assert drill_down(hierarchy, "999") is None
+
+
+def test_conversion_reports_summary_mismatches():
+    result = convert_rows(_rows(), 0.05)
+    assert result["metadata"]["summaryExcludedCount"] == 2
+    assert result["metadata"]["summaryMismatchCount"] == 1
+    assert [m["code"] for m in result["validations"]["summaryMismatches"]] == ["102-000-000"]
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import os
+
+from conversion_store import ConversionStore, resident_size
+
+
+def _rows(n: int, tag: str) -> list[dict]:
+    return [{"_rowId": f"row-{i}", "code": f"{tag}-{i}", "name": f"Cuenta {tag} {i}", "sfd": float(i)} for i in range(n)]
+
+
+def test_resident_size_grows_with_rows():
+    small, large = resident_size(_rows(100, "a")), resident_size(_rows(1000, "a"))
+    assert 8 * small < large < 12 * small
+
+
+def test_unreferenced_entries_are_discarded_and_referenced_spilled(tmp_path):
+    budget = resident_size(_rows(1000, "a")) * 3 // 2
+    store = ConversionStore(memory_budget=budget, spill_dir=tmp_path)
+    kept = store.put(_rows(1000, "a"))
+    store.bind("s1", "source_rows", kept)
+    dropped = store.put(_rows(1000, "b"))
+    store.put(_rows(1000, "c"))
+    store.put(_rows(1000, "d"))
+
+    metrics = store.metrics()
+    assert metrics["memoryBytes"] <= budget
+    assert (metrics["spills"], metrics["discards"]) == (1, 2)
+    assert store.get(dropped) is None
+    assert store.get(kept, "s1")[0]["code"] == "a-0"
+    assert metrics["sessions"]["s1"]["bytes"] > 0
+
+
+def test_get_refreshes_session(tmp_path):
+    store = ConversionStore(spill_dir=tmp_path)
+    key = store.put(_rows(3, "a"))
+    store.bind("s1", "source_rows", key)
+    store._last_seen["s1"] = 0.0
+    store.get(key, "s1")
+    assert store._last_seen["s1"] > 0.0
+
+
+def test_spill_dirs_are_per_process(tmp_path):
+    other = tmp_path / str(os.getppid())
+    other.mkdir()
+    (other / "live.pkl").write_bytes(b"x")
+    dead = tmp_path / "999999999"
+    dead.mkdir()
+    store = ConversionStore(spill_dir=tmp_path)
+    assert store.spill_dir == tmp_path / str(os.getpid())
+    assert (other / "live.pkl").exists()
+    assert not dead.exists()
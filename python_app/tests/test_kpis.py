@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import pytest
+
+import kpis
+from db import init_db, load_statement_cache, save_period_data
+from mapping_store import MappingSnapshot, current_snapshot
+from sample_data import build_synthetic_rows
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def test_refresh_caches_the_snapshot_used_for_the_conversion(monkeypatch):
+    save_period_data(
+        year=2032,
+        month=1,
+        filename="base",
+        exchange_rate=0.05,
+        rows=build_synthetic_rows(50, seed=7),
+        manual_mappings={},
+        uploaded_at="2026-01-01T00:00:00",
+    )
+    snapshot = current_snapshot()
+    # si la conversion tomara el mapeo vigente por su cuenta, veria esta otra version
+    newer = MappingSnapshot(snapshot.version + 1, {})
+    monkeypatch.setattr("conversion_engine.current_snapshot", lambda: newer)
+
+    entry = next(e for e in load_statement_cache() if e["periodKey"] == "2032-01")
+    line_cents, source = kpis._refresh(entry, snapshot)
+    assert source == "converted"
+
+    cached = next(e for e in load_statement_cache() if e["periodKey"] == "2032-01")
+    assert cached["mappingVersion"] == snapshot.version
+    assert cached["lineCents"] == line_cents
+    assert line_cents != kpis.statement_line_cents(kpis.convert_rows(build_synthetic_rows(50, seed=7), 0.05, snapshot=newer))
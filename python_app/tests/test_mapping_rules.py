@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from conversion_engine import convert_rows
+from mapping_rules import CompiledRules, normalize_rule
+from mapping_store import MappingSnapshot
+
+TARGET = {"pgc": "430", "pgcName": "Clientes", "grupo": "Activo", "subgrupo": "Deudores comerciales"}
+
+
+def _rule(rule_id: int, **fields) -> dict:
+    return {"id": rule_id, **TARGET, **fields}
+
+
+def _hits(rules: list[dict], codes: list[str], names: list[str] | None = None, saldos: list[int] | None = None) -> list:
+    """Id de la regla que gana en cada linea (None si ninguna)."""
+    compiled = CompiledRules(rules)
+    ranks = compiled.evaluate(codes, names or [""] * len(codes), np.asarray(saldos or [100] * len(codes), dtype=np.int64))
+    return [compiled.rules[rank]["id"] if rank < compiled.none else None for rank in ranks.tolist()]
+
+
+def test_code_range_includes_both_bounds_and_their_children():
+    rules = [_rule(1, codeFrom="4300", codeTo="4302")]
+    codes = ["4299-99", "4300", "4301-05", "4302", "4302-99-01", "4303", "43020"]
+    assert _hits(rules, codes) == [None, 1, 1, 1, 1, None, None]
+
+
+def test_prefix_rule_matches_whole_segments_only():
+    rules = [_rule(1, codeFrom="601")]
+    assert _hits(rules, ["601", "601-01", "601-01-02", "6010-01", "6011", "602"]) == [1, 1, 1, None, None, None]
+
+
+def test_sign_classes_follow_the_balance_and_zero_is_neither():
+    rules = [
+        _rule(1, codeFrom="440", sign="deudor", priority=5),
+        _rule(2, codeFrom="440", sign="acreedor", priority=5),
+        _rule(3, codeFrom="440"),
+    ]
+    assert _hits(rules, ["440-01"] * 3, saldos=[250, -250, 0]) == [1, 2, 3]
+    assert _hits(rules[:2], ["440-01"], saldos=[0]) == [None]
+
+
+def test_priority_then_lowest_id_between_code_and_name_rules():
+    name_rule = _rule(1, namePattern="cliente")
+    code_rule = _rule(2, codeFrom="430")
+    line = (["430-01"], ["Cliente nacional"])
+    # misma prioridad: gana el id menor, sea de codigo o de nombre
+    assert _hits([code_rule, name_rule], *line) == [1]
+    assert _hits([_rule(3, codeFrom="430"), _rule(4, namePattern="cliente")], *line) == [3]
+    # mas prioridad gana aunque el id sea mayor
+    assert _hits([{**code_rule, "priority": 1}, name_rule], *line) == [2]
+    assert _hits([code_rule, {**name_rule, "id": 5, "priority": 1}], *line) == [5]
+
+
+def test_rule_hits_are_reported_without_manual_mappings():
+    rules = [_rule(1, codeFrom="430"), _rule(2, namePattern="banco"), _rule(3, codeFrom="700")]
+    rows = [
+        {"_rowId": f"r{i}", "code": code, "name": name, "sid": 0.0, "sia": 0.0, "cargos": 0.0, "abonos": 0.0, "sfd": 10.0, "sfa": 0.0}
+        for i, (code, name) in enumerate(
+            [("430-01", "Cliente A"), ("430-02", "Cliente B"), ("572-01", "Banco X"), ("572-02", "Banco Y"), ("999-01", "Otra")]
+        )
+    ]
+    snapshot = MappingSnapshot(1, {}, rules=rules)
+    result = convert_rows(rows, 0.05, {"r1": TARGET}, snapshot=snapshot)
+    assert result["metadata"]["mappingRuleHits"] == {"1": 1, "2": 2, "3": 0}
+
+
+@pytest.mark.parametrize(
+    "fields, message",
+    [
+        ({"codeFrom": "430", "namePattern": "cliente"}, "no ambos"),
+        ({}, "no ambos"),
+        ({"codeFrom": "430", "sign": "positivo"}, "signo desconocido"),
+        ({"codeFrom": "430", "codeTo": "430-99"}, "mismos segmentos"),
+        ({"codeFrom": "431", "codeTo": "430"}, "mayor que codeTo"),
+        ({"namePattern": "cliente("}, "patron de nombre invalido"),
+        ({"codeFrom": "430", "pgc": ""}, "obligatorios"),
+        ({"codeFrom": "430", "priority": "alta"}, "entero"),
+    ],
+)
+def test_normalize_rule_rejects_invalid_rules(fields, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_rule(_rule(1, **fields))
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import pytest
+
+from db import init_db, load_period_data, mapping_history_fingerprint, save_period_data, save_period_delta
+from mapping_suggestions import get_suggestion_index
+
+BANK = {"pgc": "572", "pgcName": "Bancos", "grupo": "Activo", "subgrupo": "Tesoreria"}
+CASH = {"pgc": "570", "pgcName": "Caja", "grupo": "Activo", "subgrupo": "Tesoreria"}
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def test_history_index_follows_delta_mapping_updates():
+    row = {"_rowId": "row-1", "code": "9100-01", "name": "Cuenta HSBC", "sid": 0.0, "sia": 0.0, "cargos": 1.0, "abonos": 0.0, "sfd": 1.0, "sfa": 0.0}
+    save_period_data(
+        year=2033, month=1, filename="base", exchange_rate=0.05, rows=[row], manual_mappings={"row-1": CASH}, uploaded_at="2026-01-01"
+    )
+    before = mapping_history_fingerprint()
+    index = get_suggestion_index()
+    stored = load_period_data(2033, 1)
+    # mismo row_id: el guardado en delta actualiza el mapeo en su sitio (ni id ni numero de filas cambian)
+    save_period_delta(
+        year=2033,
+        month=1,
+        filename="delta",
+        exchange_rate=0.05,
+        rows=stored["rows"],
+        changed_row_ids=set(),
+        removed_row_ids=set(),
+        manual_mappings={"row-1": BANK},
+        uploaded_at="2026-01-02",
+        expected_version=stored["period"]["version"],
+    )
+    assert mapping_history_fingerprint() != before
+    refreshed = get_suggestion_index()
+    assert refreshed is not index
+    assert any(doc["mapping"]["pgc"] == "572" and doc["source"] == "historico" for doc in refreshed.documents)
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import io
+
+from openpyxl import Workbook
+
+import conversion_engine
+from conversion_engine import parse_balance
+
+HEADER = ["Cuenta", "Nombre", "SID", "SIA", "Cargos", "Abonos", "SFD", "SFA"]
+
+
+def _xlsx(sheets: dict[str, list[list]]) -> bytes:
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def test_all_sheets_skips_sheets_without_header():
+    file_bytes = _xlsx(
+        {
+            "Balanza": [HEADER, ["100-01", "Caja", 10, 0, 5, 0, 15, 0]],
+            "Notas": [["Preparado por: Juan"], ["Revisado", "si"]],
+            "Filial": [HEADER, ["200-01", "Bancos", 0, 0, 1, 0, 1, 0]],
+        }
+    )
+    parsed = parse_balance(file_bytes, all_sheets=True, workers=1)
+    assert parsed.codes == ["100-01", "200-01"]
+    assert parsed.skipped_sheets == ["Notas"]
+
+
+def test_single_sheet_keeps_fallback_scan():
+    parsed = parse_balance(_xlsx({"Hoja": [["100", "Caja", 1, 0, 0, 0, 1, 0]]}), workers=1)
+    assert parsed.codes == ["100"]
+    assert parsed.skipped_sheets == []
+
+
+def test_csv_decimal_comma_with_tab_delimiter():
+    text = "\t".join(HEADER) + "\n100-01\tCaja\t1.234,56\t0\t0\t0\t1.234,56\t0\n"
+    parsed = parse_balance(text.encode("utf-8"), workers=1)
+    assert parsed.cents[0].tolist() == [123456, 0, 0, 0, 123456, 0]
+
+
+def test_csv_decimal_point_with_semicolon_delimiter():
+    text = ";".join(HEADER) + "\n100-01;Caja;1,234.56;0.5;0;0;1234.56;0\n"
+    parsed = parse_balance(text.encode("utf-8"), workers=1)
+    assert parsed.cents[0].tolist() == [123456, 50, 0, 0, 123456, 0]
+
+
+def test_csv_byte_ranges_match_sequential(monkeypatch):
+    monkeypatch.setattr(conversion_engine, "CSV_CHUNK_BYTES", 256)
+    lines = ["Balanza de comprobacion", ",".join(HEADER)]
+    lines += [f'{100 + i}-01,"Cuenta {i}, sub",{i}.25,0,"1,000.50",0,{i},0' for i in range(200)]
+    file_bytes = "\n".join(lines).encode("utf-8")
+    sequential = parse_balance(file_bytes, workers=1)
+    parallel = parse_balance(file_bytes, workers=2)
+    assert len(sequential.codes) == 200
+    assert parallel.codes == sequential.codes
+    assert parallel.names == sequential.names
+    assert (parallel.cents == sequential.cents).all()
+    assert sequential.cents[3].tolist() == [325, 0, 100050, 0, 300, 0]
+
+
+def test_csv_quoted_newline_falls_back_to_full_read():
+    text = ",".join(HEADER) + '\n100,"Caja\nchica",1,0,0,0,1,0\n'
+    parsed = parse_balance(text.encode("utf-8"), workers=2)
+    assert parsed.names == ["Caja\nchica"]
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import pytest
+
+from db import PeriodConflictError, init_db, list_period_versions, load_period_data, save_period_data, save_period_delta
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def _row(code: str, sfd: float = 1.0) -> dict:
+    return {"code": code, "name": f"Cuenta {code}", "sid": 0.0, "sia": 0.0, "cargos": sfd, "abonos": 0.0, "sfd": sfd, "sfa": 0.0}
+
+
+def _save(year: int, month: int, codes: list[str], expected_version: int | None) -> int:
+    rows = [{**_row(c), "_rowId": f"row-{i + 1}"} for i, c in enumerate(codes)]
+    return save_period_data(
+        year=year,
+        month=month,
+        filename="base",
+        exchange_rate=0.05,
+        rows=rows,
+        manual_mappings={},
+        uploaded_at="2026-01-01T00:00:00",
+        expected_version=expected_version,
+    )
+
+
+def test_stale_full_save_raises_and_writes_nothing():
+    assert _save(2035, 1, ["100", "200"], expected_version=0) == 1
+    assert _save(2035, 1, ["100", "200", "300"], expected_version=1) == 2
+    before = load_period_data(2035, 1)
+
+    with pytest.raises(PeriodConflictError) as exc:
+        _save(2035, 1, ["999"], expected_version=1)
+    assert (exc.value.expected_version, exc.value.current_version) == (1, 2)
+    assert load_period_data(2035, 1) == before
+    assert len(list_period_versions(2035, 1)) == 2
+
+
+def test_stale_delta_save_raises_and_writes_nothing():
+    _save(2035, 2, ["100", "200"], expected_version=0)
+    _save(2035, 2, ["100", "200"], expected_version=1)
+    before = load_period_data(2035, 2)
+
+    with pytest.raises(PeriodConflictError):
+        save_period_delta(
+            year=2035,
+            month=2,
+            filename="delta",
+            exchange_rate=0.05,
+            rows=[*before["rows"], {**_row("300"), "_rowId": "row-3"}],
+            changed_row_ids={"row-3"},
+            removed_row_ids={"row-1"},
+            manual_mappings={},
+            uploaded_at="2026-01-02T00:00:00",
+            expected_version=1,
+        )
+    assert load_period_data(2035, 2) == before
+    assert len(list_period_versions(2035, 2)) == 2
+
+
+def test_expected_version_zero_fails_on_existing_period():
+    _save(2035, 3, ["100"], expected_version=0)
+    with pytest.raises(PeriodConflictError) as exc:
+        _save(2035, 3, ["200"], expected_version=0)
+    assert exc.value.current_version == 1
+    assert [r["code"] for r in load_period_data(2035, 3)["rows"]] == ["100"]
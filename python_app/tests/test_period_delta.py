@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import pytest
+
+from db import init_db, load_period_data, save_period_data, save_period_delta
+from period_delta import diff_period_rows
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def _row(code: str, sfd: float = 1.0) -> dict:
+    return {"code": code, "name": f"Cuenta {code}", "sid": 0.0, "sia": 0.0, "cargos": sfd, "abonos": 0.0, "sfd": sfd, "sfa": 0.0}
+
+
+def _save_delta(year: int, month: int, codes: list[str]) -> dict:
+    stored = load_period_data(year, month)
+    delta = diff_period_rows(stored["rows"], stored["manualMappings"], [_row(c) for c in codes])
+    return save_period_delta(
+        year=year,
+        month=month,
+        filename="delta",
+        exchange_rate=0.05,
+        rows=delta["rows"],
+        changed_row_ids=delta["changedRowIds"],
+        removed_row_ids=delta["removedRowIds"],
+        moved_row_ids=delta["movedRowIds"],
+        manual_mappings=delta["manualMappings"],
+        uploaded_at="2026-01-01T00:00:00",
+        expected_version=stored["period"]["version"],
+    )
+
+
+def _stored_codes(year: int, month: int) -> list[str]:
+    return [r["code"] for r in load_period_data(year, month)["rows"]]
+
+
+def test_delta_save_keeps_upload_order_after_insert_and_remove():
+    rows = [{**_row(c), "_rowId": f"row-{i + 1}"} for i, c in enumerate(["100", "200", "300", "400"])]
+    save_period_data(
+        year=2031, month=1, filename="base", exchange_rate=0.05, rows=rows, manual_mappings={}, uploaded_at="2026-01-01T00:00:00"
+    )
+
+    written = _save_delta(2031, 1, ["100", "150", "200", "300", "400"])
+    assert written["rowsWritten"] == 1
+    assert _stored_codes(2031, 1) == ["100", "150", "200", "300", "400"]
+
+    written = _save_delta(2031, 1, ["100", "150", "300", "400"])
+    assert written["rowsDeleted"] == 1
+    assert _stored_codes(2031, 1) == ["100", "150", "300", "400"]
+
+
+def test_delta_save_without_moves_rewrites_nothing():
+    rows = [{**_row(c), "_rowId": f"row-{i + 1}"} for i, c in enumerate(["100", "200", "300"])]
+    save_period_data(
+        year=2031, month=2, filename="base", exchange_rate=0.05, rows=rows, manual_mappings={}, uploaded_at="2026-01-01T00:00:00"
+    )
+    written = _save_delta(2031, 2, ["100", "200", "300", "400"])
+    assert (written["rowsWritten"], written["rowsReordered"]) == (1, 0)
+    assert _stored_codes(2031, 2) == ["100", "200", "300", "400"]
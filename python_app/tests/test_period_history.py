@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import pytest
+
+from db import (
+    diff_period_versions,
+    init_db,
+    list_period_versions,
+    load_period_data,
+    load_period_version,
+    pooled_conn,
+    rollback_period,
+    save_period_data,
+    save_period_delta,
+)
+from period_delta import diff_period_rows
+
+BANK = {"pgc": "572", "pgcName": "Bancos", "grupo": "Activo", "subgrupo": "Tesoreria"}
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def _row(code: str, sfd: float) -> dict:
+    return {"code": code, "name": f"Cuenta {code}", "sid": 0.0, "sia": 0.0, "cargos": sfd, "abonos": 0.0, "sfd": sfd, "sfa": 0.0}
+
+
+def _save_delta(year: int, month: int, upload: list[tuple[str, float]]) -> dict:
+    stored = load_period_data(year, month)
+    delta = diff_period_rows(stored["rows"], stored["manualMappings"], [_row(c, sfd) for c, sfd in upload])
+    return save_period_delta(
+        year=year,
+        month=month,
+        filename="delta",
+        exchange_rate=0.05,
+        rows=delta["rows"],
+        changed_row_ids=delta["changedRowIds"],
+        removed_row_ids=delta["removedRowIds"],
+        moved_row_ids=delta["movedRowIds"],
+        manual_mappings=delta["manualMappings"],
+        uploaded_at="2026-01-02T00:00:00",
+        expected_version=stored["period"]["version"],
+    )
+
+
+def _history_count(period_key: str) -> int:
+    with pooled_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM period_row_history WHERE period_key = ?", (period_key,)).fetchone()[0]
+
+
+def _by_id(payload: dict) -> tuple[dict, dict]:
+    return {r["_rowId"]: r for r in payload["rows"]}, payload["manualMappings"]
+
+
+def test_versions_round_trip_through_modify_reorder_delete_and_rollback():
+    rows = [{**_row(c, sfd), "_rowId": f"row-{i + 1}"} for i, (c, sfd) in enumerate([("100", 1.0), ("200", 2.0), ("300", 3.0), ("400", 4.0)])]
+    save_period_data(
+        year=2034, month=1, filename="base", exchange_rate=0.05, rows=rows, manual_mappings={"row-2": BANK}, uploaded_at="2026-01-01T00:00:00"
+    )
+    saved = {1: load_period_data(2034, 1)}
+    assert _history_count("2034-01") == 4
+
+    # v2: una linea modificada -> una sola linea nueva en el historial
+    _save_delta(2034, 1, [("100", 1.0), ("200", 2.0), ("300", 30.0), ("400", 4.0)])
+    saved[2] = load_period_data(2034, 1)
+    assert _history_count("2034-01") == 5
+
+    # v3: baja de 400 y 200/300 intercambiadas -> se cierra una linea y se reordena, sin lineas nuevas
+    written = _save_delta(2034, 1, [("100", 1.0), ("300", 30.0), ("200", 2.0)])
+    saved[3] = load_period_data(2034, 1)
+    assert (written["rowsDeleted"], written["rowsReordered"]) == (1, 2)
+    assert _history_count("2034-01") == 5
+
+    for version, payload in saved.items():
+        rebuilt = load_period_version(2034, 1, version)
+        assert rebuilt["period"]["version"] == version
+        assert _by_id(rebuilt) == _by_id(payload)
+    # Un reordenamiento corrige el sort_order en su sitio: el orden solo es fiable en la ultima version
+    assert load_period_version(2034, 1, 3)["rows"] == saved[3]["rows"]
+
+    diff = diff_period_versions(2034, 1, 1, 3)
+    assert diff["added"] == []
+    assert [r["_rowId"] for r in diff["removed"]] == ["row-4"]
+    assert [c["_rowId"] for c in diff["changed"]] == ["row-3"]
+    assert "sfd" in diff["changed"][0]["fields"]
+
+    # Restaurar crea una version nueva con el contenido de v1; solo se anotan las dos lineas que vuelven
+    restored = rollback_period(2034, 1, 1, uploaded_at="2026-01-03T00:00:00", expected_version=3)
+    assert restored == 4
+    versions = list_period_versions(2034, 1)
+    assert [v["version"] for v in versions] == [4, 3, 2, 1]
+    assert _by_id(load_period_version(2034, 1, 4)) == _by_id(saved[1])
+    assert _by_id(load_period_data(2034, 1)) == _by_id(saved[1])
+    assert _history_count("2034-01") == 7
+    # las versiones anteriores siguen igual tras restaurar
+    assert _by_id(load_period_version(2034, 1, 3)) == _by_id(saved[3])
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import pytest
+
+from db import init_db, load_period_data, rollback_period, save_period_data, save_period_delta, search_period_rows
+from period_delta import diff_period_rows
+
+# Codigos y nombres propios de este modulo: la BBDD de los tests la comparten todos
+ROWS = [
+    ("9871-01", "Depósito Tlaxcala", 100.0, 0.0),
+    ("9871-02", "Deposito Tlaxcala dos", 0.0, 50.25),
+    ("9872-01", "Caja Tlaxcala", 10.1, 0.0),
+]
+
+
+@pytest.fixture(autouse=True)
+def _db():
+    init_db()
+
+
+def _row(code: str, name: str, sfd: float, sfa: float) -> dict:
+    return {"code": code, "name": name, "sid": 0.0, "sia": 0.0, "cargos": sfd, "abonos": sfa, "sfd": sfd, "sfa": sfa}
+
+
+def _ids(**kwargs) -> list[str]:
+    return [r["_rowId"] for r in search_period_rows(**kwargs)["rows"]]
+
+
+@pytest.fixture
+def period() -> tuple[int, int]:
+    """Cada test guarda el periodo completo de nuevo (sustituye lo que dejara el anterior)."""
+    rows = [{**_row(*values), "_rowId": f"row-{i + 1}"} for i, values in enumerate(ROWS)]
+    save_period_data(
+        year=2036, month=1, filename="base", exchange_rate=0.05, rows=rows, manual_mappings={}, uploaded_at="2026-01-01T00:00:00"
+    )
+    return 2036, 1
+
+
+def test_text_search_ignores_accents_and_matches_word_starts(period):
+    assert _ids(text="deposito") == ["row-1", "row-2"]
+    assert _ids(text="DEPÓSITO tlax") == ["row-1", "row-2"]
+    assert _ids(text="tlaxcala dos") == ["row-2"]
+
+
+def test_code_prefix_and_saldo_range_in_cents(period):
+    assert _ids(code_prefix="9871-*") == ["row-1", "row-2"]
+    assert _ids(code_prefix="9872") == ["row-3"]
+    # saldo = sfd - sfa; los limites se comparan en centimos y son inclusivos
+    assert _ids(code_prefix="987", min_saldo=0, max_saldo=10.1) == ["row-3"]
+    assert _ids(code_prefix="987", min_saldo=10.11) == ["row-1"]
+    assert _ids(code_prefix="987", max_saldo=-50.25) == ["row-2"]
+    assert search_period_rows(code_prefix="9871-02")["rows"][0]["saldo"] == -50.25
+
+
+def test_pagination_reports_the_full_total(period):
+    first = search_period_rows(text="tlaxcala", limit=2)
+    second = search_period_rows(text="tlaxcala", limit=2, offset=2)
+    assert (first["total"], second["total"]) == (3, 3)
+    assert [r["_rowId"] for r in first["rows"] + second["rows"]] == ["row-1", "row-2", "row-3"]
+
+
+def test_index_follows_delta_saves_and_rollbacks(period):
+    stored = load_period_data(*period)
+    upload = [_row("9871-02", "Deposito Tlaxcala dos", 0.0, 50.25), _row("9872-01", "Caja Puebla", 10.1, 0.0)]
+    delta = diff_period_rows(stored["rows"], stored["manualMappings"], upload)
+    save_period_delta(
+        year=2036,
+        month=1,
+        filename="delta",
+        exchange_rate=0.05,
+        rows=delta["rows"],
+        changed_row_ids=delta["changedRowIds"],
+        removed_row_ids=delta["removedRowIds"],
+        moved_row_ids=delta["movedRowIds"],
+        manual_mappings=delta["manualMappings"],
+        uploaded_at="2026-01-02T00:00:00",
+        expected_version=stored["period"]["version"],
+    )
+    assert _ids(text="puebla") == ["row-3"]
+    assert _ids(text="tlaxcala") == ["row-2"]
+
+    rollback_period(2036, 1, stored["period"]["version"], uploaded_at="2026-01-03T00:00:00")
+    assert _ids(text="puebla") == []
+    assert _ids(text="tlaxcala") == ["row-1", "row-2", "row-3"]
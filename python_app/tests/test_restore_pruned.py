@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from conversion_engine import parse_balance, restore_pruned
+
+CSV = (
+    "Cuenta,Nombre,SID,SIA,Cargos,Abonos,SFD,SFA\n"
+    "100,Caja,1,0,0,0,1,0\n"
+    "110,Cero A,0,0,0,0,0,0\n"
+    "120,Bancos,2,0,0,0,2,0\n"
+    "130,Cero B,0,0,0,0,0,0\n"
+    "140,Clientes,3,0,0,0,3,0\n"
+).encode("utf-8")
+
+
+def _codes(rows: list[dict]) -> list[str]:
+    return [r["code"] for r in rows]
+
+
+def test_restore_pruned_round_trip():
+    parsed = parse_balance(CSV, prune_zero=True, workers=1)
+    assert _codes(parsed.rows()) == ["100", "120", "140"]
+    assert restore_pruned(parsed.rows(), parsed.pruned_rows()) == parsed.rows(include_pruned=True)
+
+
+def test_restore_pruned_after_edits():
+    parsed = parse_balance(CSV, prune_zero=True, workers=1)
+    rows = parsed.rows()
+    # se borra "Caja" y se anade una linea a mano al principio
+    edited = [{"_rowId": "row-x", "code": "090", "name": "Nueva"}, *rows[1:]]
+    assert _codes(restore_pruned(edited, parsed.pruned_rows())) == ["090", "110", "120", "130", "140"]
+
+
+def test_restore_pruned_after_delta_rebase():
+    parsed = parse_balance(CSV, prune_zero=True, workers=1)
+    # en delta las lineas toman el _rowId guardado pero conservan su posicion de lectura
+    rebased = [{**row, "_rowId": f"row-{10 + i}"} for i, row in enumerate(parsed.rows())]
+    assert _codes(restore_pruned(rebased, parsed.pruned_rows())) == ["100", "110", "120", "130", "140"]